@@ -0,0 +1,12 @@
+"""
+Benchmarks of the conversions, run locally without the Functions host.
+
+- benchmarks.workbooks generates synthetic workbooks with the structure of the fb, ff and analytical layouts.
+- benchmarks.run runs them through the same parse path as the blueprints (read_layout, transform_layout,
+  write_output) and appends the throughput and peak memory of every case to a results file, so that the
+  performance of the parser can be tracked from one change to the next.
+- benchmarks.load_test drives the http routes of a local Functions host on workbooks uploaded to Azurite
+  and compares the latency, throughput, errors and worker memory of every concurrency level with a baseline.
+
+    python -m benchmarks.run --sizes small medium --engines openpyxl calamine
+"""
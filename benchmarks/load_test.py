@@ -0,0 +1,386 @@
+"""
+Load test of the function app: the http routes of a local Functions host, on workbooks stored in Azurite.
+
+The generated workbooks (benchmarks.workbooks) are uploaded to the input storage account, then every
+concurrency level sends conversion requests from that many clients at the same time for --duration seconds.
+For every level the latency percentiles (p50, p95, p99), the throughput, the error rate and the resident
+memory of the Python workers of the host (sampled from /proc, with the processes of the parse pool) are printed
+and written to a report. A report can be saved as the baseline the next runs are compared with:
+
+    azurite --silent &
+    export DATALAKE_STORAGE=UseDevelopmentStorage=true DATALAKE_STORAGE_OUTPUT=UseDevelopmentStorage=true
+    func start &
+    python -m benchmarks.load_test --layouts fb ff analytical --sizes small --concurrency 1 2 4 8 --save-baseline
+    python -m benchmarks.load_test --layouts fb ff analytical --sizes small --concurrency 1 2 4 8 --max-regression 20
+
+The requests are sent with "force": true, so that the result cache does not skip the conversions; the
+workbooks are --files distinct workbooks per layout and size, set PARSED_CACHE_MB=0 on the host to
+measure every conversion without the parsed tables cache. The function key is read from --function-key
+or the FUNCTION_KEY environment variable, the local host does not need one.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.run import environment_info
+from benchmarks.workbooks import SIZES, generate_size
+
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(_ROOT, "benchmarks", "load_baseline.json")
+DEFAULT_RESULTS = os.path.join(_ROOT, "benchmarks", "load_results.jsonl")
+
+# command line of the Python worker processes of the Functions host
+DEFAULT_WORKER_PATTERN = r"azure_functions_worker|proxy_worker|worker\.py"
+
+
+def seed_workbooks(layouts: list, sizes: list, files: int, input_path: str, seed: int) -> list:
+    """Upload files generated workbooks per layout and size to the input path, return their names and sizes."""
+    from azure.core.exceptions import ResourceExistsError
+
+    from shared_code.layouts import LAYOUTS
+    from shared_code.storage import INPUT_CONNECTION, get_blob_service_client, split_blob_path, upload_blob
+
+    _container, _ = split_blob_path(input_path, "")
+    try:
+        get_blob_service_client(INPUT_CONNECTION).create_container(_container)
+    except ResourceExistsError:
+        pass
+
+    _workbooks = []
+    for layout in layouts:
+        # the unit of operation in the name of the file selects the layout
+        _unit = sorted(LAYOUTS[layout]["units_of_operation"])[0]
+        for size in sizes:
+            for index in range(files):
+                _file = f"loadtest_{size}_{index}_{_unit}.xlsx"
+                _content = generate_size(layout, size, seed=seed + index)
+                upload_blob(input_path, _file, _content, connection=INPUT_CONNECTION)
+                _workbooks.append({"layout": layout, "size": size, "input_file": _file, "bytes": len(_content)})
+    return _workbooks
+
+
+def output_file(input_file: str, output_format: str) -> str:
+    """The name of the output of a workbook, e.g. loadtest_small_0_DIL.csv."""
+    from shared_code.outputs import extension
+
+    return os.path.splitext(input_file)[0] + extension(output_format)
+
+
+##### worker memory #####
+
+def _read_proc(pid: int, name: str) -> str:
+    with open(f"/proc/{pid}/{name}", "rb") as f:
+        return f.read().decode(errors="replace")
+
+
+def worker_pids(pattern: str) -> set:
+    """Return the processes whose command line matches the pattern and all their descendants (Linux only)."""
+    _parents = {}
+    _matched = set()
+    _regex = re.compile(pattern)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            _stat = _read_proc(int(entry), "stat")
+            _cmdline = _read_proc(int(entry), "cmdline").replace("\0", " ")
+        except OSError:
+            continue
+        # the command name can hold spaces and parentheses, the fields after it are split from the last ")"
+        _parents[int(entry)] = int(_stat.rsplit(")", 1)[1].split()[1])
+        if _regex.search(_cmdline) and int(entry) != os.getpid():
+            _matched.add(int(entry))
+
+    _pids = set(_matched)
+    _added = True
+    while _added:
+        _children = {pid for pid, parent in _parents.items() if parent in _pids and pid not in _pids}
+        _pids |= _children
+        _added = bool(_children)
+    return _pids
+
+
+def _rss_mb(pids: set) -> float:
+    _page_size = os.sysconf("SC_PAGE_SIZE")
+    _total = 0
+    for pid in pids:
+        try:
+            _total += int(_read_proc(pid, "statm").split()[1]) * _page_size
+        except (OSError, ValueError, IndexError):
+            continue
+    return round(_total / 2**20, 1)
+
+
+class RssSampler:
+    """Sample the resident memory of the worker processes in a background thread."""
+
+    def __init__(self, pattern: str, interval: float = 0.5):
+        self.pattern = pattern
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if os.path.isdir("/proc"):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            _pids = worker_pids(self.pattern)
+            if _pids:
+                self.samples.append(_rss_mb(_pids))
+            self._stop.wait(self.interval)
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def as_dict(self) -> dict:
+        if not self.samples:
+            return {"worker_rss_mean_mb": None, "worker_rss_peak_mb": None}
+        return {
+            "worker_rss_mean_mb": round(sum(self.samples) / len(self.samples), 1),
+            "worker_rss_peak_mb": max(self.samples),
+        }
+
+
+##### requests #####
+
+def percentile(values: list, percent: float):
+    """Nearest-rank percentile of the values, None if there are none."""
+    if not values:
+        return None
+    _sorted = sorted(values)
+    _rank = max(1, -(-len(_sorted) * percent // 100))
+    return _sorted[int(_rank) - 1]
+
+
+def send_request(url: str, body: dict, timeout: float) -> tuple:
+    """Post the conversion request, return (status code, latency in seconds, error)."""
+    _request = urllib.request.Request(
+        url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}, method="POST"
+    )
+    _start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(_request, timeout=timeout) as response:
+            response.read()
+            return response.status, time.perf_counter() - _start, None
+    except urllib.error.HTTPError as e:
+        return e.code, time.perf_counter() - _start, e.read()[:200].decode(errors="replace")
+    except Exception as e:
+        return None, time.perf_counter() - _start, str(e)
+
+
+def run_level(
+    url: str, workbooks: list, concurrency: int, duration: float, request_options: dict, timeout: float,
+    worker_pattern: str
+) -> dict:
+    """Send requests from concurrency clients for duration seconds and return the statistics of the level."""
+    _lock = threading.Lock()
+    _samples = []
+    _next = [0]
+    _deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < _deadline:
+            with _lock:
+                _workbook = workbooks[_next[0] % len(workbooks)]
+                _next[0] += 1
+            _status, _latency, _error = send_request(
+                url, {**request_options, "input_file": _workbook["input_file"], "output_file": _workbook["output_file"]},
+                timeout
+            )
+            with _lock:
+                _samples.append((_status, _latency, _workbook["bytes"], _error))
+
+    _start = time.perf_counter()
+    with RssSampler(worker_pattern) as sampler, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    _elapsed = time.perf_counter() - _start
+
+    _ok = [sample for sample in _samples if sample[0] == 200]
+    _latencies = [sample[1] for sample in _ok]
+    _errors = Counter(str(sample[0]) for sample in _samples if sample[0] != 200)
+    return {
+        "concurrency": concurrency,
+        "requests": len(_samples),
+        "succeeded": len(_ok),
+        "error_rate": round(1 - len(_ok) / len(_samples), 4) if _samples else None,
+        "errors": dict(_errors),
+        "first_error": next((sample[3] for sample in _samples if sample[0] != 200), None),
+        "p50_s": _round(percentile(_latencies, 50)),
+        "p95_s": _round(percentile(_latencies, 95)),
+        "p99_s": _round(percentile(_latencies, 99)),
+        "max_s": _round(max(_latencies, default=None)),
+        "conversions_per_min": round(len(_ok) / _elapsed * 60, 1),
+        # the size of the workbooks is not known with --no-seed
+        "input_mb_per_min": round(sum(sample[2] for sample in _ok) / 2**20 / _elapsed * 60, 2) or None,
+        "elapsed_s": round(_elapsed, 1),
+        **sampler.as_dict(),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+##### baseline #####
+
+def _change(value, previous) -> str:
+    if not previous or value is None:
+        return ""
+    return f"{(value - previous) / previous * 100:+.0f}%"
+
+
+def regressions(levels: list, baseline: dict, max_regression: float) -> list:
+    """
+    Return the levels whose p95 latency, throughput or error rate are more than max_regression percent worse
+    than the baseline.
+    """
+    _baseline = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    _regressions = []
+    for level in levels:
+        _previous = _baseline.get(level["concurrency"])
+        if not _previous:
+            continue
+        if _previous["p95_s"] and level["p95_s"] and level["p95_s"] > _previous["p95_s"] * (1 + max_regression / 100):
+            _regressions.append(f"concurrency {level['concurrency']}: p95 {_previous['p95_s']}s -> {level['p95_s']}s")
+        if level["conversions_per_min"] < _previous["conversions_per_min"] * (1 - max_regression / 100):
+            _regressions.append(
+                f"concurrency {level['concurrency']}: {_previous['conversions_per_min']} -> "
+                f"{level['conversions_per_min']} conversions/min"
+            )
+        # the error rate may rise by a percentage point, e.g. a few 429 responses of the admission control
+        _error_rate = (_previous["error_rate"] or 0) * (1 + max_regression / 100) + 0.01
+        if level["error_rate"] is not None and level["error_rate"] > _error_rate:
+            _regressions.append(
+                f"concurrency {level['concurrency']}: error rate {_previous['error_rate']} -> {level['error_rate']}"
+            )
+    return _regressions
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument("--url", default="http://localhost:7071/api", help="base url of the Functions host")
+    _parser.add_argument("--route", default="http-parse-to-csv", help="route the requests are sent to")
+    _parser.add_argument("--function-key", default=os.environ.get("FUNCTION_KEY"))
+    _parser.add_argument("--layouts", nargs="+", default=list(SIZES), choices=list(SIZES))
+    _parser.add_argument("--sizes", nargs="+", default=["small"], choices=["small", "medium", "large"])
+    _parser.add_argument("--files", type=int, default=4, help="distinct workbooks per layout and size")
+    _parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4, 8])
+    _parser.add_argument("--duration", type=float, default=60, help="seconds of every concurrency level")
+    _parser.add_argument("--timeout", type=float, default=230, help="seconds before a request is an error")
+    _parser.add_argument("--input-path", default="loadtest/input")
+    _parser.add_argument("--output-path", default="loadtest/output")
+    _parser.add_argument("--engine")
+    _parser.add_argument("--output-format", default="csv")
+    _parser.add_argument("--no-seed", action="store_true", help="the workbooks are already uploaded")
+    _parser.add_argument("--seed", type=int, default=0)
+    _parser.add_argument("--worker-pattern", default=DEFAULT_WORKER_PATTERN,
+                         help="regular expression of the command line of the worker processes")
+    _parser.add_argument("--results", default=DEFAULT_RESULTS, help="json lines file the reports are appended to")
+    _parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    _parser.add_argument("--save-baseline", action="store_true", help="save this run as the baseline")
+    _parser.add_argument("--max-regression", type=float,
+                         help="exit with an error if a level is this percentage worse than the baseline")
+    _args = _parser.parse_args()
+
+    if _args.no_seed:
+        from shared_code.layouts import LAYOUTS
+
+        _workbooks = [
+            {"layout": layout, "size": size, "bytes": 0,
+             "input_file": f"loadtest_{size}_{index}_{sorted(LAYOUTS[layout]['units_of_operation'])[0]}.xlsx"}
+            for layout in _args.layouts for size in _args.sizes for index in range(_args.files)
+        ]
+    else:
+        print(f"Uploading {len(_args.layouts) * len(_args.sizes) * _args.files} workbooks to {_args.input_path}")
+        _workbooks = seed_workbooks(_args.layouts, _args.sizes, _args.files, _args.input_path, _args.seed)
+
+    _url = f"{_args.url.rstrip('/')}/{_args.route}"
+    if _args.function_key:
+        _url += f"?code={_args.function_key}"
+    _request_options = {
+        "input_path": _args.input_path,
+        "output_path": _args.output_path,
+        "output_format": _args.output_format,
+        "force": True,
+    }
+    if _args.engine:
+        _request_options["engine"] = _args.engine
+    # the output binding of the routes needs the output_file, every workbook is converted to its own output
+    for workbook in _workbooks:
+        workbook["output_file"] = output_file(workbook["input_file"], _args.output_format)
+
+    _baseline = {}
+    if os.path.exists(_args.baseline):
+        with open(_args.baseline) as baseline:
+            _baseline = json.load(baseline)
+    _previous = {level["concurrency"]: level for level in _baseline.get("levels", [])}
+
+    print(f"{'concurrency':>11} {'requests':>8} {'errors':>7} {'p50':>7} {'p95':>7} {'change':>7} {'p99':>7} "
+          f"{'conv/min':>9} {'change':>7} {'rss peak':>9}")
+    _levels = []
+    for concurrency in _args.concurrency:
+        _level = run_level(
+            _url, _workbooks, concurrency, _args.duration, _request_options, _args.timeout, _args.worker_pattern
+        )
+        _levels.append(_level)
+        _last = _previous.get(concurrency, {})
+        print(
+            f"{concurrency:>11} {_level['requests']:>8} {_level['error_rate'] or 0:>7.1%} "
+            f"{_level['p50_s'] or 0:>6.2f}s {_level['p95_s'] or 0:>6.2f}s {_change(_level['p95_s'], _last.get('p95_s')):>7} "
+            f"{_level['p99_s'] or 0:>6.2f}s {_level['conversions_per_min']:>9} "
+            f"{_change(_level['conversions_per_min'], _last.get('conversions_per_min')):>7} "
+            f"{_level['worker_rss_peak_mb'] or '-':>7}MB"
+        )
+        if _level["first_error"]:
+            print(f"{'':>11} first error: {_level['first_error']}")
+        sys.stdout.flush()
+
+    _report = {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "url": _args.url,
+        "route": _args.route,
+        "layouts": _args.layouts,
+        "sizes": _args.sizes,
+        "files": _args.files,
+        "duration_s": _args.duration,
+        "output_format": _args.output_format,
+        "engine": _args.engine,
+        "levels": _levels,
+        **environment_info(),
+    }
+    with open(_args.results, "a") as results:
+        results.write(json.dumps(_report) + "\n")
+    if _args.save_baseline:
+        with open(_args.baseline, "w") as baseline:
+            json.dump(_report, baseline, indent=2)
+        print(f"Baseline saved to {_args.baseline}")
+
+    if _args.max_regression is not None and _baseline:
+        _regressions = regressions(_levels, _baseline, _args.max_regression)
+        for regression in _regressions:
+            print(f"REGRESSION {regression}")
+        if _regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Run the synthetic workbooks through the parse path of the blueprints and record the throughput
+and the peak memory of every case.
+
+Every case (layout, size, engine, output format) runs in a fresh interpreter, so that its peak resident
+memory is not hidden by the previous cases, and is repeated --repeat times; the median wall times are kept.
+Each case is appended as one json line to the results file with the commit and the library versions,
+and compared with the last recorded run of the same case:
+
+    python -m benchmarks.run --layouts fb ff --sizes small medium large --engines openpyxl calamine
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.workbooks import SIZES, generate_size
+
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS = os.path.join(_ROOT, "benchmarks", "results.jsonl")
+
+
+def run_case(blob_content: bytes, layout: str, engine: str, output_format: str, repeat: int) -> dict:
+    """Parse, transform and serialize the workbook repeat times, return the median stage times and the memory."""
+    import io
+    import tracemalloc
+
+    from shared_code.instrumentation import StageTimer, peak_rss_mb, rss_mb
+    from shared_code.layouts import read_layout, transform_layout
+    from shared_code.outputs import resolve_output, write_output
+
+    _format, _compression = resolve_output(output_format)
+    # import the libraries before measuring the baseline memory
+    read_layout(blob_content, layout, engine)
+    _baseline_rss_mb = rss_mb()
+
+    _runs = []
+    tracemalloc.start()
+    for _ in range(repeat):
+        tracemalloc.reset_peak()
+        _timer = StageTimer()
+        with _timer.stage("read_excel"):
+            _df = read_layout(blob_content, layout, engine)
+        with _timer.stage("transform"):
+            _df = transform_layout(_df, layout)
+        with _timer.stage("serialize"):
+            _buffer = io.BytesIO()
+            write_output(_df, _buffer, _format, _compression)
+        _timings = _timer.as_dict()
+        _timings["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        _runs.append(_timings)
+    tracemalloc.stop()
+
+    _result = {
+        "output_shape": list(_df.shape),
+        "output_bytes": _buffer.tell(),
+        "baseline_rss_mb": _baseline_rss_mb,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_traced_mb": max(run["peak_traced_mb"] for run in _runs),
+    }
+    for stage in ("read_excel", "transform", "serialize"):
+        _result[f"{stage}_s"] = round(statistics.median(run[stage]["wall_s"] for run in _runs), 4)
+    _result["total_s"] = round(statistics.median(run["total_s"] for run in _runs), 4)
+    return _result
+
+
+def _run_isolated(*args) -> dict:
+    """Run a case in a new interpreter and return its result."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_case, *args).result()
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info() -> dict:
+    from importlib.metadata import PackageNotFoundError, version
+
+    from shared_code.layouts import PARSER_VERSION
+
+    _info = {
+        "commit": _git_commit(),
+        "parser_version": PARSER_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+    for package in ("pandas", "openpyxl", "python-calamine", "pyarrow"):
+        try:
+            _info[package] = version(package)
+        except PackageNotFoundError:
+            _info[package] = None
+    return _info
+
+
+def _previous_results(results_file: str) -> dict:
+    """Last recorded result of every case of the results file."""
+    _previous = {}
+    if not os.path.exists(results_file):
+        return _previous
+    with open(results_file) as results:
+        for line in results:
+            if line.strip():
+                _record = json.loads(line)
+                _previous[_record["case"]] = _record
+    return _previous
+
+
+def _change(value, previous) -> str:
+    if not previous or value is None:
+        return ""
+    return f"{(value - previous) / previous * 100:+.0f}%"
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument("--layouts", nargs="+", default=list(SIZES), choices=list(SIZES))
+    _parser.add_argument("--sizes", nargs="+", default=["small", "medium"], choices=["small", "medium", "large"])
+    _parser.add_argument("--engines", nargs="+", default=["openpyxl"])
+    _parser.add_argument("--output-formats", nargs="+", default=["csv"])
+    _parser.add_argument("--repeat", type=int, default=3)
+    _parser.add_argument("--seed", type=int, default=0)
+    _parser.add_argument("--results", default=DEFAULT_RESULTS, help="json lines file the results are appended to")
+    _parser.add_argument("--save-workbooks", help="folder to write the generated workbooks to")
+    _args = _parser.parse_args()
+
+    _environment = environment_info()
+    _previous = _previous_results(_args.results)
+    _started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    print(f"{'case':<40} {'cells':>8} {'total':>8} {'change':>7} {'cells/s':>10} {'MB/s':>6} {'peak rss':>9} {'traced':>7}")
+    for layout in _args.layouts:
+        for size in _args.sizes:
+            _blob_content = generate_size(layout, size, seed=_args.seed)
+            _rows, _columns = SIZES[layout][size]
+            if _args.save_workbooks:
+                os.makedirs(_args.save_workbooks, exist_ok=True)
+                with open(os.path.join(_args.save_workbooks, f"{layout}_{size}.xlsx"), "wb") as workbook:
+                    workbook.write(_blob_content)
+
+            for engine in _args.engines:
+                for output_format in _args.output_formats:
+                    _case = f"{layout}/{size}/{engine}/{output_format}"
+                    _result = _run_isolated(_blob_content, layout, engine, output_format, _args.repeat)
+                    _record = {
+                        "case": _case,
+                        "layout": layout,
+                        "size": size,
+                        "engine": engine,
+                        "output_format": output_format,
+                        "cells": _rows * _columns,
+                        "input_bytes": len(_blob_content),
+                        "repeat": _args.repeat,
+                        **_result,
+                        "cells_per_s": round(_rows * _columns / _result["total_s"]),
+                        "mb_per_s": round(len(_blob_content) / 2**20 / _result["total_s"], 2),
+                        "started_at": _started_at,
+                        **_environment,
+                    }
+                    with open(_args.results, "a") as results:
+                        results.write(json.dumps(_record) + "\n")
+
+                    _last = _previous.get(_case, {})
+                    print(
+                        f"{_case:<40} {_record['cells']:>8} {_result['total_s']:>7.3f}s "
+                        f"{_change(_result['total_s'], _last.get('total_s')):>7} {_record['cells_per_s']:>10} "
+                        f"{_record['mb_per_s']:>6} {_result['peak_rss_mb']:>7}MB {_result['peak_traced_mb']:>5}MB"
+                    )
+                    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
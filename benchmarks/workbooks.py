@@ -0,0 +1,139 @@
+"""
+Synthetic workbooks with the structure of the layouts of shared_code.layouts.
+
+- fb: a header row, 2 rows skipped by the reader, 6 leading columns, the experiment ids on the first
+  table row (some of them "Template" experiments or empty) and one process parameter per row,
+  some of them "↑"/"↓" parameters dropped by the transformation.
+- ff: a title row, 6 header rows, the header row with "Parameter name pivot", "↑"/"↓" and non text columns,
+  then one experiment per row with "---" and "Insert" rows dropped by the transformation.
+- analytical: 4 header rows, the header row and one sample per row with the Spalte_Compiling_Timestamp
+  column holding timestamps, text dates and invalid values.
+
+The workbooks are written with openpyxl in write_only mode and are deterministic for a given seed.
+"""
+
+import datetime
+import io
+import random
+
+
+# (rows, columns) of the table of each layout for the size presets, from ~10k to ~500k cells
+SIZES = {
+    "fb": {"small": (100, 100), "medium": (500, 200), "large": (1000, 500)},
+    "ff": {"small": (250, 40), "medium": (2500, 40), "large": (12500, 40)},
+    "analytical": {"small": (1000, 10), "medium": (10000, 10), "large": (50000, 10)},
+}
+
+
+def _value(rng: random.Random, day: int):
+    """A random process value: empty, integer, float, text, date or boolean."""
+    _kind = rng.random()
+    if _kind < 0.15:
+        return None
+    if _kind < 0.45:
+        return rng.randint(0, 1000)
+    if _kind < 0.8:
+        return round(rng.random() * 100, 4)
+    if _kind < 0.9:
+        return rng.choice(["ok", "n.a.", "see comment"])
+    if _kind < 0.97:
+        return datetime.datetime(2024, 1, 1) + datetime.timedelta(days=day, minutes=rng.randint(0, 1440))
+    return rng.random() < 0.5
+
+
+def fb_rows(n_parameters: int, n_experiments: int, seed: int = 0):
+    """Yield the rows of a fb sheet with n_parameters rows and n_experiments columns."""
+    _rng = random.Random(seed)
+    yield [f"Meta {i}" for i in range(6)] + ["Parameter"] + [f"Column {i}" for i in range(n_experiments)]
+    yield ["Unit"] * 6 + ["Version"] + [1] * n_experiments
+    yield [None] * 6 + ["Status"] + [_rng.choice(["done", "planned", None]) for _ in range(n_experiments)]
+    _experiments = []
+    for i in range(n_experiments):
+        if i % 25 == 0:
+            _experiments.append(f"Template {i}")
+        elif i % 40 == 39:
+            _experiments.append(None)
+        else:
+            _experiments.append(f"EXP-{i:05d}")
+    yield [None] * 6 + ["Experiment"] + _experiments
+    for p in range(n_parameters):
+        if p % 10 == 3:
+            _name = f"↑ parameter {p}"
+        elif p % 10 == 7:
+            _name = f"↓ parameter {p}"
+        else:
+            _name = f"parameter {p}"
+        yield [_rng.choice([None, "m"]) for _ in range(6)] + [_name] + [
+            _value(_rng, e % 365) for e in range(n_experiments)
+        ]
+
+
+def ff_rows(n_experiments: int, n_parameters: int, seed: int = 0):
+    """Yield the rows of a ff sheet with n_experiments rows and n_parameters columns."""
+    _rng = random.Random(seed)
+    yield ["Fill and finish export"]
+    for i in range(6):
+        yield [None, f"Info {i}"] + [_rng.choice([None, "x", 3]) for _ in range(n_parameters)]
+    _header = [None, "Parameter name pivot"]
+    for c in range(n_parameters):
+        if c % 10 == 2:
+            _header.append(f"↓ parameter {c}")
+        elif c % 10 == 5:
+            _header.append(f"↑ parameter {c}")
+        elif c % 20 == 9:
+            _header.append(c)
+        else:
+            _header.append(f"parameter {c}")
+    yield _header
+    for i in range(n_experiments):
+        if i % 50 == 49:
+            _id = "---"
+        elif i % 50 == 48:
+            _id = "Insert row"
+        elif i % 100 == 47:
+            _id = None
+        else:
+            _id = f"EXP-{i:05d}"
+        yield [_rng.choice([None, 1]), _id] + [_value(_rng, i % 365) for _ in range(n_parameters)]
+
+
+def analytical_rows(n_samples: int, n_columns: int, seed: int = 0):
+    """Yield the rows of an analytical sheet with n_samples rows and n_columns columns."""
+    _rng = random.Random(seed)
+    yield ["Analytical results"]
+    yield []
+    yield ["Generated", datetime.datetime(2024, 6, 1)]
+    yield [None, None, "compiled export"]
+    yield ["Sample", "Spalte_Compiling_Timestamp"] + [f"Result {c}" for c in range(n_columns - 2)]
+    for i in range(n_samples):
+        _kind = _rng.random()
+        if _kind < 0.8:
+            _timestamp = datetime.datetime(2024, 3, 1) + datetime.timedelta(minutes=i)
+        elif _kind < 0.9:
+            _timestamp = "2024-02-02 10:00"
+        elif _kind < 0.95:
+            _timestamp = "not a date"
+        else:
+            _timestamp = None
+        yield [f"S{i:06d}", _timestamp] + [_value(_rng, i % 365) for _ in range(n_columns - 2)]
+
+
+ROWS = {"fb": fb_rows, "ff": ff_rows, "analytical": analytical_rows}
+
+
+def generate(layout: str, rows: int, columns: int, seed: int = 0) -> bytes:
+    """Return a workbook of the layout with a table of rows x columns cells."""
+    from openpyxl import Workbook
+
+    _workbook = Workbook(write_only=True)
+    _sheet = _workbook.create_sheet("Data")
+    for row in ROWS[layout](rows, columns, seed):
+        _sheet.append(row)
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    return _buffer.getvalue()
+
+
+def generate_size(layout: str, size: str, seed: int = 0) -> bytes:
+    """Return a workbook of the layout for one of the SIZES presets."""
+    return generate(layout, *SIZES[layout][size], seed=seed)
@@ -0,0 +1,36 @@
+"""
+This function app blueprint is used to parse an excel file to a csv file, whatever its layout.
+The layout (fb, ff, analytical) is found from the unit of operation in the name of the input file and the
+workbook is converted with the execution plan of the layout, see shared_code/layouts.py.
+New unit of operation templates are added to shared_code.layouts.LAYOUT_SPECS, not as new functions.
+"""
+
+import azure.functions as func
+from shared_code import admission
+from shared_code.http_conversion import convert_request
+
+
+bp = func.Blueprint()
+
+
+@bp.route(route="http-parse-to-csv")
+
+@bp.blob_input(
+    arg_name="excelfile",
+    path="{input_path}/{input_file}",
+    connection="DATALAKE_STORAGE",
+    data_type="binary"
+)
+
+@bp.blob_output(
+    arg_name="outputblob",
+    path="{output_path}/{output_file}",
+    connection="DATALAKE_STORAGE_OUTPUT",
+    data_type="binary"
+)
+
+# wait for enough memory before converting, the cost depends on the layout found from the input file
+@admission.admitted()
+
+def http_parse_to_csv(req: func.HttpRequest, excelfile: func.InputStream, outputblob: func.Out[func.InputStream]) -> func.HttpResponse:
+    return convert_request(req, excelfile, outputblob, function_name="http_parse_to_csv")
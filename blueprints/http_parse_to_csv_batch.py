@@ -0,0 +1,216 @@
+"""
+This function app blueprint is used to parse many excel files to csv files in a single request.
+Each item of the request is dispatched to its layout (fb, ff or analytical) from the unit of operation
+found in the file name, the items are downloaded, parsed and uploaded concurrently by a bounded thread pool.
+"""
+
+import azure.functions as func
+import logging
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from shared_code import admission, layout_detection, parsed_cache
+from shared_code.excel_engines import resolve_engine
+from shared_code.http_conversion import convert_content, detect_template, read_request, resolve_options
+from shared_code.instrumentation import StageTimer
+from shared_code.layouts import find_layout
+from shared_code.outputs import extension, resolve_compression_level, resolve_output
+from shared_code.storage import INPUT_CONNECTION, download_blob_ranged, get_blob_properties
+
+
+bp = func.Blueprint()
+
+
+# upper bound of the worker pool, whatever the request asks for
+_max_workers = int(os.environ.get("BATCH_MAX_WORKERS", 4))
+
+
+def resolve_max_workers(max_workers=None) -> int:
+    """Return the number of workers a request asks for, the BATCH_MAX_WORKERS app setting by default."""
+    _workers = _max_workers if max_workers is None else max_workers
+    if isinstance(_workers, bool) or not isinstance(_workers, int) or _workers <= 0:
+        raise ValueError(f"max_workers must be a positive number of workers, got {max_workers!r}")
+    return min(_workers, _max_workers)
+
+
+def convert_item(
+    item: dict, engine: str, output_format: str = "csv", output_compression: str = "none", force: bool = False,
+    output_compression_level: int = None
+) -> dict:
+    """Download, parse and upload a single item of the batch and return its result."""
+    if not isinstance(item, dict):
+        item = {}
+    input_path = item.get("input_path")
+    input_file = item.get("input_file")
+    output_path = item.get("output_path")
+    output_file = item.get("output_file")
+
+    _result = {
+        "input_file": input_file,
+        "input_path": input_path,
+        "output_path": output_path,
+        "output_file": output_file
+    }
+    _timer = StageTimer()
+
+    if None in {input_path, input_file, output_path}:
+        _result["error"] = "MANDATORY PARAMETERS ARE MISSING"
+        _result["status_code"] = 400
+        return _result
+
+    # default output file: the input file name with the extension of the output format
+    if output_file is None:
+        output_file = os.path.splitext(input_file)[0] + extension(output_format, output_compression)
+        _result["output_file"] = output_file
+
+    _layout = find_layout(input_file)
+    _result["layout"] = _layout
+    if _layout is None:
+        _result["error"] = "The input file is not a valid file for this function"
+        _result["status_code"] = 400
+        return _result
+
+    # the size and the version of the blob, to admit the conversion and to find its parsed table
+    try:
+        with _timer.stage("blob_properties"):
+            _properties = get_blob_properties(input_path, input_file)
+    except Exception as e:
+        _result["error"] = f"Failed to read blob: {str(e)}"
+        _result["status_code"] = 406
+        return _result
+
+    # the item is converted like a request of the http-parse-to-csv route, its output is staged to the blob
+    conversion = read_request({
+        "input_path": input_path, "input_file": input_file, "output_path": output_path, "output_file": output_file,
+        "engine": engine, "output_format": output_format, "output_compression": output_compression,
+        "output_compression_level": output_compression_level, "force": item.get("force", force),
+        "stream_output": True,
+    }, "http_parse_to_csv_batch")
+    conversion["layout"] = _layout
+
+    # wait for enough memory before downloading and converting the workbook
+    try:
+        with admission.admit(_properties.size, _layout):
+            _result.update(_convert_blob(conversion, _properties.etag, _timer))
+    except admission.AdmissionRejected as e:
+        _result["error"] = f"TOO MANY CONVERSIONS: {e}"
+        _result["status_code"] = 429
+        _result["retry_after"] = e.retry_after
+        return _result
+    # the rows of the items are not returned, only their number
+    _result.pop("first_5_rows", None)
+    return _result
+
+
+def _convert_blob(conversion: dict, _etag: str, _timer: StageTimer) -> dict:
+    """
+    Download an admitted item of the batch and convert it through the paths of http_conversion.convert_content,
+    return its result.
+    """
+    input_path = conversion["input_path"]
+    input_file = conversion["input_file"]
+
+    ##### read from blob #####
+    # the blob is not downloaded again if the table of this version of the blob is still cached,
+    # concurrent requests for the same version share a single download
+    _source = (INPUT_CONNECTION, input_path, input_file)
+
+    def download():
+        _content = download_blob_ranged(input_path, input_file, etag=_etag)
+        if not _content:
+            raise ValueError("Blob content is empty")
+        return _content, parsed_cache.content_hash(_content)
+
+    blob_content = None
+    try:
+        with _timer.stage("read_blob"):
+            _blob_hash = parsed_cache.hash_for_etag(_source, _etag)
+            # the template of the workbook is detected from its content, it is always downloaded
+            _detected = layout_detection.is_enabled()
+            if _blob_hash is None or _detected or not parsed_cache.is_cached(
+                _blob_hash, conversion["layout"], conversion["engine"]
+            ):
+                blob_content, _blob_hash = parsed_cache.coalesce(("download", _source, _etag), download)
+                parsed_cache.remember_etag(_source, _etag, _blob_hash)
+    except Exception as e:
+        return {"error": f"Failed to read blob: {str(e)}", "status_code": 406}
+    conversion["blob_hash"] = _blob_hash
+
+    # the template of the workbook is detected from its header region, see shared_code/layout_detection.py
+    if layout_detection.is_enabled():
+        detect_template(conversion, blob_content, _timer)
+
+    try:
+        resolve_options(conversion)
+    except ValueError as e:
+        return {"error": str(e), "status_code": 400}
+
+    def load_content():
+        # the cached table was evicted since the lookup
+        return blob_content if blob_content is not None else download()[0]
+
+    return convert_content(conversion, load_content, None, _timer)
+
+
+@bp.route(route="http-parse-to-csv-batch")
+
+def http_parse_to_csv_batch(req: func.HttpRequest) -> func.HttpResponse:
+    _result = {}
+    logging.info("Python HTTP trigger function processed a batch request.")
+
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        req_body = {}
+
+    if not isinstance(req_body, dict):
+        _result["error"] = "The request body must be a JSON object"
+        _result["status_code"] = 400
+        return func.HttpResponse(json.dumps(_result, indent=4), mimetype="application/json", status_code=400)
+
+    items = req_body.get("items")
+    if not items or not isinstance(items, list):
+        _result["error"] = "MANDATORY PARAMETERS ARE MISSING"
+        _result["status_code"] = 400
+        return func.HttpResponse(json.dumps(_result, indent=4), mimetype="application/json", status_code=400)
+
+    try:
+        engine = resolve_engine(req_body.get("engine"))
+        output_format, output_compression = resolve_output(
+            req_body.get("output_format"), req_body.get("output_compression")
+        )
+        output_compression_level = resolve_compression_level(
+            output_compression, req_body.get("output_compression_level")
+        )
+        force = req_body.get("force", False)
+        max_workers = resolve_max_workers(req_body.get("max_workers"))
+    except ValueError as e:
+        _result["error"] = str(e)
+        _result["status_code"] = 400
+        return func.HttpResponse(json.dumps(_result), status_code=400, mimetype = "application/json")
+
+    _workers = min(max_workers, len(items))
+    logging.info(f"Converting {len(items)} files with {_workers} workers")
+
+    _start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=_workers) as executor:
+        _items = list(executor.map(
+            lambda item: convert_item(item, engine, output_format, output_compression, force, output_compression_level),
+            items
+        ))
+
+    _failed = sum(1 for item in _items if item["status_code"] != 200)
+    _result["status_code"] = 200 if not _failed else 207
+    _result["message"] = "SUCCESS" if not _failed else "SOME FILES FAILED"
+    _result["succeeded"] = len(_items) - _failed
+    _result["failed"] = _failed
+    _result["total_seconds"] = round(time.perf_counter() - _start, 3)
+    _result["items"] = _items
+
+    # the items rejected by the admission control can be sent again later
+    _retry_after = [item["retry_after"] for item in _items if item["status_code"] == 429]
+    _headers = {"Retry-After": str(max(_retry_after))} if _retry_after else None
+    return func.HttpResponse(
+        json.dumps(_result, indent=4), mimetype="application/json", status_code=_result["status_code"], headers=_headers
+    )
@@ -0,0 +1,274 @@
+"""
+This function app blueprint consolidates many excel files of the same layout into a partitioned parquet dataset,
+instead of writing one csv per file. The workbooks are downloaded and parsed concurrently like the items of the
+batch route, their tables are appended to the dataset partitioned by unit of operation and date, with the
+lineage of their workbook on every row, see shared_code/dataset.py. The rows of a workbook are handed to the
+part file of its partition while the workbook is admitted, they are not kept until the end of the request.
+"""
+
+import azure.functions as func
+import datetime
+import logging
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from shared_code import admission, dataset, layout_detection, parsed_cache
+from shared_code.excel_engines import resolve_engine
+from shared_code.http_conversion import LoadError, detect_template, load_table
+from shared_code.instrumentation import StageTimer
+from shared_code.layouts import LAYOUTS, find_unit
+from shared_code.outputs import resolve_compression_level, resolve_output
+from shared_code.storage import download_blob_ranged, get_blob_properties, list_blob_names
+from blueprints.http_parse_to_csv_batch import resolve_max_workers
+
+
+bp = func.Blueprint()
+
+
+def is_layout_file(input_file: str, layout: str) -> bool:
+    """Return True if the unit of operation of the file, the longest one found in its name, is one of the layout."""
+    return find_unit(input_file) in LAYOUTS[layout]["units_of_operation"]
+
+
+def load_item(
+    input_path: str, input_file: str, layout: str, engine: str, output_path: str, partition_date: str,
+    ingested_at: datetime.datetime, force: bool, partitions: "Partitions"
+) -> dict:
+    """
+    Download, parse and transform a workbook of the dataset and append its rows to the part file of its
+    partition, return its result.
+    """
+    _result = {
+        "input_file": input_file,
+        "input_path": input_path
+    }
+    _timer = StageTimer()
+
+    if not is_layout_file(input_file, layout):
+        _result["error"] = f"The input file is not a {layout} file"
+        _result["status_code"] = 400
+        return _result
+
+    try:
+        with _timer.stage("blob_properties"):
+            _properties = get_blob_properties(input_path, input_file)
+    except Exception as e:
+        _result["error"] = f"Failed to read blob: {str(e)}"
+        _result["status_code"] = 406
+        return _result
+
+    try:
+        with admission.admit(_properties.size, layout):
+            try:
+                with _timer.stage("read_blob"):
+                    blob_content = download_blob_ranged(input_path, input_file, etag=_properties.etag)
+                if not blob_content:
+                    raise ValueError("Blob content is empty")
+            except Exception as e:
+                _result["error"] = f"Failed to read blob: {str(e)}"
+                _result["status_code"] = 406
+                return _result
+
+            # Skip the workbooks already in the dataset with the same content.
+            _blob_hash = parsed_cache.content_hash(blob_content)
+            if not force:
+                with _timer.stage("cache_lookup"):
+                    _consolidated = dataset.is_consolidated(output_path, layout, _blob_hash)
+                if _consolidated:
+                    _result["status_code"] = 200
+                    _result["message"] = "SUCCESS"
+                    _result["cache"] = "hit"
+                    _result["timings"] = _timer.as_dict()
+                    return _result
+
+            # the template of the workbook is detected from its header region, the markers of the dataset keep
+            # the layout of the request
+            _conversion = {
+                "input_file": input_file, "layout": layout, "engine": engine, "blob_hash": _blob_hash,
+                "detection": None
+            }
+            if layout_detection.is_enabled():
+                detect_template(_conversion, blob_content, _timer)
+                _result["layout"] = _conversion["layout"]
+
+            try:
+                _df, _parsed = load_table(_conversion, lambda: blob_content, _timer)
+            except LoadError as e:
+                _result["error"] = e.error
+                _result["status_code"] = e.status_code
+                return _result
+
+            try:
+                _modified = _properties.last_modified or ingested_at
+                _lineage = dataset.lineage_of(input_path, input_file, _blob_hash, _modified, ingested_at)
+                _table = dataset.with_lineage(_df, _lineage)
+                del _df
+                _partition = dataset.partition_of(
+                    find_unit(input_file), _modified if partition_date == "modified" else ingested_at
+                )
+                # the rows are written, or buffered up to a row group, while the workbook is admitted
+                with _timer.stage("write_output"):
+                    _part_file = partitions.writer(_partition).append(_table, _lineage)
+            except Exception as e:
+                logging.error(e)
+                _result["error"] = "Error parsing the data frame"
+                _result["status_code"] = 500
+                return _result
+    except admission.AdmissionRejected as e:
+        _result["error"] = f"TOO MANY CONVERSIONS: {e}"
+        _result["status_code"] = 429
+        _result["retry_after"] = e.retry_after
+        return _result
+
+    # the status of the workbook is the status of its part file, known once the partition is closed
+    _result["status_code"] = 200
+    _result["rows"] = len(_table)
+    _result["cache"] = "miss"
+    _result["parsed"] = _parsed
+    _result["partition"] = _partition
+    _result["output_file"] = f"{_partition}/{_part_file}"
+    _result["timings"] = _timer.as_dict()
+    return _result
+
+
+class Partitions:
+    """The PartitionWriter of every partition of a request, created by the first workbook of the partition."""
+
+    def __init__(self, output_path: str, layout: str, ingested_at: datetime.datetime, **options):
+        self._output_path = output_path
+        self._layout = layout
+        self._ingested_at = ingested_at
+        self._options = options
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def writer(self, partition: str) -> dataset.PartitionWriter:
+        with self._lock:
+            if partition not in self._writers:
+                self._writers[partition] = dataset.PartitionWriter(
+                    self._output_path, partition, self._layout, self._ingested_at, **self._options
+                )
+            return self._writers[partition]
+
+    def close(self) -> list:
+        """Close the part files of every partition, return their results."""
+        return [part for partition in sorted(self._writers) for part in self._writers[partition].close()]
+
+
+@bp.route(route="http-parse-to-dataset")
+
+def http_parse_to_dataset(req: func.HttpRequest) -> func.HttpResponse:
+    _result = {}
+    logging.info("Python HTTP trigger function processed a dataset request.")
+
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        req_body = {}
+
+    if not isinstance(req_body, dict):
+        _result["error"] = "The request body must be a JSON object"
+        _result["status_code"] = 400
+        return func.HttpResponse(json.dumps(_result, indent=4), mimetype="application/json", status_code=400)
+
+    layout = req_body.get("layout")
+    input_path = req_body.get("input_path")
+    input_files = req_body.get("input_files")
+    output_path = req_body.get("output_path")
+    if None in {layout, input_path, output_path}:
+        _result["error"] = "MANDATORY PARAMETERS ARE MISSING"
+        _result["status_code"] = 400
+        return func.HttpResponse(json.dumps(_result, indent=4), mimetype="application/json", status_code=400)
+
+    try:
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout '{layout}', expected one of {sorted(LAYOUTS)}")
+        if input_files is not None and not (isinstance(input_files, list) and input_files):
+            raise ValueError("input_files must be a non empty list of file names")
+        engine = resolve_engine(req_body.get("engine"))
+        _, output_compression = resolve_output("parquet", req_body.get("output_compression"))
+        output_compression_level = resolve_compression_level(
+            output_compression, req_body.get("output_compression_level")
+        )
+        row_group_rows = dataset.resolve_row_group_rows(req_body.get("row_group_rows"))
+        partition_date = dataset.resolve_partition_date(req_body.get("partition_date"))
+        force = req_body.get("force", False)
+        max_workers = resolve_max_workers(req_body.get("max_workers"))
+    except ValueError as e:
+        _result["error"] = str(e)
+        _result["status_code"] = 400
+        return func.HttpResponse(json.dumps(_result), status_code=400, mimetype = "application/json")
+
+    # without input_files, every workbook of the layout in the input folder
+    if input_files is None:
+        try:
+            input_files = sorted(name for name in list_blob_names(input_path) if is_layout_file(name, layout))
+        except Exception as e:
+            _result["error"] = f"Failed to list the input folder: {str(e)}"
+            _result["status_code"] = 406
+            return func.HttpResponse(json.dumps(_result, indent=4), mimetype="application/json", status_code=406)
+        if not input_files:
+            _result["error"] = f"No {layout} file in {input_path}"
+            _result["status_code"] = 406
+            return func.HttpResponse(json.dumps(_result, indent=4), mimetype="application/json", status_code=406)
+
+    _ingested_at = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+    _workers = min(max_workers, len(input_files))
+    logging.info(f"Consolidating {len(input_files)} {layout} files with {_workers} workers")
+
+    _timer = StageTimer()
+    _start = time.perf_counter()
+    _partitions = Partitions(
+        output_path, layout, _ingested_at, output_compression=output_compression,
+        output_compression_level=output_compression_level, row_group_rows=row_group_rows
+    )
+    with _timer.stage("convert"), ThreadPoolExecutor(max_workers=_workers) as executor:
+        _items = list(executor.map(
+            lambda input_file: load_item(
+                input_path, input_file, layout, engine, output_path, partition_date, _ingested_at, force, _partitions
+            ),
+            input_files
+        ))
+    with _timer.stage("write_output"):
+        _parts = _partitions.close()
+
+    # the items of a part file that failed failed too
+    _part_results = {f"{part['partition']}/{part['output_file']}": part for part in _parts}
+    for item in _items:
+        _part = _part_results.get(item.get("output_file"))
+        if _part is None:
+            continue
+        if _part["status_code"] != 200:
+            item["error"] = _part["error"]
+            item["status_code"] = _part["status_code"]
+            del item["output_file"]
+        else:
+            item["message"] = "SUCCESS"
+
+    _failed = sum(1 for item in _items if item["status_code"] != 200)
+    _result["layout"] = layout
+    _result["output_path"] = output_path
+    _result["status_code"] = 200 if not _failed else 207
+    _result["message"] = "SUCCESS" if not _failed else "SOME FILES FAILED"
+    _result["succeeded"] = len(_items) - _failed
+    _result["failed"] = _failed
+    _result["skipped"] = sum(1 for item in _items if item.get("cache") == "hit")
+    _result["rows"] = sum(part.get("rows", 0) for part in _parts)
+    _result["total_seconds"] = round(time.perf_counter() - _start, 3)
+    _result["timings"] = _timer.as_dict()
+    _result["partitions"] = _parts
+    _result["items"] = _items
+    _timer.emit(
+        "http_parse_to_dataset", layout=layout, engine=engine, files=len(_items), failed=_failed,
+        skipped=_result["skipped"], partitions=len(_parts), rows=_result["rows"],
+        **parsed_cache.stats(), **admission.stats()
+    )
+
+    # the items rejected by the admission control can be sent again later
+    _retry_after = [item["retry_after"] for item in _items if item["status_code"] == 429]
+    _headers = {"Retry-After": str(max(_retry_after))} if _retry_after else None
+    return func.HttpResponse(
+        json.dumps(_result, indent=4, default=str), mimetype="application/json", status_code=_result["status_code"],
+        headers=_headers
+    )
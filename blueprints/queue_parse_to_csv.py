@@ -0,0 +1,65 @@
+"""
+This function app blueprint converts the excel files announced on a storage queue, without an http call waiting
+for the conversion. It is opt-in: INGESTION_QUEUE=<queue name> registers the queue trigger.
+The queue is read from the storage account of the DATALAKE_STORAGE connection, its messages are either the
+BlobCreated events of the input files (Event Grid subscription with a storage queue endpoint) or conversion
+requests, see shared_code/ingestion.py. Each message is converted like an item of the batch route.
+
+The host pulls the messages in micro-batches and runs them concurrently (the "queues" settings of host.json):
+- a successful conversion deletes its message,
+- a message that can never be converted (invalid message or file, 400 and 406) is written at once to the
+  dead-letter queue <INGESTION_QUEUE>-poison with the reason of the failure,
+- the other failures are retried after the visibility timeout, the host moves the message to the same
+  dead-letter queue after maxDequeueCount attempts.
+"""
+
+import azure.functions as func
+import logging
+import os
+from shared_code import ingestion
+from shared_code.excel_engines import resolve_engine
+from shared_code.outputs import resolve_compression_level, resolve_output
+from blueprints.http_parse_to_csv_batch import convert_item
+
+
+bp = func.Blueprint()
+
+
+def convert_message(body: str, dequeue_count: int, deadletter: func.Out[str]) -> dict:
+    """Convert the message and return its result, raise to have the message retried."""
+    _result = {}
+    try:
+        item, options = ingestion.parse_message(body)
+        engine = resolve_engine(options.get("engine"))
+        output_format, output_compression = resolve_output(
+            options.get("output_format"), options.get("output_compression")
+        )
+        output_compression_level = resolve_compression_level(
+            output_compression, options.get("output_compression_level")
+        )
+    except ValueError as e:
+        _result["error"] = str(e)
+        _result["status_code"] = 400
+    else:
+        _result = convert_item(
+            item, engine, output_format, output_compression, options.get("force", False), output_compression_level
+        )
+
+    if _result["status_code"] == 200:
+        logging.info(f"Queued conversion of {_result['input_path']}/{_result['input_file']} done")
+        return _result
+    if ingestion.is_permanent(_result):
+        logging.warning(f"Queued conversion failed, message dead-lettered: {_result['error']}")
+        deadletter.set(ingestion.dead_letter(body, dequeue_count, _result))
+        return _result
+    # the message becomes visible again after the visibility timeout
+    raise RuntimeError(f"Queued conversion failed (attempt {dequeue_count}), retried: {_result.get('error')}")
+
+
+if os.environ.get("INGESTION_QUEUE"):
+    @bp.function_name(name="queue_parse_to_csv")
+    @bp.queue_trigger(arg_name="msg", queue_name="%INGESTION_QUEUE%", connection="DATALAKE_STORAGE")
+    @bp.queue_output(arg_name="deadletter", queue_name="%INGESTION_QUEUE%-poison", connection="DATALAKE_STORAGE")
+    def queue_parse_to_csv(msg: func.QueueMessage, deadletter: func.Out[str]) -> None:
+        logging.info(f"Python queue trigger function processed message {msg.id}.")
+        convert_message(msg.get_body().decode("utf-8"), msg.dequeue_count, deadletter)
@@ -0,0 +1,49 @@
+"""
+This function app blueprint warms up the workers before they serve conversions, it is opt-in:
+- WARMUP_TRIGGER=true registers a warmup trigger, run by the platform on every new instance
+  (Premium and Dedicated plans only).
+- WARMUP_SCHEDULE=<cron expression> registers a timer trigger that keeps the worker warm on the Consumption plan.
+  It only runs on its schedule: WARMUP_ON_STARTUP=true also runs it whenever a host starts, which includes every
+  scale-out and restart, Azure advises against it in production.
+See shared_code.warmup for what is warmed up. The processes of the parse pool (shared_code.process_pool),
+when it is enabled, are started and warmed up as well.
+"""
+
+import azure.functions as func
+import logging
+import os
+from shared_code import process_pool
+from shared_code.warmup import warm_up
+
+
+bp = func.Blueprint()
+
+
+def _run_warm_up():
+    try:
+        warm_up()
+        process_pool.prestart()
+    except Exception as e:
+        # a failed warm-up only means a slower first conversion
+        logging.warning(f"Warm-up failed: {e}")
+
+
+def _is_set(name: str) -> bool:
+    return os.environ.get(name, "false").lower() in ("true", "1", "yes")
+
+
+if _is_set("WARMUP_TRIGGER"):
+    @bp.function_name(name="warmup")
+    @bp.warm_up_trigger("warmup")
+    def warmup(warmup) -> None:
+        _run_warm_up()
+
+
+if os.environ.get("WARMUP_SCHEDULE"):
+    @bp.function_name(name="warmup_timer")
+    @bp.timer_trigger(
+        arg_name="timer", schedule="%WARMUP_SCHEDULE%", run_on_startup=_is_set("WARMUP_ON_STARTUP"),
+        use_monitor=False
+    )
+    def warmup_timer(timer: func.TimerRequest) -> None:
+        _run_warm_up()
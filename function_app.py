@@ -1,12 +1,24 @@
 import azure.functions as func
 from blueprints import (
+    http_parse_to_csv,
     http_parse_to_csv_fb,
     http_parse_to_csv_ff,
-    http_parse_to_csv_analytical
+    http_parse_to_csv_analytical,
+    http_parse_to_csv_batch,
+    http_parse_to_dataset,
+    queue_parse_to_csv,
+    warmup
 )
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+app.register_functions(http_parse_to_csv.bp)
 app.register_functions(http_parse_to_csv_fb.bp)
 app.register_functions(http_parse_to_csv_ff.bp)
 app.register_functions(http_parse_to_csv_analytical.bp)
+app.register_functions(http_parse_to_csv_batch.bp)
+app.register_functions(http_parse_to_dataset.bp)
+# the queue trigger is only registered when enabled by the app settings, see blueprints/queue_parse_to_csv.py
+app.register_functions(queue_parse_to_csv.bp)
+# the warm-up functions are only registered when enabled by the app settings, see blueprints/warmup.py
+app.register_functions(warmup.bp)
@@ -0,0 +1,81 @@
+"""
+Send conversions to the ingestion queue (blueprints/queue_parse_to_csv.py), e.g. to test it locally with Azurite.
+
+Uploads the workbooks to the input storage account (DATALAKE_STORAGE), then sends for each of them a BlobCreated
+event, as Event Grid would, or a conversion request (--request), and prints the dead-letter queue:
+
+    export DATALAKE_STORAGE=UseDevelopmentStorage=true DATALAKE_STORAGE_OUTPUT=UseDevelopmentStorage=true
+    python scripts/enqueue_conversions.py --queue conversions --input-path input/experiments x_DIL.xlsm x_STOV.xlsm
+    python scripts/enqueue_conversions.py --queue conversions --dead-letters
+
+The function app runs with `func start` and the same settings plus INGESTION_QUEUE and INGESTION_OUTPUT_PATH.
+Needs azure-storage-queue (`pip install azure-storage-queue`), which the function app itself does not use.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared_code.storage import INPUT_CONNECTION, _connection_string, split_blob_path, upload_blob  # noqa: E402
+
+
+def _queue_client(queue: str):
+    from azure.core.exceptions import ResourceExistsError
+    from azure.storage.queue import BinaryBase64DecodePolicy, BinaryBase64EncodePolicy, QueueClient
+
+    # the queue trigger expects base64 encoded messages, as Event Grid sends them
+    _client = QueueClient.from_connection_string(
+        _connection_string(INPUT_CONNECTION), queue,
+        message_encode_policy=BinaryBase64EncodePolicy(), message_decode_policy=BinaryBase64DecodePolicy()
+    )
+    try:
+        _client.create_queue()
+    except ResourceExistsError:
+        pass
+    return _client
+
+
+def blob_created_event(input_path: str, input_file: str) -> dict:
+    """Return a BlobCreated event of the blob, with the fields the ingestion reads (Event Grid schema)."""
+    _container, _blob_name = split_blob_path(input_path, input_file)
+    return {
+        "eventType": "Microsoft.Storage.BlobCreated",
+        "subject": f"/blobServices/default/containers/{_container}/blobs/{_blob_name}",
+        "data": {"api": "PutBlob", "blobType": "BlockBlob"},
+    }
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument("--queue", required=True)
+    _parser.add_argument("--input-path", help="folder of the input blobs, {container}/{folder}")
+    _parser.add_argument("--output-path", help="with --request, folder of the outputs")
+    _parser.add_argument("--request", action="store_true", help="send conversion requests instead of events")
+    _parser.add_argument("--no-upload", action="store_true", help="the blobs are already in the input path")
+    _parser.add_argument("--dead-letters", action="store_true", help="print the messages of the dead-letter queue")
+    _parser.add_argument("workbooks", nargs="*")
+    _args = _parser.parse_args()
+
+    _queue = _queue_client(_args.queue)
+    for workbook in _args.workbooks:
+        _file = os.path.basename(workbook)
+        if not _args.no_upload:
+            with open(workbook, "rb") as f:
+                upload_blob(_args.input_path, _file, f.read(), connection=INPUT_CONNECTION)
+        if _args.request:
+            _message = {"input_path": _args.input_path, "input_file": _file, "output_path": _args.output_path}
+        else:
+            _message = blob_created_event(_args.input_path, _file)
+        _queue.send_message(json.dumps(_message).encode())
+        print(f"queued {_args.input_path}/{_file}")
+
+    if _args.dead_letters:
+        for message in _queue_client(f"{_args.queue}-poison").peek_messages(max_messages=32):
+            print(message.content.decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Report the import time of the function app, i.e. what a new worker pays before serving its first request.
+
+Runs `python -X importtime -c "import function_app"` in a fresh interpreter and prints the total
+and the slowest modules by cumulative import time:
+
+    python scripts/import_time_report.py [--top 20] [--module function_app]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+def import_times(module: str) -> list:
+    """Return the (cumulative_us, self_us, module) of every module imported by `import <module>`."""
+    _root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    _process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=_root, capture_output=True, text=True, check=True
+    )
+    _times = []
+    for line in _process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self, _cumulative, _name = line[len("import time:"):].split("|")
+        _times.append((int(_cumulative), int(_self), _name.rstrip()))
+    return _times
+
+
+def main():
+    _parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _parser.add_argument("--module", default="function_app")
+    _parser.add_argument("--top", type=int, default=20)
+    _args = _parser.parse_args()
+
+    _times = import_times(_args.module)
+    _total = next((cumulative for cumulative, _, name in _times if name.strip() == _args.module), 0)
+    print(f"import {_args.module}: {_total / 1e6:.3f}s, {len(_times)} modules")
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for cumulative, self_time, name in sorted(_times, reverse=True)[:_args.top]:
+        print(f"{cumulative / 1e3:>10.1f}ms {self_time / 1e3:>8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
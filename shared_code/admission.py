@@ -0,0 +1,230 @@
+"""
+Memory-aware admission control of the conversions run by a worker.
+
+Parsing and transposing a workbook takes many times its size in memory, a worker converting several
+big workbooks at once gets killed and Data Factory retries all of them. Every conversion is first admitted:
+- its memory cost is estimated from the size of the blob and the memory factor of its layout
+  (shared_code.layouts.LAYOUTS, measured with the benchmarks),
+- the conversions run as long as the sum of their costs stays within the memory budget of the worker
+  (ADMISSION_MEMORY_MB app setting, 1536 MB by default, 0 disables the admission control),
+- the waiting conversions are admitted smallest first, so small workbooks are not stuck behind huge ones,
+- a conversion that can not be admitted within ADMISSION_MAX_WAIT seconds (default 30), or when
+  ADMISSION_MAX_QUEUE conversions (default 32) are already waiting, is rejected: the routes answer
+  429 with a Retry-After header (ADMISSION_RETRY_AFTER seconds, default 30) instead of running it.
+
+A conversion costing more than the whole budget is only admitted when no other conversion is running.
+The state of the controller is logged as an "admission_metrics" record and added to the conversion metrics.
+"""
+
+import functools
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# memory of a conversion that does not depend on the size of the workbook (pandas frames, buffers...)
+BASE_COST_MB = 20
+
+
+class AdmissionRejected(Exception):
+    """The conversion can not be admitted, it should be retried after retry_after seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Admit the conversions smallest first as long as their estimated memory fits in the budget."""
+
+    def __init__(self, budget_mb: float, max_wait: float = 30, max_queue: int = 32, retry_after: int = 30):
+        self.budget_mb = budget_mb
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self.in_use_mb = 0.0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_mb > 0
+
+    def _fits(self, ticket, cost_mb: float) -> bool:
+        if self._waiting[0] is not ticket:
+            return False
+        # a conversion larger than the budget runs alone
+        return self.in_use_mb + cost_mb <= self.budget_mb or self.running == 0
+
+    def acquire(self, cost_mb: float) -> float:
+        """Wait until the conversion is admitted and return the seconds waited, raise AdmissionRejected."""
+        _start = time.monotonic()
+        with self._condition:
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected(f"{len(self._waiting)} conversions are already waiting", self.retry_after)
+
+            _ticket = (cost_mb, next(self._sequence))
+            heapq.heappush(self._waiting, _ticket)
+            _deadline = _start + self.max_wait
+            while not self._fits(_ticket, cost_mb):
+                _remaining = _deadline - time.monotonic()
+                if _remaining <= 0:
+                    self._waiting.remove(_ticket)
+                    heapq.heapify(self._waiting)
+                    self.rejected += 1
+                    # the next waiting conversion may fit now that this one gave up
+                    self._condition.notify_all()
+                    raise AdmissionRejected(
+                        f"{cost_mb:.0f} MB could not be admitted within {self.max_wait}s "
+                        f"({self.in_use_mb:.0f} of {self.budget_mb:.0f} MB in use)",
+                        self.retry_after
+                    )
+                self._condition.wait(_remaining)
+
+            heapq.heappop(self._waiting)
+            self.in_use_mb += cost_mb
+            self.running += 1
+            self.admitted += 1
+            # the next smallest conversion may fit as well
+            self._condition.notify_all()
+        return time.monotonic() - _start
+
+    def release(self, cost_mb: float):
+        with self._condition:
+            self.in_use_mb -= cost_mb
+            self.running -= 1
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, cost_mb: float):
+        """Run the block once the conversion is admitted, raise AdmissionRejected."""
+        if not self.enabled:
+            yield 0.0
+            return
+        _waited = self.acquire(cost_mb)
+        try:
+            yield _waited
+        finally:
+            self.release(cost_mb)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "admission_budget_mb": self.budget_mb,
+                "admission_in_use_mb": round(self.in_use_mb, 1),
+                "admission_running": self.running,
+                "admission_waiting": len(self._waiting),
+                "admission_admitted": self.admitted,
+                "admission_rejected": self.rejected,
+            }
+
+
+controller = AdmissionController(
+    budget_mb=float(os.environ.get("ADMISSION_MEMORY_MB", 1536)),
+    max_wait=float(os.environ.get("ADMISSION_MAX_WAIT", 30)),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", 32)),
+    retry_after=int(os.environ.get("ADMISSION_RETRY_AFTER", 30)),
+)
+
+
+def estimate_cost_mb(blob_size: int, layout: str) -> float:
+    """Return the estimated peak memory of the conversion of a blob of blob_size bytes, in MB."""
+    from shared_code.layouts import DEFAULT_MEMORY_FACTOR, layout_plan
+
+    # the memory factor of a layout, or of the layout of a template variant, is set when its spec is compiled
+    try:
+        _factor = layout_plan(layout)["memory_factor"]
+    except (KeyError, TypeError, ValueError):
+        # the layout of the request is unknown, the conversion will be rejected by the handler
+        _factor = DEFAULT_MEMORY_FACTOR
+    return BASE_COST_MB + (blob_size or 0) / 2**20 * _factor
+
+
+def _log(event: str, layout: str, cost_mb: float, **dimensions):
+    _dimensions = {"event": event, "layout": layout, "cost_mb": round(cost_mb, 1), **dimensions, **controller.stats()}
+    logging.info("admission_metrics %s", json.dumps(_dimensions), extra={"custom_dimensions": _dimensions})
+
+
+@contextmanager
+def admit(blob_size: int, layout: str):
+    """Run the block once the conversion of the blob is admitted, raise AdmissionRejected."""
+    _cost_mb = estimate_cost_mb(blob_size, layout)
+    try:
+        with controller.admit(_cost_mb) as waited:
+            if controller.enabled:
+                _log("admitted", layout, _cost_mb, waited_s=round(waited, 3))
+            yield waited
+    except AdmissionRejected as e:
+        _log("rejected", layout, _cost_mb, reason=str(e))
+        raise
+
+
+def rejected_response(func, rejection: AdmissionRejected, **fields):
+    """The 429 response of a rejected conversion, func is the azure.functions module."""
+    _result = {**fields, "error": f"TOO MANY CONVERSIONS: {rejection}", "status_code": 429, "admission": stats()}
+    return func.HttpResponse(
+        json.dumps(_result, indent=4), mimetype="application/json", status_code=429,
+        headers={"Retry-After": str(rejection.retry_after)}
+    )
+
+
+def _request_body(req) -> dict:
+    try:
+        _body = req.get_json()
+    except ValueError:
+        return {}
+    return _body if isinstance(_body, dict) else {}
+
+
+def _request_layout(body: dict):
+    """Return the layout of the input file of the request, None if there is none."""
+    from shared_code.layouts import find_layout
+
+    _input_file = body.get("input_file")
+    return find_layout(_input_file) if isinstance(_input_file, str) else None
+
+
+def admitted(layout: str = None):
+    """
+    Decorator of the routes converting the workbook of their "excelfile" input binding: the conversion
+    is run once admitted, a rejected conversion gets a 429 response with a Retry-After header.
+    Without layout, the layout is found from the input file of the request.
+    The validations ("mode": "validate") only read the header region of the workbook, they are not admitted.
+    """
+    import azure.functions as func
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(req, excelfile, outputblob):
+            _body = _request_body(req)
+            if _body.get("mode") == "validate":
+                return handler(req, excelfile, outputblob)
+            _size = excelfile.length
+            if _size is None:
+                # the host did not tell the size, read the content and hand it over to the handler
+                _content = excelfile.read()
+                _size = len(_content)
+                excelfile = func.blob.InputStream(data=_content, name=excelfile.name, uri=excelfile.uri, length=_size)
+            _layout = layout if layout is not None else _request_layout(_body)
+            try:
+                with admit(_size, _layout):
+                    return handler(req, excelfile, outputblob)
+            except AdmissionRejected as e:
+                return rejected_response(func, e, input_size=_size, layout=_layout)
+        return wrapper
+    return decorator
+
+
+def stats() -> dict:
+    """State of the admission controller, as dimensions of the conversion metrics."""
+    return controller.stats()
@@ -0,0 +1,411 @@
+"""
+Chunked conversion of the analytical layout to csv, in bounded memory.
+
+The generic path reads the whole compiled export (read_sheet), makes its first row the header, drops it,
+resets the index, coerces the whole Spalte_Compiling_Timestamp column and serializes the table: each step
+holds a full copy of the table. In chunked mode the sheet rows flow through the same steps in batches of
+chunk_rows rows, only one batch is held in memory whatever the height of the export:
+- a first pass over the rows (plan_chunks) settles what pandas decides over whole columns: the dtype of
+  every column, the format inferred for the timestamps and how precisely they are written,
+- a second pass (write_chunks) converts every batch with these decisions and appends its csv to the output.
+
+The csv written is the same as the one of the generic path. The exports for which it can not be guaranteed
+(no or several timestamp columns, timestamps with a timezone or with milliseconds only, integers out of
+the int64 range...) get None from plan_chunks and go through the generic path, which also raises the same
+errors as before.
+
+The chunked mode is enabled by the "chunk_rows" field of the request body or the ANALYTICAL_CHUNK_ROWS
+app setting (rows per batch, 0 disables it). The rows are read twice, a conversion takes longer than with
+the generic path, it is meant for the exports too tall to be converted at once.
+The errors met while write_chunks reads or converts the rows are raised as ChunkedConversionError, apart
+from the errors of the output file.
+pandas is only imported by the conversion functions, resolve_chunk_rows is cheap to import.
+"""
+
+import gzip
+import io
+import os
+import warnings
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+from shared_code.excel_engines import DEFAULT_ENGINE, iter_sheet_values
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# offsets of the analytical layout, see LAYOUTS["analytical"]["read"]: 4 skipped rows, then the header row
+_SKIPPED_ROWS = 4
+_TIMESTAMP_COLUMN = "Spalte_Compiling_Timestamp"
+
+# the strings pd.to_datetime skips when it infers the format of a column from its first value
+_SKIPPED_TIMESTAMPS = {"", "NaT", "nat", "NAT", "nan", "NaN", "NAN", "now", "today"}
+
+
+class ChunkedConversionError(Exception):
+    """The rows of the export could not be read ("read") or converted ("transform"), see stage."""
+
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(str(error))
+        self.stage = stage
+
+
+def resolve_chunk_rows(chunk_rows=None):
+    """
+    Return the number of rows per batch of a request, the requested one else the ANALYTICAL_CHUNK_ROWS
+    app setting, None when the chunked mode is disabled. Raise ValueError for an invalid number.
+    """
+    _chunk_rows = chunk_rows if chunk_rows is not None else os.environ.get("ANALYTICAL_CHUNK_ROWS") or 0
+    try:
+        if isinstance(_chunk_rows, bool):
+            raise ValueError
+        _chunk_rows = int(_chunk_rows)
+        if _chunk_rows < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"chunk_rows must be a positive number of rows, got {_chunk_rows!r}")
+    return _chunk_rows or None
+
+
+def _iter_batches(blob_content: bytes, engine: str, chunk_rows: int):
+    """
+    Yield the converted sheet rows in batches of about chunk_rows rows, without their trailing empty cells.
+    The first batch starts with the skipped rows, the blank rows are only kept if more data follows.
+    """
+    from shared_code.workbook_reader import _trimmed_length, convert_value
+
+    _batch = []
+    _pending_blank_rows = 0
+    for row_number, row in enumerate(iter_sheet_values(blob_content, engine)):
+        _converted = [convert_value(value) for value in row]
+        del _converted[_trimmed_length(_converted):]
+        if row_number < _SKIPPED_ROWS:
+            _batch.append(_converted)
+            continue
+        if not _converted:
+            _pending_blank_rows += 1
+            continue
+        _batch.extend([] for _ in range(_pending_blank_rows))
+        _pending_blank_rows = 0
+        _batch.append(_converted)
+        if len(_batch) >= chunk_rows:
+            yield _batch
+            _batch = []
+    if _batch:
+        yield _batch
+
+
+def _parse(batch: list, width: int, dtype: dict = None) -> "pd.DataFrame":
+    """Parse a batch of rows padded to width columns, as read_sheet does for the whole table."""
+    from shared_code.workbook_reader import parse_rows
+
+    for row in batch:
+        if len(row) < width:
+            row.extend([""] * (width - len(row)))
+    return parse_rows(batch, dtype)
+
+
+def _kind(values: "pd.Series", batch: list, col: int):
+    """Return how pandas typed the column of a batch, None for the types not handled."""
+    import pandas as pd
+
+    if values.dtype == "int64":
+        return "int"
+    if values.dtype == "float64":
+        return "float" if values.notna().any() else "empty"
+    if values.dtype == bool:
+        # True and False cells are numbers for pandas, the "True" and "False" texts are not
+        return "bool_text" if any(type(row[col]) is str for row in batch) else "bool"
+    if pd.api.types.is_datetime64_dtype(values.dtype):
+        return "datetime"
+    if isinstance(values.dtype, pd.StringDtype):
+        return "other"
+    if values.dtype == object:
+        for value in values:
+            if value is not True and value is not False and value == value:
+                return "other"
+        # "True" and "False" texts converted to booleans, with missing values
+        return "bool_text_missing"
+    return None
+
+
+def _combined_dtype(kinds: set):
+    """
+    Return the dtype pandas gives a column from how it typed it in every batch,
+    None when every batch gets the same values as the whole column without a dtype.
+    """
+    if kinds <= {"int", "float", "empty", "bool"}:
+        # the numbers, the booleans and the missing values are converted together
+        if kinds & {"float", "empty"}:
+            return "float64"
+        return "int64" if "int" in kinds else "bool"
+    if kinds <= {"bool_text", "bool_text_missing", "empty"}:
+        return "bool" if kinds == {"bool_text"} else None
+    if kinds <= {"datetime", "empty"}:
+        return None
+    return "object"
+
+
+def _first_timestamp(values):
+    """Return the value pd.to_datetime infers the format of the column from, None if there is none."""
+    import pandas as pd
+
+    for value in values:
+        if isinstance(value, str):
+            if value not in _SKIPPED_TIMESTAMPS:
+                return value
+        elif not pd.isna(value):
+            return value
+    return None
+
+
+class _Precision:
+    """How precisely pandas writes a datetime64 column, known once all its values are seen."""
+
+    def __init__(self):
+        self.dates_only = True
+        self.milliseconds = False
+        self.microseconds = False
+        self.nanoseconds = False
+
+    def update(self, timestamps: "pd.Series"):
+        _present = timestamps.dropna()
+        self.dates_only = self.dates_only and bool((_present == _present.dt.normalize()).all())
+        self.milliseconds = self.milliseconds or bool((_present.dt.microsecond != 0).any())
+        self.microseconds = self.microseconds or bool((_present.dt.microsecond % 1000 != 0).any())
+        self.nanoseconds = self.nanoseconds or bool((_present.dt.nanosecond != 0).any())
+
+    def date_format(self):
+        """Return the strftime format of the column, None if strftime can not write it like pandas."""
+        if self.dates_only:
+            return "%Y-%m-%d"
+        if self.nanoseconds or (self.milliseconds and not self.microseconds):
+            # written with 9 or 3 digits
+            return None
+        return "%Y-%m-%d %H:%M:%S.%f" if self.microseconds else "%Y-%m-%d %H:%M:%S"
+
+
+def plan_chunks(blob_content: bytes, engine: str = DEFAULT_ENGINE, chunk_rows: int = 50000):
+    """
+    Read the rows once and return the decisions pandas takes over whole columns, None if the export
+    can not be converted by batches with the same result.
+    """
+    import pandas as pd
+    from pandas.tseries.api import guess_datetime_format
+
+    _width = 0
+    _batch_widths = []
+    _kinds = []
+    _precisions = {}
+    _timestamp_col = None
+    _format = None
+    _format_found = False
+    _rows = 0
+
+    for batch_number, batch in enumerate(_iter_batches(blob_content, engine, chunk_rows)):
+        _first = 0
+        if batch_number == 0:
+            if len(batch) <= _SKIPPED_ROWS:
+                # no header row, left to the generic path
+                return None
+            _header = batch[_SKIPPED_ROWS]
+            _positions = [col for col, value in enumerate(_header) if value == _TIMESTAMP_COLUMN]
+            if len(_positions) != 1:
+                return None
+            _timestamp_col = _positions[0]
+            _first = _SKIPPED_ROWS + 1
+        _rows += len(batch) - _first
+
+        _batch_width = max(len(row) for row in batch)
+        _width = max(_width, _batch_width)
+        _batch_widths.append(_batch_width)
+        _dtype = {_timestamp_col: object} if _timestamp_col < _batch_width else None
+        _df = _parse(batch, _batch_width, _dtype)
+        _kinds.extend(set() for _ in range(len(_kinds), _batch_width))
+        for col in range(_batch_width):
+            _kind_found = _kind(_df[col], batch, col)
+            _kinds[col].add(_kind_found)
+            if _kind_found == "datetime":
+                _precisions.setdefault(col, _Precision()).update(_df[col])
+        if _dtype is None:
+            # no timestamp in these rows
+            continue
+
+        # the timestamps are coerced with the format inferred from the first one, as the generic path does
+        _values = _df[_timestamp_col].to_numpy(dtype=object)[_first:]
+        if not len(_values):
+            continue
+        _first_value = _first_timestamp(_values) if not _format_found else None
+        if _first_value is not None:
+            # only the format of a text is guessed, the other values are parsed as they are
+            if type(_first_value) is str:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    _format = guess_datetime_format(_first_value)
+            _format_found = True
+        try:
+            _timestamps = pd.to_datetime(pd.Series(_values, dtype=object), errors="coerce", format=_format or "mixed")
+        except (ValueError, TypeError, OverflowError):
+            return None
+        if _timestamps.dtype.kind != "M" or _timestamps.dt.tz is not None:
+            return None
+        _precisions.setdefault(_timestamp_col, _Precision()).update(_timestamps)
+
+    if _timestamp_col is None:
+        return None
+    # the columns missing at the end of a batch are empty cells
+    for batch_width in _batch_widths:
+        for col in range(batch_width, _width):
+            _kinds[col].add("empty")
+    _dtypes = {}
+    for col, kinds in enumerate(_kinds):
+        if None in kinds:
+            return None
+        _dtypes[col] = "object" if col == _timestamp_col else _combined_dtype(kinds)
+
+    # the datetime64 columns are written as text, with the format pandas would choose for the whole column
+    _date_formats = {}
+    for col, precision in _precisions.items():
+        if col != _timestamp_col and _dtypes[col] is not None:
+            continue
+        _date_formats[col] = precision.date_format()
+        if _date_formats[col] is None:
+            return None
+    _date_formats.setdefault(_timestamp_col, "%Y-%m-%d")
+
+    return {
+        "width": _width,
+        "dtypes": _dtypes,
+        "timestamp_col": _timestamp_col,
+        "timestamp_format": _format,
+        "date_formats": _date_formats,
+        "rows": _rows,
+    }
+
+
+@contextmanager
+def _csv_file(file, output_compression: str = None, output_compression_level: int = None):
+    """Text file the csv of the batches is written to, its bytes go to the binary file."""
+    if output_compression == "gzip":
+        # written like to_csv(compression={"method": "gzip", "mtime": 0}) writes the whole table,
+        # the compressed stream depends on how the text reaches the compressor
+        _level = 9 if output_compression_level is None else output_compression_level
+        with gzip.GzipFile(fileobj=file, mode="wb", mtime=0, compresslevel=_level) as compressed, \
+                _text(compressed) as text:
+            yield text
+    elif output_compression == "zstd":
+        import zstandard
+
+        _compressor = zstandard.ZstdCompressor(level=3 if output_compression_level is None else output_compression_level)
+        with _compressor.stream_writer(file, closefd=False) as compressed, _text(compressed) as text:
+            yield text
+    else:
+        with _text(file) as text:
+            yield text
+
+
+@contextmanager
+def _text(file):
+    _text_file = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        yield _text_file
+        _text_file.flush()
+    finally:
+        # the binary file stays open
+        _text_file.detach()
+
+
+def _read_batches(blob_content: bytes, engine: str, chunk_rows: int):
+    """Yield the batches of _iter_batches, the errors of the reader are raised as ChunkedConversionError."""
+    _batches = _iter_batches(blob_content, engine, chunk_rows)
+    while True:
+        try:
+            _batch = next(_batches, None)
+        except Exception as e:
+            raise ChunkedConversionError("read", e) from e
+        if _batch is None:
+            return
+        yield _batch
+
+
+def _converted_frames(blob_content: bytes, plan: dict, engine: str, chunk_rows: int):
+    """
+    Yield (frame, header) for every batch of rows, the frame transformed and ready to be written as csv,
+    header True for the first one. The errors of the conversion are raised as ChunkedConversionError.
+    """
+    import pandas as pd
+
+    from shared_code.workbook_reader import is_interned
+
+    _dtype = {col: dtype for col, dtype in plan["dtypes"].items() if dtype is not None}
+    _timestamp_col = plan["timestamp_col"]
+    _object_cols = [col for col, dtype in _dtype.items() if dtype == "object"]
+    _memos = {col: {} for col in _object_cols}
+    _columns = None
+    _offset = 0
+
+    for batch in _read_batches(blob_content, engine, chunk_rows):
+        try:
+            _df = _parse(batch, plan["width"], _dtype)
+
+            # the values met first in a column replace the equal ones (True and 1...) in the next batches
+            for col in _object_cols:
+                _values = _df[col].to_numpy(dtype=object, copy=True)
+                _memo = _memos[col]
+                for i, value in enumerate(_values):
+                    if is_interned(value):
+                        _values[i] = _memo.setdefault(value, value)
+                _df[col] = pd.Series(_values, dtype=object)
+
+            if _columns is None:
+                # the first row after the skipped ones is the header
+                _df = _df.iloc[_SKIPPED_ROWS:]
+                _df.index = pd.RangeIndex(_SKIPPED_ROWS, _SKIPPED_ROWS + len(_df))
+                _columns = _df.iloc[0].copy()
+                for col in plan["date_formats"]:
+                    # the missing header of a datetime64 column is NaT, even if the first batch is empty
+                    if col != _timestamp_col and _columns.iloc[col] != _columns.iloc[col]:
+                        _columns.iloc[col] = pd.NaT
+                _df = _df[1:]
+                _header = True
+            else:
+                _header = False
+            _df.columns = _columns
+            _df.index = pd.RangeIndex(_offset, _offset + len(_df))
+            _offset += len(_df)
+
+            _timestamps = pd.to_datetime(
+                _df.iloc[:, _timestamp_col], errors="coerce", format=plan["timestamp_format"] or "mixed"
+            )
+            _df.isetitem(_timestamp_col, _timestamps)
+        except Exception as e:
+            raise ChunkedConversionError("transform", e) from e
+        yield _df, _header
+
+
+def write_chunks(
+    blob_content: bytes, plan: dict, file, engine: str = DEFAULT_ENGINE, chunk_rows: int = 50000,
+    output_compression: str = None, output_compression_level: int = None
+) -> "pd.DataFrame":
+    """
+    Read the rows again and write the csv of the transformed table to the binary file batch by batch,
+    return the first 5 rows of the table. Raise ChunkedConversionError if the rows can not be read or
+    converted, the errors of the file are raised as they are.
+    """
+    import pandas as pd
+
+    _head = []
+    with _csv_file(file, output_compression, output_compression_level) as csv_file:
+        for _df, _header in _converted_frames(blob_content, plan, engine, chunk_rows):
+            if sum(len(head) for head in _head) < 5:
+                _head.append(_df.head())
+            try:
+                for col, date_format in plan["date_formats"].items():
+                    if _df.dtypes.iloc[col].kind == "M":
+                        _df.isetitem(col, _df.iloc[:, col].dt.strftime(date_format))
+            except Exception as e:
+                raise ChunkedConversionError("transform", e) from e
+            _df.to_csv(csv_file, index=True, header=_header)
+
+    return pd.concat(_head).head() if len(_head) > 1 else _head[0]
@@ -0,0 +1,339 @@
+"""
+Consolidated dataset of many workbooks of the same layout, see blueprints/http_parse_to_dataset.py.
+
+One csv per workbook leaves the lake with tens of thousands of tiny files. The consolidation appends the
+transformed tables of many workbooks to a parquet dataset partitioned hive style by unit of operation and date:
+
+    {output_path}/unit_of_operation=STOV/date=2024-05-01/part-20240502T101500-1a2b3c4d.parquet
+
+- the rows of a workbook are handed to the part file of its partition as soon as it is transformed
+  (PartitionWriter), they are buffered up to row_group_rows rows (DATASET_ROW_GROUP_ROWS app setting, default
+  100000) and written as a row group by the writer thread of the partition: the memory of a request does not
+  grow with its number of workbooks, and a workbook does not wait for the uploads of the others,
+- a request writes one part file per partition, the columns of a part file are the union of the columns of its
+  workbooks (a workbook missing some of them gets empty values) until its first row group is written: a workbook
+  with columns the part file does not have then closes it and starts a new part file,
+- the date is the last modification date of the workbook (or, with "partition_date": "ingested", the date of
+  the consolidation), in UTC,
+- every row carries the lineage of its workbook: LINEAGE_COLUMNS,
+- the index of the table (e.g. the experiment number of fb) is written as a column,
+- the type of every column is fixed by the layout (column_type), not by the values of the workbooks, so that all
+  the part files of the dataset agree: the columns with a dtypes hint in the layout spec are timestamps or
+  floats, the index is an integer, the lineage columns are text and timestamps, every other column is text.
+
+A workbook already consolidated with the same content is skipped: a marker is written for every consolidated
+workbook in {output_path}/_sources once its part file is written. A workbook changed since its consolidation is
+appended again, downstream keeps the rows of the latest _source_modified of every _source_file.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+from shared_code.layouts import PARSER_VERSION, layout_plan
+from shared_code.storage import OUTPUT_CONNECTION, get_blob_size, open_blob_writer, upload_blob
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+SOURCES_FOLDER = "_sources"
+LINEAGE_COLUMNS = [
+    "_source_path", "_source_file", "_source_hash", "_source_modified", "_ingested_at", "_parser_version"
+]
+# the names reset_index gives to the index of the table
+INDEX_COLUMNS = {"index", "id"}
+PARTITION_DATES = {"modified", "ingested"}
+
+_default_row_group_rows = int(os.environ.get("DATASET_ROW_GROUP_ROWS", 100000))
+
+
+def resolve_row_group_rows(row_group_rows=None) -> int:
+    """Return the number of rows of the row groups, the DATASET_ROW_GROUP_ROWS app setting by default."""
+    _rows = _default_row_group_rows if row_group_rows is None else row_group_rows
+    if isinstance(_rows, bool) or not isinstance(_rows, int) or _rows <= 0:
+        raise ValueError(f"row_group_rows must be a positive number of rows, got {row_group_rows}")
+    return _rows
+
+
+def resolve_partition_date(partition_date: str = None) -> str:
+    _partition_date = partition_date or "modified"
+    if _partition_date not in PARTITION_DATES:
+        raise ValueError(f"Unknown partition_date '{partition_date}', expected one of {sorted(PARTITION_DATES)}")
+    return _partition_date
+
+
+def partition_of(unit: str, date: datetime.datetime) -> str:
+    """Return the hive style folder of the partition, e.g. unit_of_operation=STOV/date=2024-05-01."""
+    return f"unit_of_operation={unit}/date={date.astimezone(datetime.timezone.utc).date().isoformat()}"
+
+
+def _marker(layout: str, blob_hash: str) -> str:
+    return f"{layout}-{blob_hash}.json"
+
+
+def is_consolidated(output_path: str, layout: str, blob_hash: str) -> bool:
+    """Return True if the workbook with this content was already consolidated into the dataset."""
+    try:
+        return get_blob_size(
+            f"{output_path.rstrip('/')}/{SOURCES_FOLDER}", _marker(layout, blob_hash), connection=OUTPUT_CONNECTION
+        ) is not None
+    except Exception as e:
+        logging.warning(f"Dataset source lookup failed for {output_path}: {e}")
+        return False
+
+
+def record_source(output_path: str, layout: str, blob_hash: str, lineage: dict, part_file: str):
+    """Write the marker of a consolidated workbook. Failures are only logged, the workbook is appended again."""
+    try:
+        upload_blob(
+            f"{output_path.rstrip('/')}/{SOURCES_FOLDER}", _marker(layout, blob_hash),
+            json.dumps({**lineage, "layout": layout, "part_file": part_file}, default=str).encode()
+        )
+    except Exception as e:
+        logging.warning(f"Dataset source record failed for {lineage['_source_file']}: {e}")
+
+
+def lineage_of(input_path: str, input_file: str, blob_hash: str, modified: datetime.datetime,
+               ingested_at: datetime.datetime) -> dict:
+    """Return the values of the lineage columns of a workbook."""
+    return {
+        "_source_path": input_path,
+        "_source_file": input_file,
+        "_source_hash": blob_hash,
+        "_source_modified": modified,
+        "_ingested_at": ingested_at,
+        "_parser_version": PARSER_VERSION,
+    }
+
+
+def with_lineage(_df: "pd.DataFrame", lineage: dict) -> "pd.DataFrame":
+    """Return the table with its index as a column, unique column names and the lineage columns."""
+    from shared_code.outputs import unique_names
+
+    _table = _df.reset_index()
+    _table.columns = unique_names(_table.columns)
+    _table = _table.astype(object)
+    for column, value in lineage.items():
+        _table[column] = value
+    return _table
+
+
+def column_type(layout: str, column: str) -> str:
+    """Return the type of a column of the dataset of the layout: timestamp, timestamp_utc, float, int or text."""
+    if column in ("_source_modified", "_ingested_at"):
+        return "timestamp_utc"
+    if column in LINEAGE_COLUMNS:
+        return "text"
+    if column in INDEX_COLUMNS:
+        return "int"
+    _hint = layout_plan(layout)["spec"].get("dtypes", {}).get(column)
+    return {"datetime": "timestamp", "numeric": "float"}.get(_hint, "text")
+
+
+def _arrow_type(kind: str):
+    import pyarrow as pa
+
+    return {
+        "timestamp": pa.timestamp("us"), "timestamp_utc": pa.timestamp("us", tz="UTC"), "float": pa.float64(),
+        "int": pa.int64(), "text": pa.string(),
+    }[kind]
+
+
+def part_schema(layout: str, columns: list):
+    """Return the arrow schema of a part file with these columns."""
+    import pyarrow as pa
+
+    return pa.schema([(column, _arrow_type(column_type(layout, column))) for column in columns])
+
+
+def _arrow_column(values: "pd.Series", kind: str):
+    import pandas as pd
+    import pyarrow as pa
+
+    if kind == "timestamp":
+        _values = pd.to_datetime(values, errors="coerce")
+    elif kind == "timestamp_utc":
+        _values = pd.to_datetime(values, errors="coerce", utc=True)
+    elif kind == "float":
+        _values = pd.to_numeric(values, errors="coerce").astype("float64")
+    elif kind == "int":
+        _values = pd.to_numeric(values, errors="coerce").astype("Int64")
+    else:
+        _values = [None if pd.isna(value) else str(value) for value in values]
+    return pa.array(_values, type=_arrow_type(kind), from_pandas=True)
+
+
+def to_arrow(_table: "pd.DataFrame", layout: str, schema) -> "pa.Table":
+    """Return the table (with_lineage) as an arrow table of the schema, the columns it does not have are empty."""
+    import pyarrow as pa
+
+    return pa.Table.from_arrays([
+        _arrow_column(_table[field.name], column_type(layout, field.name)) if field.name in _table.columns
+        else pa.nulls(len(_table), type=field.type)
+        for field in schema
+    ], schema=schema)
+
+
+class PartitionWriter:
+    """
+    Part files of a partition, written while the workbooks of the request are loaded, see the module docstring.
+    append is called concurrently by the workbooks of the partition, close once they are all appended.
+
+    The rows of a workbook are converted to arrow before the lock of the partition is taken: the lock only
+    guards the buffered batches. Full row groups are handed to the writer thread of the partition, which
+    serializes and uploads them in order, so a workbook never waits (admitted) for the writes of the others.
+    """
+
+    def __init__(
+        self, output_path: str, partition: str, layout: str, ingested_at: datetime.datetime,
+        output_compression: str = "snappy", output_compression_level: int = None, row_group_rows: int = None
+    ):
+        self.output_path = output_path
+        self.partition = partition
+        self.layout = layout
+        self.ingested_at = ingested_at
+        self.output_compression = None if output_compression in (None, "none") else output_compression
+        self.output_compression_level = output_compression_level
+        self.row_group_rows = resolve_row_group_rows(row_group_rows)
+        self.parts = []
+        self._part = None
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dataset-writer")
+        self._writes = []
+
+    @property
+    def _path(self) -> str:
+        return f"{self.output_path.rstrip('/')}/{self.partition}"
+
+    def append(self, _table: "pd.DataFrame", lineage: dict) -> str:
+        """
+        Add the rows of a workbook (with_lineage) to the open part file of the partition, return its name.
+        A failed write fails the part file, its result tells it once the partition is closed.
+        """
+        _rows = to_arrow(_table, self.layout, part_schema(self.layout, list(_table.columns)))
+        with self._lock:
+            if self._part is not None and not set(_rows.column_names) <= set(self._part["schema"].names):
+                # the columns of the part file are fixed by its first row group
+                if not self._part["fixed"]:
+                    self._widen(_rows.column_names)
+                else:
+                    self._submit_close()
+            if self._part is None:
+                self._part = {
+                    "name": part_file_name([lineage["_source_hash"]], self.ingested_at), "schema": _rows.schema,
+                    "fixed": False, "sources": [], "batches": [], "buffered": 0, "rest": None, "rows": 0,
+                    "writer": None, "parquet": None, "error": None,
+                }
+            _part = self._part
+            _part["sources"].append(lineage)
+            _part["batches"].append(_rows)
+            _part["buffered"] += len(_rows)
+            if _part["buffered"] >= self.row_group_rows:
+                _batches, _part["batches"], _part["buffered"] = _part["batches"], [], 0
+                _part["fixed"] = True
+                self._writes.append(self._writer.submit(self._write, _part, _batches))
+            return _part["name"]
+
+    def _widen(self, columns: list):
+        """Add the columns to the open part file, the rows buffered without them get empty values when written."""
+        _names = self._part["schema"].names
+        _data = [name for name in _names if name not in LINEAGE_COLUMNS]
+        _data += [name for name in columns if name not in _names and name not in LINEAGE_COLUMNS]
+        self._part["schema"] = part_schema(self.layout, _data + [name for name in _names if name in LINEAGE_COLUMNS])
+
+    def _submit_close(self):
+        """Hand the open part file to the writer thread to be written and committed, under the lock."""
+        _part, self._part = self._part, None
+        _batches, _part["batches"] = _part["batches"], []
+        self._writes.append(self._writer.submit(self._close_part, _part, _batches))
+
+    def _write(self, _part: dict, batches: list, final: bool = False):
+        """Write the rows of the part file as full row groups, all of them if final. Run by the writer thread."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        from shared_code.outputs import content_settings
+
+        _schema = _part["schema"]
+        _tables = [_part["rest"]] if _part["rest"] is not None else []
+        _tables += [
+            pa.Table.from_arrays([
+                batch.column(field.name) if field.name in batch.column_names else pa.nulls(len(batch), type=field.type)
+                for field in _schema
+            ], schema=_schema)
+            for batch in batches
+        ]
+        _part["rest"] = None
+        if _part["error"] is not None or not _tables:
+            return
+        _rows = pa.concat_tables(_tables)
+        _written = len(_rows) if final else len(_rows) // self.row_group_rows * self.row_group_rows
+        if _written < len(_rows):
+            _part["rest"] = _rows.slice(_written)
+        try:
+            if _part["writer"] is None:
+                _part["writer"] = open_blob_writer(
+                    self._path, _part["name"], content_settings=content_settings("parquet")
+                )
+                _part["parquet"] = pq.ParquetWriter(
+                    _part["writer"], _schema, compression=self.output_compression,
+                    compression_level=self.output_compression_level
+                )
+            _part["parquet"].write_table(_rows.slice(0, _written), row_group_size=self.row_group_rows)
+            _part["rows"] += _written
+        except Exception as e:
+            logging.error(f"Failed to write {self._path}/{_part['name']}: {e}")
+            _part["error"] = f"Failed to write to output blob: {str(e)}"
+            _part["rest"] = None
+            if _part["writer"] is not None:
+                _part["writer"].abort()
+
+    def _close_part(self, _part: dict, batches: list):
+        """Write the rest of the part file, commit it and record its workbooks. Run by the writer thread."""
+        self._write(_part, batches, final=True)
+        _result = {"partition": self.partition, "output_file": _part["name"], "sources": len(_part["sources"])}
+        if _part["error"] is None:
+            try:
+                _part["parquet"].close()
+                _part["writer"].close()
+            except Exception as e:
+                logging.error(f"Failed to write {self._path}/{_part['name']}: {e}")
+                _part["error"] = f"Failed to write to output blob: {str(e)}"
+                _part["writer"].abort()
+        if _part["error"] is not None:
+            _result["error"] = _part["error"]
+            _result["status_code"] = 500
+            self.parts.append(_result)
+            return
+
+        # the workbooks are only skipped by the next requests once their rows are written
+        for lineage in _part["sources"]:
+            record_source(
+                self.output_path, self.layout, lineage["_source_hash"], lineage, f"{self._path}/{_part['name']}"
+            )
+        _result["status_code"] = 200
+        _result["rows"] = _part["rows"]
+        _result["bytes"] = _part["writer"].size
+        self.parts.append(_result)
+
+    def close(self) -> list:
+        """Close the open part file, wait for the writer thread and return the results of the part files."""
+        with self._lock:
+            if self._part is not None:
+                self._submit_close()
+        self._writer.shutdown(wait=True)
+        for write in self._writes:
+            write.result()
+        return self.parts
+
+
+def part_file_name(blob_hashes: list, ingested_at: datetime.datetime) -> str:
+    """Return the name of a part file, unique to its workbooks and the time of the consolidation."""
+    _digest = hashlib.blake2b("".join(sorted(blob_hashes)).encode(), digest_size=4).hexdigest()
+    return f"part-{ingested_at.strftime('%Y%m%dT%H%M%S')}-{_digest}.parquet"
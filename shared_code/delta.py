@@ -0,0 +1,202 @@
+"""
+Incremental (delta) outputs keyed by the experiment id of the layout.
+
+The experiment workbooks are append-mostly, rewriting the whole table at every conversion makes the
+downstream reload everything. With "incremental": true the output only holds what changed since the previous
+conversion of the same output:
+- the new and changed rows, with all their columns,
+- a tombstone for every deleted row: only its key (and its previous index) is filled,
+and a "_change" column telling "insert", "update" or "delete" for every row.
+
+The hash of every row of the previous conversion is kept in a small state blob next to the output,
+in {output_path}/_delta/{output_file}.json, keyed by the key column of the layout (Experiment_ID for fb,
+Experiment ID for ff, see shared_code.layouts.LAYOUTS). Rows sharing a key are one record: they are all
+written again when one of them changes. The index (e.g. the experiment number of fb) is not part of the
+hash, a renumbering alone is not a change. When the columns of the table change, every row is an update.
+
+Every conversion writes its delta to a new blob under the output, named by its sequence number:
+{output_path}/{output_file}/{sequence:08d}-{timestamp}-{token}{extension}, a delta nobody read yet is never
+overwritten by the next one. Downstream applies the deltas in the order of their names, as upserts and deletes
+by key. The state is saved once the delta blob is committed, and only if no other conversion of the output
+saved it since it was read (etag): on a conflict the delta blob is deleted, the delta is computed again from
+the new state and written to a new blob, at most SAVE_ATTEMPTS times. A failed upload leaves the previous
+state, the next conversion writes the same changes again.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import uuid
+from typing import TYPE_CHECKING
+
+from shared_code.storage import OUTPUT_CONNECTION, delete_blob, download_blob_version, upload_blob
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+STATE_FOLDER = "_delta"
+CHANGE_COLUMN = "_change"
+
+# conversions of an output computing their delta again after a concurrent conversion wrote the state
+SAVE_ATTEMPTS = 3
+
+
+class StateConflict(Exception):
+    """The state was written by another conversion of the output since it was read."""
+
+
+def _state_location(output_path: str, output_file: str):
+    return f"{output_path.rstrip('/')}/{STATE_FOLDER}", f"{output_file}.json"
+
+
+def delta_location(output_path: str, output_file: str, sequence: int, extension: str = ""):
+    """The folder and the name of a new delta blob of the output, the names sort in the order of the sequence."""
+    _timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    return (
+        f"{output_path.rstrip('/')}/{output_file}", f"{sequence:08d}-{_timestamp}-{uuid.uuid4().hex[:8]}{extension}"
+    )
+
+
+def load_state(output_path: str, output_file: str):
+    """
+    Return (state, etag) of the previous conversion of the output, (None, None) if there is none.
+    Storage errors are raised: without the state the deleted rows would be missed.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        _content, _etag = download_blob_version(*_state_location(output_path, output_file), connection=OUTPUT_CONNECTION)
+    except ResourceNotFoundError:
+        return None, None
+    return json.loads(_content), _etag
+
+
+def save_state(output_path: str, output_file: str, state: dict, etag: str = None):
+    """
+    Write the state of the conversion, if the state read with etag (None: there was none) was not written
+    since. Raise StateConflict if it was. Other failures are only logged, the next delta repeats the changes.
+    """
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+
+    try:
+        upload_blob(
+            *_state_location(output_path, output_file), json.dumps(state).encode(), etag=etag, if_missing=etag is None
+        )
+    except (ResourceExistsError, ResourceModifiedError) as e:
+        raise StateConflict(f"The delta state of {output_path}/{output_file} was written by another conversion") from e
+    except Exception as e:
+        logging.warning(f"Delta state record failed for {output_path}/{output_file}: {e}")
+
+
+def write_delta(
+    _df: "pd.DataFrame", output_path: str, output_file: str, key_column: str, layout: str, write, extension: str = ""
+) -> dict:
+    """
+    Write the rows of the table changed since the previous conversion of the output to a new delta blob, then
+    save the state. write(_delta, path, file) writes the delta blob and returns its size.
+    Return {"delta_file": name of the blob under output_path, "size": ..., "delta": counts}.
+    Raise StateConflict when other conversions saved the state SAVE_ATTEMPTS times, the other errors as they are.
+    """
+    for _attempt in range(1, SAVE_ATTEMPTS + 1):
+        _state, _etag = load_state(output_path, output_file)
+        _delta, _new_state, _counts = compute_delta(_df, key_column, layout, _state)
+        _new_state["sequence"] = (_state or {}).get("sequence", 0) + 1
+        _folder, _file = delta_location(output_path, output_file, _new_state["sequence"], extension)
+        _new_state["delta_file"] = _file
+        _size = write(_delta, _folder, _file)
+        try:
+            save_state(output_path, output_file, _new_state, _etag)
+            return {"delta_file": f"{output_file}/{_file}", "size": _size, "delta": _counts}
+        except StateConflict as e:
+            # the delta of the other conversion is kept, this one was computed from a state that is gone
+            logging.warning(f"{e}, attempt {_attempt} of {SAVE_ATTEMPTS}")
+            try:
+                delete_blob(_folder, _file)
+            except Exception as delete_error:
+                logging.warning(f"Failed to delete the superseded delta {_folder}/{_file}: {delete_error}")
+    raise StateConflict(f"The delta state of {output_path}/{output_file} was written by concurrent conversions")
+
+
+def _json_value(value):
+    """The index values as JSON values, numpy scalars become Python ones."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def row_hashes(_df: "pd.DataFrame", key_column: str) -> dict:
+    """Return {key: [hash, index]} of the table, the hash covers every row of the key, the index is the first one."""
+    import pandas as pd
+
+    # the values are hashed as text, so that a column changing dtype (e.g. int to float) with the same
+    # values written is not a change
+    _hashes = pd.util.hash_pandas_object(_df.astype(str), index=False).to_numpy()
+    _keys = _df[key_column].astype(str).to_numpy()
+    _index = _df.index.tolist()
+
+    _records = {}
+    for key, row_hash, index in zip(_keys, _hashes, _index):
+        _record = _records.get(key)
+        if _record is None:
+            _records[key] = [format(row_hash, "016x"), _json_value(index)]
+        else:
+            _record[0] += format(row_hash, "016x")
+    for _record in _records.values():
+        if len(_record[0]) > 16:
+            _record[0] = hashlib.blake2b(_record[0].encode(), digest_size=8).hexdigest()
+    return _records
+
+
+def compute_delta(_df: "pd.DataFrame", key_column: str, layout: str, state: dict = None):
+    """
+    Return (delta, new_state, counts): the rows of the table changed since the state with a _change column
+    and the tombstones of the deleted keys, the state of this conversion and the number of rows
+    inserted, updated, deleted and unchanged.
+    """
+    import pandas as pd
+
+    _columns = [str(col) for col in _df.columns]
+    _rows = row_hashes(_df, key_column)
+    _previous = {}
+    if state is not None and state.get("key_column") == key_column:
+        _previous = state.get("rows", {})
+        if state.get("columns") != _columns:
+            # a new, dropped or renamed column changes every row
+            _previous = {key: [None, record[1]] for key, record in _previous.items()}
+
+    _changes = {}
+    for key, record in _rows.items():
+        _before = _previous.get(key)
+        if _before is None:
+            _changes[key] = "insert"
+        elif _before[0] != record[0]:
+            _changes[key] = "update"
+    _deleted = [key for key in _previous if key not in _rows]
+
+    _keys = _df[key_column].astype(str)
+    _changed = _df[_keys.isin(_changes).to_numpy()].astype(object)
+    _changed[CHANGE_COLUMN] = _keys[_keys.isin(_changes)].map(_changes).to_numpy()
+
+    # the tombstones hold the key (as it was written) and the previous index of the deleted rows
+    _tombstones = pd.DataFrame(
+        None, index=pd.Index([_previous[key][1] for key in _deleted], name=_df.index.name),
+        columns=_changed.columns, dtype=object
+    )
+    _tombstones[key_column] = _deleted
+    _tombstones[CHANGE_COLUMN] = "delete"
+    _delta = pd.concat([_changed, _tombstones]) if _deleted else _changed
+
+    _counts = {
+        "inserted": sum(1 for change in _changes.values() if change == "insert"),
+        "updated": sum(1 for change in _changes.values() if change == "update"),
+        "deleted": len(_deleted),
+        "unchanged": len(_rows) - len(_changes),
+    }
+    _state = {
+        "layout": layout,
+        "key_column": key_column,
+        "columns": _columns,
+        "rows": _rows,
+        "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    return _delta, _state, _counts
@@ -0,0 +1,376 @@
+"""
+Excel engines used to read the rows of the first worksheet of a workbook.
+
+Every engine yields the rows of the sheet as tuples of raw cell values, with the same values
+openpyxl returns in read_only / values_only mode (None for empty cells, int or float for numbers,
+datetime for date formatted numbers, the error code for error cells), so that
+shared_code.workbook_reader builds exactly the same table whatever the engine.
+
+Available engines:
+- openpyxl: the reference engine, also used by pd.read_excel.
+- calamine: Rust based reader (python-calamine), much faster on large sheets.
+- sheetxml: minimal reader, opens the zip and iterparses only the sheet part, the shared strings
+  and the number formats of the styles. vbaProject, drawings and the rest of the package are never read.
+
+The engine is chosen with the "engine" field of the request body, or the EXCEL_ENGINE app setting.
+The engine libraries are imported on first use, resolve_engine is cheap to import.
+"""
+
+import datetime
+import io
+import os
+import posixpath
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+
+DEFAULT_ENGINE = "openpyxl"
+
+# the codes of the error cells, returned as they are by the engines (openpyxl.cell.cell.ERROR_CODES)
+ERROR_CODES = frozenset({"#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"})
+# the strings the pandas parsers read as missing values, their default na_values
+NA_STRINGS = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>", "N/A",
+    "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+})
+
+
+def iter_openpyxl_rows(blob_content: bytes, max_cols: int = None):
+    """
+    Yield the rows of the first worksheet with openpyxl, limited to the first max_cols columns if given.
+    The workbook is opened in read_only mode, so only the current row is kept in memory.
+    """
+    from openpyxl import load_workbook
+
+    _workbook = load_workbook(io.BytesIO(blob_content), read_only=True, data_only=True, keep_links=False)
+    try:
+        _sheet = _workbook.worksheets[0]
+        # the stored dimensions of exported files are not reliable, read the rows as they are
+        _sheet.reset_dimensions()
+        for row in _sheet.iter_rows(values_only=True, max_col=max_cols):
+            yield row
+    finally:
+        _workbook.close()
+
+
+def iter_calamine_rows(blob_content: bytes, max_cols: int = None):
+    """
+    Yield the rows of the first worksheet with python-calamine, limited to the first max_cols columns if given.
+    calamine returns every number as float, "" for empty cells and date for midnight dates,
+    the values are aligned on what openpyxl returns.
+    calamine also returns "" for the error cells and for the strings made of whitespace only, which openpyxl
+    keeps: the workbooks holding such values are read with the sheetxml engine instead.
+    """
+    if _calamine_unreadable(blob_content):
+        yield from iter_sheetxml_rows(blob_content, max_cols=max_cols)
+        return
+
+    from python_calamine import CalamineWorkbook
+
+    _workbook = CalamineWorkbook.from_filelike(io.BytesIO(blob_content))
+    _sheet = _workbook.get_sheet_by_index(0)
+    # the rows start at the first sheet row but the columns start at the first used column
+    _leading_cells = (None,) * _sheet.start[1] if _sheet.start else ()
+    for row in _sheet.iter_rows():
+        _row = _leading_cells + tuple(_calamine_value(value) for value in row)
+        yield _row if max_cols is None else _row[:max_cols]
+
+
+def _calamine_value(value):
+    if isinstance(value, str):
+        # only the empty cells are left to be read as "", see iter_calamine_rows
+        return value or None
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return datetime.datetime(value.year, value.month, value.day)
+    return value
+
+
+##### sheetxml engine #####
+
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PACKAGE_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+
+def _read_rels(archive: zipfile.ZipFile, part: str) -> dict:
+    """Return the relationships of a package part as {id: (type, absolute target)}."""
+    _folder, _name = posixpath.split(part)
+    _rels_part = posixpath.join(_folder, "_rels", _name + ".rels")
+    if _rels_part not in archive.namelist():
+        return {}
+    _rels = {}
+    with archive.open(_rels_part) as source:
+        for _, element in iterparse(source):
+            if element.tag == _PACKAGE_REL_NS + "Relationship":
+                _target = element.get("Target")
+                if _target.startswith("/"):
+                    _target = _target[1:]
+                else:
+                    _target = posixpath.normpath(posixpath.join(_folder, _target))
+                _rels[element.get("Id")] = (element.get("Type"), _target)
+    return _rels
+
+
+def _text_content(element) -> str:
+    """Text of a shared or inline string, without the formatting and the phonetic runs."""
+    _snippets = []
+    for child in element:
+        if child.tag == _MAIN_NS + "t":
+            _snippets.append(child.text or "")
+        elif child.tag == _MAIN_NS + "r":
+            _snippets.append(child.findtext(_MAIN_NS + "t") or "")
+    return "".join(_snippets)
+
+
+def _read_shared_strings(archive: zipfile.ZipFile, part: str) -> list:
+    _strings = []
+    with archive.open(part) as source:
+        for _, element in iterparse(source):
+            if element.tag == _MAIN_NS + "si":
+                _strings.append(_text_content(element).replace("x005F_", ""))
+                element.clear()
+    return _strings
+
+
+def _read_date_styles(archive: zipfile.ZipFile, part: str):
+    """Return the indexes of the cell styles formatted as dates and as timedeltas."""
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+
+    _custom_formats = {}
+    _style_formats = []
+    with archive.open(part) as source:
+        for _, element in iterparse(source):
+            if element.tag == _MAIN_NS + "numFmt":
+                _custom_formats[int(element.get("numFmtId"))] = element.get("formatCode")
+            elif element.tag == _MAIN_NS + "cellXfs":
+                _style_formats = [int(xf.get("numFmtId", 0)) for xf in element.iter(_MAIN_NS + "xf")]
+                break
+
+    _date_styles, _timedelta_styles = set(), set()
+    for idx, fmt_id in enumerate(_style_formats):
+        _fmt = _custom_formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id))
+        if is_date_format(_fmt):
+            _date_styles.add(idx)
+        if is_timedelta_format(_fmt):
+            _timedelta_styles.add(idx)
+    return _date_styles, _timedelta_styles
+
+
+def _cast_number(value: str):
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def _locate_first_sheet(archive: zipfile.ZipFile):
+    """Return (workbook relationships, date epoch, part of the first worksheet) of the package."""
+    from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+
+    _workbook_part = "xl/workbook.xml"
+    for rel_type, target in _read_rels(archive, "").values():
+        if rel_type.endswith("/officeDocument"):
+            _workbook_part = target
+    _workbook_rels = _read_rels(archive, _workbook_part)
+
+    _epoch = CALENDAR_WINDOWS_1900
+    _sheet_part = None
+    with archive.open(_workbook_part) as source:
+        for _, element in iterparse(source):
+            if element.tag == _MAIN_NS + "workbookPr" and element.get("date1904") in ("1", "true"):
+                _epoch = CALENDAR_MAC_1904
+            elif element.tag == _MAIN_NS + "sheet" and _sheet_part is None:
+                _rel_type, _target = _workbook_rels[element.get(_REL_NS + "id")]
+                if _rel_type.endswith("/worksheet"):
+                    _sheet_part = _target
+    if _sheet_part is None:
+        raise ValueError("The workbook does not contain any worksheet")
+    return _workbook_rels, _epoch, _sheet_part
+
+
+_ESTIMATE_SAMPLE_BYTES = 256 * 1024
+
+
+def estimate_sheet_rows(blob_content: bytes):
+    """
+    Return an estimate of the number of rows of the first worksheet, None if there is none, without
+    reading the whole sheet: the dimension stored at the top of the sheet xml when there is one, else
+    the uncompressed size of the sheet xml divided by the size of the rows of its first 256 KB.
+    Exported files may store a wrong dimension and the rows are not all the same size, it is an estimate.
+    """
+    from openpyxl.utils.cell import range_boundaries
+
+    with zipfile.ZipFile(io.BytesIO(blob_content)) as archive:
+        _, _, _sheet_part = _locate_first_sheet(archive)
+        _size = archive.getinfo(_sheet_part).file_size
+        with archive.open(_sheet_part) as source:
+            _head = source.read(_ESTIMATE_SAMPLE_BYTES)
+
+    _dimension = re.search(rb'<(?:\w+:)?dimension[^>]*\sref="([^"]+)"', _head)
+    if _dimension is not None:
+        try:
+            return range_boundaries(_dimension.group(1).decode())[3]
+        except (TypeError, ValueError):
+            pass
+
+    _rows = list(re.finditer(rb"<(?:\w+:)?row[\s>]", _head))
+    if not _rows:
+        return None
+    if len(_head) == _size or len(_rows) < 2:
+        # the whole sheet xml was read
+        return len(_rows)
+    # the rows left are as large as the rows read
+    _row_size = (_rows[-1].start() - _rows[0].start()) / (len(_rows) - 1)
+    return len(_rows) - 1 + round((_size - _rows[-1].start()) / _row_size)
+
+
+# a text or value element made of whitespace only, the character entities included
+_BLANK_TEXT = re.compile(rb">(?:[ \t\r\n]|&#(?:x[0-9a-fA-F]+|[0-9]+);)+</(?:\w+:)?[tv]>")
+# the whitespace and "&" mapped to a single byte, so that a single search finds the possible blank texts
+_BLANK_STARTS = bytes.maketrans(b" \t\r\n&", b"\0\0\0\0\0")
+_ERROR_CELLS = (b't="e"', b"t='e'")
+_SCAN_CHUNK_BYTES = 1024 * 1024
+
+
+def _has_unreadable_values(source) -> bool:
+    """
+    Return True if the xml part holds an error cell or a text or value element made of whitespace only.
+    The part is read by chunks, the regular expression only runs on the chunks that may match.
+    """
+    _tail = b""
+    while True:
+        _chunk = source.read(_SCAN_CHUNK_BYTES)
+        if not _chunk:
+            return False
+        _buffer = _tail + _chunk
+        if any(error_cell in _buffer for error_cell in _ERROR_CELLS):
+            return True
+        if b">\0" in _buffer.translate(_BLANK_STARTS) and _BLANK_TEXT.search(_buffer):
+            return True
+        # an element may be cut by the end of the chunk, there is no ">" after its start
+        _tail = _buffer[max(_buffer.rfind(b">"), 0):]
+
+
+def _calamine_unreadable(blob_content: bytes) -> bool:
+    """
+    Return True if the workbook holds values python-calamine reads as empty cells: the error cells and the
+    strings made of whitespace only, in the shared strings or in the first worksheet.
+    Formatted runs and character entities may give false positives, never false negatives.
+    """
+    with zipfile.ZipFile(io.BytesIO(blob_content)) as archive:
+        _workbook_rels, _, _sheet_part = _locate_first_sheet(archive)
+        _parts = [target for rel_type, target in _workbook_rels.values() if rel_type.endswith("/sharedStrings")]
+        for part in [*_parts, _sheet_part]:
+            with archive.open(part) as source:
+                if _has_unreadable_values(source):
+                    return True
+    return False
+
+
+def iter_sheetxml_rows(blob_content: bytes, max_cols: int = None):
+    """
+    Yield the rows of the first worksheet by iterparsing the sheet xml directly, limited to the first
+    max_cols columns if given (the cells right of them are not converted).
+    Cell values are converted like openpyxl does with data_only=True.
+    """
+    from openpyxl.utils.cell import coordinate_to_tuple
+
+    with zipfile.ZipFile(io.BytesIO(blob_content)) as archive:
+        _workbook_rels, _epoch, _sheet_part = _locate_first_sheet(archive)
+
+        _shared_strings = []
+        _date_styles, _timedelta_styles = set(), set()
+        for rel_type, target in _workbook_rels.values():
+            if rel_type.endswith("/sharedStrings"):
+                _shared_strings = _read_shared_strings(archive, target)
+            elif rel_type.endswith("/styles"):
+                _date_styles, _timedelta_styles = _read_date_styles(archive, target)
+
+        _expected_row = 1
+        _row_counter = 0
+        with archive.open(_sheet_part) as source:
+            for _, element in iterparse(source):
+                if element.tag != _MAIN_NS + "row":
+                    continue
+                _row_counter = int(float(element.get("r"))) if element.get("r") else _row_counter + 1
+                # rows missing from the xml are empty rows
+                for _ in range(_expected_row, _row_counter):
+                    yield ()
+                _expected_row = _row_counter + 1
+
+                _cells = {}
+                _col_counter = 0
+                for cell in element.iter(_MAIN_NS + "c"):
+                    _coordinate = cell.get("r")
+                    _col_counter = coordinate_to_tuple(_coordinate)[1] if _coordinate else _col_counter + 1
+                    if max_cols is not None and _col_counter > max_cols:
+                        break
+                    _cells[_col_counter] = _cell_value(
+                        cell, _shared_strings, _date_styles, _timedelta_styles, _epoch
+                    )
+                element.clear()
+
+                if not _cells:
+                    yield ()
+                    continue
+                _row = [None] * max(_cells)
+                for col, value in _cells.items():
+                    _row[col - 1] = value
+                yield tuple(_row)
+
+
+def _cell_value(cell, shared_strings, date_styles, timedelta_styles, epoch):
+    _data_type = cell.get("t", "n")
+    if _data_type == "inlineStr":
+        _inline = cell.find(_MAIN_NS + "is")
+        return _text_content(_inline) if _inline is not None else None
+
+    _value = cell.findtext(_MAIN_NS + "v") or None
+    if _value is None:
+        return None
+    if _data_type == "n":
+        _value = _cast_number(_value)
+        _style_id = int(cell.get("s", 0))
+        if _style_id in date_styles:
+            from openpyxl.utils.datetime import from_excel
+
+            try:
+                return from_excel(_value, epoch, timedelta=_style_id in timedelta_styles)
+            except (OverflowError, ValueError):
+                return "#VALUE!"
+        return _value
+    if _data_type == "s":
+        return shared_strings[int(_value)]
+    if _data_type == "b":
+        return bool(int(_value))
+    if _data_type == "d":
+        from openpyxl.utils.datetime import from_ISO8601
+
+        return from_ISO8601(_value)
+    # "str" (formula result) and "e" (error code) are returned as they are
+    return _value
+
+
+ENGINES = {
+    "openpyxl": iter_openpyxl_rows,
+    "calamine": iter_calamine_rows,
+    "sheetxml": iter_sheetxml_rows,
+}
+
+
+def resolve_engine(name: str = None) -> str:
+    """
+    Return the engine to use for a request: the requested one, else the EXCEL_ENGINE app setting,
+    else openpyxl. Raise ValueError for an unknown engine.
+    """
+    _engine = name or os.environ.get("EXCEL_ENGINE") or DEFAULT_ENGINE
+    if _engine not in ENGINES:
+        raise ValueError(f"Unknown excel engine '{_engine}', expected one of {sorted(ENGINES)}")
+    return _engine
+
+
+def iter_sheet_values(blob_content: bytes, engine: str = DEFAULT_ENGINE, max_cols: int = None):
+    """Yield the rows of the first worksheet of the workbook with the given engine, up to max_cols columns if given."""
+    if max_cols is None:
+        return ENGINES[resolve_engine(engine)](blob_content)
+    return ENGINES[resolve_engine(engine)](blob_content, max_cols=max_cols)
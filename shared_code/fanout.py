@@ -0,0 +1,174 @@
+"""
+Fan-out of a conversion to several outputs.
+
+A request can list several outputs in its "outputs" field, e.g. the full csv, a gzip compressed csv,
+a parquet file and a sample of the first rows:
+
+    "outputs": [
+        {"output_file": "table.csv"},
+        {"output_file": "table.csv.gz", "output_compression": "gzip"},
+        {"output_file": "table.csv.zst", "output_compression": "zstd", "output_compression_level": "small"},
+        {"output_file": "table.parquet", "output_format": "parquet"},
+        {"output_file": "sample.csv", "head": 100},
+        {"output_file": "changes.csv", "incremental": true}
+    ]
+
+The workbook is parsed and transformed once, then the outputs are serialized and uploaded as block blobs
+concurrently, by a pool of OUTPUT_FANOUT_CONCURRENCY threads (default 4).
+Every output has its own result cache manifest, the outputs already up to date are not written again.
+An incremental output only holds the rows changed since its previous conversion, written to a new blob under
+the output at every conversion, see shared_code/delta.py. It is never served from the result cache.
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shared_code import delta, result_cache
+from shared_code.outputs import (
+    content_settings, digest_options, extension, resolve_compression_level, resolve_output, write_output
+)
+from shared_code.storage import open_blob_writer
+
+
+MAX_OUTPUTS = 16
+
+_max_workers = int(os.environ.get("OUTPUT_FANOUT_CONCURRENCY", 4))
+
+
+def resolve_outputs(outputs, output_path: str) -> list:
+    """
+    Return the outputs of a request with the defaults applied, the output_path of the request is the default
+    output_path of every output. Raise ValueError for an invalid list of outputs.
+    """
+    if not isinstance(outputs, list) or not outputs:
+        raise ValueError("outputs must be a non empty list")
+    if len(outputs) > MAX_OUTPUTS:
+        raise ValueError(f"At most {MAX_OUTPUTS} outputs can be written by a request")
+
+    _resolved = []
+    for output in outputs:
+        if not isinstance(output, dict) or not output.get("output_file"):
+            raise ValueError("Every output needs an output_file")
+        _format, _compression = resolve_output(output.get("output_format"), output.get("output_compression"))
+        _level = resolve_compression_level(_compression, output.get("output_compression_level"))
+        _head = output.get("head")
+        if _head is not None and (isinstance(_head, bool) or not isinstance(_head, int) or _head <= 0):
+            raise ValueError(f"head must be a positive number of rows, got {_head!r}")
+        _incremental = bool(output.get("incremental", False))
+        if _incremental and _head is not None:
+            raise ValueError("An incremental output can not be limited to its head")
+        _resolved.append({
+            "output_path": output.get("output_path") or output_path,
+            "output_file": output["output_file"],
+            "output_format": _format,
+            "output_compression": _compression,
+            "output_compression_level": _level,
+            "head": _head,
+            "incremental": _incremental,
+        })
+
+    _locations = [(output["output_path"], output["output_file"]) for output in _resolved]
+    if len(set(_locations)) != len(_locations):
+        raise ValueError("Two outputs are written to the same blob")
+    return _resolved
+
+
+def _options(output: dict) -> dict:
+    """Options of the output changing its content, for the result cache digest."""
+    _options = digest_options(output["output_format"], output["output_compression"], output["output_compression_level"])
+    if output["head"] is not None:
+        _options["head"] = output["head"]
+    return _options
+
+
+def _summary(output: dict) -> dict:
+    return {
+        key: output[key]
+        for key in (
+            "output_path", "output_file", "output_format", "output_compression", "output_compression_level", "head",
+            "incremental"
+        )
+    }
+
+
+def lookup_outputs(outputs: list, blob_hash: str, layout: str, force: bool = False):
+    """
+    Return (pending, cached): the outputs to write and the results of the outputs already produced
+    from the same workbook, found in the result cache.
+    """
+    if not result_cache.is_enabled(force):
+        return [dict(output, digest=None) for output in outputs], []
+
+    _pending, _cached = [], []
+    for output in outputs:
+        if output["incremental"]:
+            _pending.append(dict(output, digest=None))
+            continue
+        _digest = result_cache.compute_digest(blob_hash, layout, **_options(output))
+        if result_cache.lookup(output["output_path"], output["output_file"], _digest) is None:
+            _pending.append(dict(output, digest=_digest))
+        else:
+            _cached.append({**_summary(output), "status_code": 200, "cache": "hit"})
+    return _pending, _cached
+
+
+def _write(_df, output: dict, input_path: str, input_file: str, layout: str = None, key_column: str = None) -> dict:
+    _result = _summary(output)
+    _start = time.perf_counter()
+    _settings = content_settings(output["output_format"], output["output_compression"])
+    _format_options = (output["output_format"], output["output_compression"], output["output_compression_level"])
+
+    def write(_table, path: str, file: str) -> int:
+        with open_blob_writer(path, file, content_settings=_settings) as writer:
+            write_output(_table, writer, *_format_options)
+        return writer.size
+
+    try:
+        if output["incremental"]:
+            # every delta is written to its own blob under the output, see shared_code/delta.py
+            _delta = delta.write_delta(
+                _df, output["output_path"], output["output_file"], key_column, layout, write,
+                extension(output["output_format"], output["output_compression"])
+            )
+            _size = _delta.pop("size")
+            _result.update(_delta)
+        else:
+            _table = _df.head(output["head"]) if output["head"] is not None else _df
+            _size = write(_table, output["output_path"], output["output_file"])
+    except delta.StateConflict as e:
+        logging.error(e)
+        _result["error"] = "The delta state was written by concurrent conversions of the output"
+        _result["status_code"] = 409
+        return _result
+    except Exception as e:
+        logging.error(f"Failed to write {output['output_path']}/{output['output_file']}: {e}")
+        _result["error"] = f"Failed to write to output blob: {str(e)}"
+        _result["status_code"] = 500
+        return _result
+
+    if output["digest"] is not None:
+        result_cache.record(
+            output["output_path"], output["output_file"], output["digest"], _size, input_path, input_file
+        )
+    _result["status_code"] = 200
+    _result["cache"] = "miss" if output["digest"] is not None else "disabled"
+    _result["size"] = _size
+    _result["seconds"] = round(time.perf_counter() - _start, 4)
+    return _result
+
+
+def write_outputs(
+    _df, outputs: list, input_path: str, input_file: str, layout: str = None, key_column: str = None
+) -> list:
+    """
+    Serialize and upload the table to every output concurrently, return the result of every output.
+    The incremental outputs are keyed by the key_column of the layout.
+    """
+    if len(outputs) == 1:
+        return [_write(_df, outputs[0], input_path, input_file, layout, key_column)]
+    with ThreadPoolExecutor(max_workers=max(1, min(_max_workers, len(outputs)))) as executor:
+        return list(executor.map(
+            lambda output: _write(_df, output, input_path, input_file, layout, key_column), outputs
+        ))
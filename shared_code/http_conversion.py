@@ -0,0 +1,619 @@
+"""
+Conversion of an excel file to a csv (or parquet) file, shared by the http routes of the function app.
+
+The routes only differ by the layout of the tables they accept, see shared_code/layouts.py:
+- the http-parse-to-csv route finds the layout from the unit of operation in the name of the input file,
+- the http-parse-to-csv-fb, -ff and -analytical routes accept the files of their own layout only.
+The request is validated, the result cache looked up, then the workbook is parsed, transformed and written
+with the execution plan of the layout. With "mode": "validate" only the header region of the workbook is
+checked, see shared_code/validation.py.
+
+convert_request checks the request and reads the workbook, then the conversion takes the first path that
+applies to it: _from_cache, _convert_chunked, _convert_in_pool, else _convert_in_worker. Every path builds its
+result with _success or _failure, convert_request answers it. detect_template and load_table (read, transform
+and their errors) are shared with the batch and dataset routes, convert_content (the paths) with the batch route.
+"""
+
+import azure.functions as func
+import logging
+import io
+import json
+from shared_code.excel_engines import resolve_engine
+from shared_code import (
+    admission, chunked_analytical, delta, fanout, layout_detection, parsed_cache, process_pool, result_cache,
+    validation
+)
+from shared_code.instrumentation import StageTimer
+from shared_code.layouts import find_layout, layout_plan, matches_layout, transform_layout
+from shared_code.outputs import (
+    content_settings, digest_options, extension, is_streamed_compression, resolve_compression_level, resolve_output,
+    write_output
+)
+from shared_code.storage import is_stream_output, open_blob_writer
+
+
+MODES = {"convert", "validate"}
+
+
+def validate_request(
+    excelfile: func.InputStream, input_path: str, input_file: str, output_path: str, layout: str, engine: str,
+    function_name: str
+) -> func.HttpResponse:
+    """
+    Validate the workbook without converting it (mode "validate") and return the http response.
+    The problems found, an unknown unit of operation included, are returned with a 200 status code.
+    """
+    _timer = StageTimer()
+    _result = {
+        "input_file": input_file,
+        "input_path": input_path,
+        "output_path": output_path
+    }
+    _result["mode"] = "validate"
+    _result["layout"] = layout
+
+    # the engine of a validation defaults to sheetxml, whatever the EXCEL_ENGINE app setting
+    try:
+        engine = resolve_engine(engine or validation.DEFAULT_VALIDATION_ENGINE)
+    except ValueError as e:
+        _result["error"] = str(e)
+        _result["status_code"] = 400
+        return _response(_result)
+
+    _validation = {"valid": False, "schema": [], "estimated_rows": None, "problems": []}
+    if layout is None:
+        _validation["problems"].append("The input file is not a valid file for this function")
+    else:
+        try:
+            with _timer.stage("read_blob"):
+                blob_content = excelfile.read()
+            if not blob_content:
+                raise ValueError("Blob content is empty")
+        except Exception as e:
+            _validation["problems"].append(f"Failed to read blob: {str(e)}")
+        else:
+            try:
+                with _timer.stage("validate"):
+                    _validation = validation.validate_workbook(blob_content, layout, engine)
+            except Exception as e:
+                logging.info(f"Validation failed: {e}")
+                _validation["problems"].append(f"INPUT FILE CAN'T BE LOADED: {str(e)}")
+
+    _result.update(_validation)
+    _result["status_code"] = 200
+    _result["message"] = "VALID" if _result["valid"] else "INVALID"
+    _result["timings"] = _timer.as_dict()
+    _timer.emit(
+        function_name, layout=layout, input_file=input_file, engine=engine, mode="validate",
+        valid=_result["valid"], problems=len(_result["problems"]), estimated_rows=_result["estimated_rows"]
+    )
+    return _response(_result)
+
+
+def _response(_result: dict, headers: dict = None) -> func.HttpResponse:
+    """The JSON response of a result, with the status code of the result."""
+    return func.HttpResponse(
+        json.dumps(_result, indent=4, default=str), mimetype="application/json", status_code=_result["status_code"],
+        headers=headers
+    )
+
+
+def _request_fields(conversion: dict, output_file: bool = False) -> dict:
+    """The fields of the request every result starts with."""
+    _result = {
+        "input_file": conversion.get("input_file"),
+        "input_path": conversion.get("input_path"),
+        "output_path": conversion.get("output_path")
+    }
+    if output_file:
+        _result["output_file"] = conversion.get("output_file")
+    return _result
+
+
+def _failure(conversion: dict, error: str, status_code: int, output_file: bool = False) -> dict:
+    """The result of a conversion that failed, output_file for the failures of the output blob."""
+    _result = _request_fields(conversion, output_file)
+    _result["error"] = error
+    _result["status_code"] = status_code
+    return _result
+
+
+def _success(conversion: dict, timer: StageTimer, fields: dict, **dimensions) -> dict:
+    """
+    The result of a conversion that went through, with the fields of its path and its timings,
+    its metrics are logged with the dimensions of its path.
+    """
+    _result = _request_fields(conversion)
+    _result["layout"] = conversion["layout"]
+    _result["status_code"] = fields.pop("status_code", 200)
+    _result["message"] = fields.pop("message", "SUCCESS")
+    _result.update(fields)
+    _result["timings"] = timer.as_dict()
+    timer.emit(
+        conversion["function_name"], layout=conversion["layout"], input_file=conversion["input_file"],
+        engine=conversion["engine"], template=conversion["detection"], **dimensions
+    )
+    return _result
+
+
+def read_request(req_body: dict, function_name: str) -> dict:
+    """The fields of the request body, before they are checked."""
+    return {
+        "function_name": function_name,
+        "input_path": req_body.get("input_path"),
+        "input_file": req_body.get("input_file"),
+        "output_path": req_body.get("output_path"),
+        "output_file": req_body.get("output_file"),
+        "engine": req_body.get("engine"),
+        "force": req_body.get("force", False),
+        "output_format": req_body.get("output_format"),
+        "output_compression": req_body.get("output_compression"),
+        "output_compression_level": req_body.get("output_compression_level"),
+        "stream_output": is_stream_output(req_body.get("stream_output")),
+        "outputs": req_body.get("outputs"),
+        "chunk_rows": req_body.get("chunk_rows"),
+        "incremental": req_body.get("incremental", False),
+        "mode": req_body.get("mode") or "convert",
+        "detection": None,
+    }
+
+
+def resolve_options(conversion: dict):
+    """
+    Check that the requested excel engine and output format exist and apply the defaults, in place.
+    The engine falls back on the EXCEL_ENGINE app setting. Raise ValueError for an invalid option.
+    """
+    _layout = conversion["layout"]
+    conversion["engine"] = resolve_engine(conversion["engine"])
+    conversion["output_format"], conversion["output_compression"] = resolve_output(
+        conversion["output_format"], conversion["output_compression"]
+    )
+    conversion["output_compression_level"] = resolve_compression_level(
+        conversion["output_compression"], conversion["output_compression_level"]
+    )
+    # several outputs can be written from a single parse, see shared_code/fanout.py
+    if conversion["outputs"] is not None:
+        conversion["outputs"] = fanout.resolve_outputs(conversion["outputs"], conversion["output_path"])
+    # tall exports can be converted batch by batch, see shared_code/chunked_analytical.py
+    conversion["chunk_rows"] = (
+        chunked_analytical.resolve_chunk_rows(conversion["chunk_rows"]) if layout_plan(_layout)["chunked"] else None
+    )
+    # incremental outputs only hold the rows changed since the previous conversion, see shared_code/delta.py
+    if conversion["incremental"] or any(output["incremental"] for output in conversion["outputs"] or []):
+        if layout_plan(_layout)["key_column"] is None:
+            raise ValueError(f"Incremental outputs need a key column, the {_layout} layout has none")
+
+    # the content encoding of a compressed csv is set on the blob, it is written by the storage SDK
+    if conversion["outputs"] is None and is_streamed_compression(
+        conversion["output_format"], conversion["output_compression"]
+    ):
+        conversion["stream_output"] = True
+    conversion["content_settings"] = content_settings(conversion["output_format"], conversion["output_compression"])
+
+
+def _read_blob(excelfile: func.InputStream, timer: StageTimer) -> bytes:
+    """Return the content of the input blob, raise if it can not be read or is empty."""
+    with timer.stage("read_blob"):
+        blob_content = excelfile.read()
+    if not blob_content:
+        raise ValueError("Blob content is empty")
+    return blob_content
+
+
+class LoadError(Exception):
+    """A workbook whose table can not be loaded, with the error and the status code of its result."""
+
+    def __init__(self, error: str, status_code: int):
+        super().__init__(error)
+        self.error = error
+        self.status_code = status_code
+
+
+def detect_template(conversion: dict, blob_content: bytes, timer: StageTimer):
+    """
+    Detect the template of the workbook from its header region, see shared_code/layout_detection.py.
+    The layout of the conversion is replaced by its template and its detection is kept, in place.
+    """
+    with timer.stage("detect_layout"):
+        conversion["layout"], conversion["detection"] = layout_detection.detect(
+            blob_content, conversion["layout"], conversion["input_file"]
+        )
+    logging.info(f"input_file: {conversion['input_file']}, template: {conversion['layout']} ({conversion['detection']})")
+
+
+def load_table(conversion: dict, load_content, timer: StageTimer):
+    """
+    Read the table of the workbook with the offsets of its layout and transform it, return (table, parsed):
+    parsed tells if the table was parsed or found in the parsed tables cache. load_content returns the content
+    of the workbook, it is only called when the table is not cached. Raise LoadError for a workbook that can
+    not be read (406), an empty table (406) or a table that can not be transformed (500).
+    """
+    try:
+        with timer.stage("read_excel"):
+            # a table parsed by a previous or concurrent request for the same workbook is reused
+            _df, _parsed = parsed_cache.read_table(
+                load_content, conversion["blob_hash"], conversion["layout"], conversion["engine"]
+            )
+    except Exception as e:
+        logging.info(f"The workbook can not be read: {e}")
+        raise LoadError("INPUT FILE CAN'T BE LOADED", 406) from e
+
+    if _df.empty:
+        raise LoadError("EMPTY DATAFRAME", 406)
+
+    logging.debug("Initial DataFrame filename: %s", conversion["input_file"])
+    try:
+        with timer.stage("transform"):
+            _df = transform_layout(_df, conversion["layout"])
+    except Exception as e:
+        logging.error(e)
+        raise LoadError("Error parsing the data frame", 500) from e
+    return _df, _parsed
+
+
+def convert_request(
+    req: func.HttpRequest, excelfile: func.InputStream, outputblob: func.Out[func.InputStream],
+    layout: str = None, function_name: str = "http_parse_to_csv"
+) -> func.HttpResponse:
+    """
+    Convert the workbook of the request and return the http response, function_name names the metrics.
+    The layout of the workbook is found from the name of the input file when layout is None.
+    The request is checked here, then the conversion goes through the first of its paths that applies:
+    result cache, chunked conversion, parse pool, or parse in the worker.
+    """
+    _timer = StageTimer()
+    logging.info("Python HTTP trigger function processed a request.")
+
+    try:
+        req_body = req.get_json()
+    except ValueError:
+        req_body = None
+    if not isinstance(req_body, dict):
+        return _response({"error": "The request body must be a JSON object", "status_code": 400})
+    conversion = read_request(req_body, function_name)
+
+    if None in {conversion["input_path"], conversion["input_file"], conversion["output_path"]}:
+        return _response(_failure(conversion, "MANDATORY PARAMETERS ARE MISSING", 400))
+
+    # the layout of the generic route is found from the unit of operation in its name,
+    # the routes of a layout only accept the files of their own layout
+    input_file = conversion["input_file"]
+    _route_layout = layout
+    if layout is None:
+        layout = find_layout(input_file)
+    elif not matches_layout(input_file, layout):
+        layout = None
+    logging.info(f"input_file: {input_file}, layout: {layout}")
+
+    # Only check the header region of the workbook, nothing is converted nor written.
+    if conversion["mode"] == "validate":
+        return validate_request(
+            excelfile, conversion["input_path"], input_file, conversion["output_path"], layout, conversion["engine"],
+            function_name
+        )
+    if conversion["mode"] not in MODES:
+        return _response(
+            _failure(conversion, f"Unknown mode '{conversion['mode']}', expected one of {sorted(MODES)}", 400)
+        )
+
+    conversion["layout"] = layout
+    # the template of the workbook is detected from its header region, see shared_code/layout_detection.py
+    blob_content = None
+    if layout_detection.is_enabled() and (layout is not None or _route_layout is None):
+        try:
+            blob_content = _read_blob(excelfile, _timer)
+        except Exception as e:
+            return _response(_failure(conversion, f"Failed to read blob: {str(e)}", 406))
+        detect_template(conversion, blob_content, _timer)
+
+    if conversion["layout"] is None:
+        return _response(_failure(conversion, "The input file is not a valid file for this function", 400))
+
+    try:
+        resolve_options(conversion)
+    except ValueError as e:
+        return _response(_failure(conversion, str(e), 400))
+
+    ##### read from blob #####
+    try:
+        if blob_content is None:
+            blob_content = _read_blob(excelfile, _timer)
+    except Exception as e:
+        return _response(_failure(conversion, f"Failed to read blob: {str(e)}", 406))
+
+    # the content hash identifies the workbook for the result cache and the parsed tables
+    conversion["blob_hash"] = parsed_cache.content_hash(blob_content)
+
+    return _response(convert_content(conversion, lambda: blob_content, outputblob, _timer))
+
+
+def convert_content(conversion: dict, load_content, outputblob, timer: StageTimer) -> dict:
+    """
+    Convert the workbook of a checked conversion (read_request, resolve_options, blob_hash) through the first
+    of its paths that applies and return its result. load_content returns the content of the workbook, it is
+    only called by the paths that need it. The output binding is only used without stream_output.
+    """
+    for convert_path in (_from_cache, _convert_chunked, _convert_in_pool):
+        _result = convert_path(conversion, load_content, outputblob, timer)
+        if _result is not None:
+            return _result
+    return _convert_in_worker(conversion, load_content, outputblob, timer)
+
+
+def _from_cache(conversion: dict, load_content, outputblob, timer: StageTimer):
+    """
+    Skip the outputs already produced from the same content, and the conversion if all of them are.
+    Return the result when nothing is left to write, else None; the outputs left to write and the digest
+    of the output are kept in the conversion.
+    """
+    if conversion["outputs"] is not None:
+        with timer.stage("cache_lookup"):
+            conversion["pending"], conversion["cached"] = fanout.lookup_outputs(
+                conversion["outputs"], conversion["blob_hash"], conversion["layout"], conversion["force"]
+            )
+        if not conversion["pending"]:
+            return _success(
+                conversion, timer, {"cache": "hit", "outputs": conversion["cached"]},
+                outputs=len(conversion["outputs"]), cache="hit"
+            )
+
+    # an incremental output depends on the previous conversion, it is never served from the cache
+    conversion["digest"] = None
+    if conversion["outputs"] is None and not conversion["incremental"] and result_cache.is_enabled(conversion["force"]):
+        with timer.stage("cache_lookup"):
+            conversion["digest"] = result_cache.compute_digest(
+                conversion["blob_hash"], conversion["layout"], **digest_options(
+                    conversion["output_format"], conversion["output_compression"], conversion["output_compression_level"]
+                )
+            )
+            _manifest = result_cache.lookup(conversion["output_path"], conversion["output_file"], conversion["digest"])
+        if _manifest is not None:
+            return _success(conversion, timer, {"cache": "hit"}, output_format=conversion["output_format"], cache="hit")
+    return None
+
+
+def _record(conversion: dict, output_size: int):
+    """Record the conversion in the result cache."""
+    if conversion["digest"] is not None:
+        result_cache.record(
+            conversion["output_path"], conversion["output_file"], conversion["digest"], output_size,
+            conversion["input_path"], conversion["input_file"]
+        )
+
+
+def _cache_status(conversion: dict) -> str:
+    return "miss" if conversion["digest"] is not None else "disabled"
+
+
+def _convert_chunked(conversion: dict, load_content, outputblob, timer: StageTimer):
+    """
+    Convert the export batch by batch, in bounded memory, the csv is the same. Return None when the
+    export is converted at once: a table already parsed by a previous request, or an export the chunked
+    conversion can not convert with the same result.
+    """
+    chunk_rows = conversion["chunk_rows"]
+    engine = conversion["engine"]
+    if chunk_rows is None or conversion["outputs"] is not None or conversion["incremental"] \
+            or conversion["output_format"] != "csv" \
+            or parsed_cache.is_cached(conversion["blob_hash"], conversion["layout"], engine):
+        return None
+
+    _plan = None
+    try:
+        with timer.stage("chunked_plan"):
+            _plan = chunked_analytical.plan_chunks(load_content(), engine, chunk_rows)
+    except Exception as e:
+        # the generic path reports the errors
+        logging.info(f"Chunked conversion not possible: {e}")
+    if _plan is None:
+        logging.info("The export is converted at once")
+        return None
+
+    # the batches are always staged to the blob, the output binding would hold the whole csv in memory
+    try:
+        with timer.stage("chunked_write"):
+            with _blob_writer(conversion) as writer:
+                _df_head = chunked_analytical.write_chunks(
+                    load_content(), _plan, writer, engine, chunk_rows, conversion["output_compression"],
+                    conversion["output_compression_level"]
+                )
+    except chunked_analytical.ChunkedConversionError as e:
+        logging.error(f"Chunked conversion failed ({e.stage}): {e}")
+        if e.stage == "read":
+            return _failure(conversion, "INPUT FILE CAN'T BE LOADED", 406)
+        return _failure(conversion, "Error parsing the data frame", 500)
+    except Exception as e:
+        logging.error(e)
+        return _failure(conversion, f"Failed to write to output blob: {str(e)}", 500, output_file=True)
+
+    _record(conversion, writer.size)
+    return _success(
+        conversion, timer,
+        {
+            "first_5_rows": _df_head.to_json(orient='records'), "cache": _cache_status(conversion),
+            "parsed": "chunked", "rows": _plan["rows"]
+        },
+        output_format=conversion["output_format"], cache=_cache_status(conversion), parsed="chunked",
+        chunk_rows=chunk_rows, rows=_plan["rows"], **admission.stats()
+    )
+
+
+def _blob_writer(conversion: dict):
+    """Writer staging the output to the blob block by block, the output is never held in memory as a whole."""
+    return open_blob_writer(
+        conversion["output_path"], conversion["output_file"], content_settings=conversion["content_settings"]
+    )
+
+
+def _convert_in_pool(conversion: dict, load_content, outputblob, timer: StageTimer):
+    """
+    Parse, transform and serialize in a process of the parse pool, on another core. Return None when the
+    conversion runs in the worker: pool disabled, conversions using the parsed table itself, or a table
+    already parsed by a previous request.
+    """
+    if not process_pool.is_enabled() or conversion["outputs"] is not None or conversion["incremental"] \
+            or parsed_cache.is_cached(conversion["blob_hash"], conversion["layout"], conversion["engine"]):
+        return None
+
+    try:
+        with timer.stage("pool_convert"):
+            _converted = process_pool.convert(
+                load_content(), conversion["layout"], conversion["engine"], conversion["output_format"],
+                conversion["output_compression"], conversion["output_compression_level"]
+            )
+    except Exception as e:
+        logging.error(f"Parse pool conversion failed: {e}")
+        return _failure(conversion, "Error parsing the data frame", 500)
+
+    if "error" in _converted:
+        logging.info(f"Parse pool conversion failed ({_converted['error']}): {_converted['message']}")
+        return _failure(
+            conversion,
+            {"read": "INPUT FILE CAN'T BE LOADED", "empty": "EMPTY DATAFRAME"}.get(
+                _converted["error"], "Error parsing the data frame"
+            ),
+            500 if _converted["error"] == "transform" else 406
+        )
+
+    try:
+        with timer.stage("write_output"):
+            if conversion["stream_output"]:
+                with _blob_writer(conversion) as writer:
+                    writer.write(_converted["output"])
+                _output_size = writer.size
+            else:
+                outputblob.set(_converted["output"])
+                _output_size = len(_converted["output"])
+    except Exception as e:
+        return _failure(conversion, f"Failed to write to output blob: {str(e)}", 500, output_file=True)
+
+    _record(conversion, _output_size)
+    return _success(
+        conversion, timer,
+        {
+            "first_5_rows": _converted["head"], "cache": _cache_status(conversion), "parsed": "pool",
+            "rows": _converted["rows"]
+        },
+        output_format=conversion["output_format"], cache=_cache_status(conversion), parsed="pool",
+        rows=_converted["rows"], **process_pool.stats(), **admission.stats()
+    )
+
+
+def _convert_in_worker(conversion: dict, load_content, outputblob, timer: StageTimer) -> dict:
+    """Parse and transform the workbook in the worker, then write its outputs."""
+    try:
+        _df, _parsed = load_table(conversion, load_content, timer)
+    except LoadError as e:
+        return _failure(conversion, e.error, e.status_code)
+
+    # get the first 5 rows of the dataframe to check the output in the response upon success.
+    _head = _df.head().to_json(orient='records')
+
+    if conversion["outputs"] is not None:
+        return _write_outputs(conversion, _df, _head, _parsed, timer)
+    return _write_output(conversion, _df, _head, _parsed, outputblob, timer)
+
+
+def _write_outputs(conversion: dict, _df, _head: str, _parsed: str, timer: StageTimer) -> dict:
+    """Write every output from the same table, concurrently."""
+    with timer.stage("write_output"):
+        _outputs = conversion["cached"] + fanout.write_outputs(
+            _df, conversion["pending"], conversion["input_path"], conversion["input_file"],
+            layout=conversion["layout"], key_column=layout_plan(conversion["layout"])["key_column"]
+        )
+    _failed = sum(1 for output in _outputs if output["status_code"] != 200)
+    return _success(
+        conversion, timer,
+        {
+            "status_code": 200 if not _failed else 207, "message": "SUCCESS" if not _failed else "SOME OUTPUTS FAILED",
+            "first_5_rows": _head, "outputs": _outputs, "parsed": _parsed
+        },
+        outputs=len(_outputs), failed=_failed, parsed=_parsed, **parsed_cache.stats(), **admission.stats()
+    )
+
+
+def _write_output(conversion: dict, _df, _head: str, _parsed: str, outputblob, timer: StageTimer) -> dict:
+    """Write the table, or the rows changed since the previous conversion, to the output blob."""
+    if conversion["incremental"]:
+        return _write_delta(conversion, _df, _head, _parsed, timer)
+
+    _written = _write_table(conversion, _df, outputblob, timer)
+    if isinstance(_written, dict):
+        return _written
+    _record(conversion, _written)
+    return _success(
+        conversion, timer,
+        {"first_5_rows": _head, "cache": _cache_status(conversion), "parsed": _parsed, "rows": len(_df)},
+        output_format=conversion["output_format"], cache=_cache_status(conversion), parsed=_parsed,
+        **parsed_cache.stats(), **admission.stats()
+    )
+
+
+def _write_delta(conversion: dict, _df, _head: str, _parsed: str, timer: StageTimer) -> dict:
+    """
+    Write the rows changed since the previous conversion of the output and the tombstones of the deleted ones
+    to a new delta blob under the output, then save the state, see shared_code/delta.py.
+    """
+    _options = (conversion["output_format"], conversion["output_compression"], conversion["output_compression_level"])
+
+    def write(_table, path: str, file: str) -> int:
+        # the deltas are always staged to their own blob, the output binding is bound to the output itself
+        with open_blob_writer(path, file, content_settings=conversion["content_settings"]) as writer:
+            write_output(_table, writer, *_options)
+        return writer.size
+
+    try:
+        with timer.stage("delta"):
+            _delta = delta.write_delta(
+                _df, conversion["output_path"], conversion["output_file"],
+                layout_plan(conversion["layout"])["key_column"], conversion["layout"], write,
+                extension(conversion["output_format"], conversion["output_compression"])
+            )
+    except delta.StateConflict as e:
+        logging.error(e)
+        return _failure(
+            conversion, "The delta state was written by concurrent conversions of the output", 409, output_file=True
+        )
+    except Exception as e:
+        logging.error(e)
+        return _failure(conversion, f"Failed to write the delta: {str(e)}", 500, output_file=True)
+
+    return _success(
+        conversion, timer,
+        {
+            "first_5_rows": _head, "cache": _cache_status(conversion), "parsed": _parsed,
+            "delta": _delta["delta"], "delta_file": _delta["delta_file"], "size": _delta["size"]
+        },
+        output_format=conversion["output_format"], cache=_cache_status(conversion), parsed=_parsed,
+        **_delta["delta"], **parsed_cache.stats(), **admission.stats()
+    )
+
+
+def _write_table(conversion: dict, _table, outputblob, timer: StageTimer):
+    """Serialize and write the table to the output blob, return the size written or the failure result."""
+    _options = (conversion["output_format"], conversion["output_compression"], conversion["output_compression_level"])
+
+    # convert table to the output format, a streamed output is serialized while it is uploaded
+    if not conversion["stream_output"]:
+        try:
+            with timer.stage("serialize"):
+                buffer = io.BytesIO()
+                write_output(_table, buffer, *_options)
+            logging.debug("DataFrame converted to %s", conversion["output_format"])
+        except Exception as e:
+            logging.error(e)
+            return _failure(conversion, "Error parsing the data frame", 500)
+
+    # Write the data to the output blob.
+    try:
+        with timer.stage("write_output"):
+            if conversion["stream_output"]:
+                # stage the output block by block, it is never held in memory as a whole
+                with _blob_writer(conversion) as writer:
+                    write_output(_table, writer, *_options)
+                return writer.size
+            _output = buffer.getvalue()
+            outputblob.set(_output)
+            return len(_output)
+    except Exception as e:
+        return _failure(conversion, f"Failed to write to output blob: {str(e)}", 500, output_file=True)
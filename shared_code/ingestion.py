@@ -0,0 +1,90 @@
+"""
+Queue messages of the event-driven ingestion, see blueprints/queue_parse_to_csv.py.
+
+The ingestion queue receives two kinds of messages:
+- the BlobCreated events of the input storage account, delivered by an Event Grid subscription to the queue
+  (Event Grid or CloudEvents schema): the blob of the event is converted to the INGESTION_OUTPUT_PATH folder,
+  with the default output file name of the batch route,
+- conversion requests, a JSON object with the fields of a batch item (input_path, input_file, output_path,
+  output_file) and optionally the engine, output_format, output_compression, output_compression_level and force
+  fields of the batch route.
+
+The result of a conversion tells whether its message can be retried: an invalid message, a file that is not valid
+for any layout (400), can't be loaded or is empty (406) fails the same way every time, its message goes straight
+to the dead-letter queue. The other failures (429 admission rejections, storage errors) are retried by the host.
+"""
+
+import json
+import os
+import posixpath
+
+
+BLOB_CREATED_EVENT = "Microsoft.Storage.BlobCreated"
+
+# the failures that a retry would not fix, a 406 can also be a failed download of the blob
+PERMANENT_ERRORS = {"INPUT FILE CAN'T BE LOADED", "EMPTY DATAFRAME"}
+
+# fields of a conversion request message passed to the conversion as options
+_OPTION_FIELDS = ("engine", "output_format", "output_compression", "output_compression_level", "force")
+
+
+def _blob_created_item(event: dict) -> dict:
+    """Return the batch item of a BlobCreated event, the subject is /blobServices/default/containers/<c>/blobs/<name>."""
+    _output_path = os.environ.get("INGESTION_OUTPUT_PATH")
+    if not _output_path:
+        raise ValueError("The app setting INGESTION_OUTPUT_PATH is not defined, BlobCreated events can't be converted")
+
+    _, _, _blob = event.get("subject", "").partition("/containers/")
+    _container, _separator, _name = _blob.partition("/blobs/")
+    if not _container or not _separator or not _name:
+        raise ValueError(f"The subject of the event is not a blob: {event.get('subject')}")
+    _folder, _file = posixpath.split(_name)
+    return {
+        "input_path": f"{_container}/{_folder}" if _folder else _container,
+        "input_file": _file,
+        "output_path": _output_path,
+    }
+
+
+def parse_message(body: str):
+    """
+    Return (item, options) of a message of the ingestion queue: the batch item to convert and the conversion
+    options of the message. Raise ValueError for a message that can't be converted.
+    """
+    try:
+        _message = json.loads(body)
+    except ValueError:
+        raise ValueError("The message is not a JSON object")
+    # Event Grid delivers a single event per message, some tools wrap it in a list
+    if isinstance(_message, list) and len(_message) == 1:
+        _message = _message[0]
+    if not isinstance(_message, dict):
+        raise ValueError("The message is not a JSON object")
+
+    _event_type = _message.get("eventType", _message.get("type"))
+    if _event_type is not None:
+        if _event_type != BLOB_CREATED_EVENT:
+            raise ValueError(f"Unexpected event type {_event_type}, expected {BLOB_CREATED_EVENT}")
+        return _blob_created_item(_message), {}
+
+    _item = {key: _message.get(key) for key in ("input_path", "input_file", "output_path", "output_file")}
+    _options = {key: _message[key] for key in _OPTION_FIELDS if key in _message}
+    return _item, _options
+
+
+def is_permanent(result: dict) -> bool:
+    """Return True when the conversion failed in a way a retry would not fix."""
+    return result.get("status_code") == 400 or (
+        result.get("status_code") == 406 and result.get("error") in PERMANENT_ERRORS
+    )
+
+
+def dead_letter(body: str, dequeue_count: int, result: dict) -> str:
+    """Return the dead-letter message of a message that can't be converted: the message and why it failed."""
+    return json.dumps({
+        "message": body,
+        "dequeue_count": dequeue_count,
+        "status_code": result.get("status_code"),
+        "error": result.get("error"),
+        "result": result,
+    }, default=str)
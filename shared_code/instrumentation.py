@@ -0,0 +1,169 @@
+"""
+Per-stage instrumentation of the conversions.
+
+StageTimer records, for each stage of a conversion (blob read, excel read, transform, serialization,
+output write), its wall time, the CPU time of the invocation thread and the memory of the worker:
+- rss_mb: resident memory of the worker at the end of the stage,
+- peak_rss_mb: peak resident memory of the worker during the stage, sampled from /proc/self/statm every
+  RSS_SAMPLE_INTERVAL seconds (default 0.01) by a background thread while stages are running,
+- peak_traced_mb: peak of the memory allocated by python during the stage, only with the TRACE_MEMORY
+  app setting, tracemalloc slows every allocation down and is shared by the concurrent invocations.
+
+The stages are returned in the "timings" block of the responses and logged as one structured
+"conversion_metrics" record, with the stages as custom dimensions for Application Insights.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+_trace_memory = os.environ.get("TRACE_MEMORY", "false").lower() in ("true", "1", "yes")
+if _trace_memory and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+_page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_sample_interval = float(os.environ.get("RSS_SAMPLE_INTERVAL", 0.01))
+
+
+def _rss_pages():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _pages_mb(pages):
+    return None if pages is None else round(pages * _page_size / 2**20, 1)
+
+
+def rss_mb():
+    """Resident memory of the worker in MB, None if it can not be read."""
+    return _pages_mb(_rss_pages())
+
+
+def peak_rss_mb():
+    """Peak resident memory of the worker since it started in MB, None if it can not be read."""
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class _RssSampler:
+    """
+    Background thread sampling the resident memory of the worker while stages are running.
+    Every running stage keeps the peak of the samples taken since it started, the thread waits
+    without sampling when no stage is running.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._peaks = {}
+        self._thread = None
+
+    def start(self) -> object:
+        """Start following the memory of a stage, return its token."""
+        _token = object()
+        with self._lock:
+            self._peaks[_token] = _rss_pages()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._lock.notify()
+        return _token
+
+    def stop(self, token: object):
+        """Stop following the stage, return its peak resident memory in pages."""
+        _pages = _rss_pages()
+        with self._lock:
+            _peak = self._peaks.pop(token)
+        if _pages is None or _peak is None:
+            return _pages
+        return max(_peak, _pages)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._peaks:
+                    self._lock.wait()
+            _pages = _rss_pages()
+            if _pages is not None:
+                with self._lock:
+                    for token, peak in self._peaks.items():
+                        if peak is not None and _pages > peak:
+                            self._peaks[token] = _pages
+            time.sleep(_sample_interval)
+
+
+_sampler = _RssSampler()
+
+
+class StageTimer:
+    """Collect the wall time, CPU time and memory of the stages of a conversion."""
+
+    def __init__(self):
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        _wall = time.perf_counter()
+        _cpu = time.thread_time()
+        if _trace_memory:
+            tracemalloc.reset_peak()
+        _token = _sampler.start()
+        try:
+            yield
+        finally:
+            _peak = _sampler.stop(_token)
+            _stage = {
+                "wall_s": round(time.perf_counter() - _wall, 4),
+                "cpu_s": round(time.thread_time() - _cpu, 4),
+                "rss_mb": rss_mb(),
+                "peak_rss_mb": _pages_mb(_peak),
+            }
+            if _trace_memory:
+                _stage["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            self.stages[name] = _stage
+
+    def as_dict(self) -> dict:
+        """Stages recorded so far and the total wall time since the timer was created."""
+        _timings = dict(self.stages)
+        _timings["total_s"] = round(time.perf_counter() - self._start, 4)
+        return _timings
+
+    def emit(self, function_name: str, **dimensions):
+        """Log the stages as a structured record, flattened as custom dimensions."""
+        _dimensions = {"function": function_name, **dimensions}
+        for stage, values in self.stages.items():
+            for key, value in values.items():
+                _dimensions[f"{stage}_{key}"] = value
+        _dimensions["total_s"] = self.as_dict()["total_s"]
+        logging.info(
+            "conversion_metrics %s", json.dumps(_dimensions, default=str),
+            extra={"custom_dimensions": _dimensions}
+        )
+
+
+class lazy:
+    """
+    Defer an expensive log argument until the record is actually formatted:
+    logging.debug("Columns: %s", lazy(lambda: _df.columns.tolist())) costs nothing when debug is disabled.
+    """
+
+    def __init__(self, func):
+        self._func = func
+
+    def __str__(self) -> str:
+        return str(self._func())
@@ -0,0 +1,291 @@
+"""
+Detection of the template of a workbook from the fingerprint of its header region.
+
+The layouts read their table at fixed offsets (shared_code.layouts.LAYOUT_SPECS), a template with a row
+inserted above the header or a column added on the left fails as a whole. With the LAYOUT_DETECTION app
+setting set to "fingerprint", the template of every workbook is detected before it is converted:
+- only the top-left region of the sheet is read, once (SCAN_ROWS x SCAN_COLS cells, sheetxml engine),
+- the fingerprint of its header region (the first REGION_ROWS x REGION_COLS cells) is made of the rows holding the anchors of the layouts (their id column and typed columns,
+  e.g. "Parameter name pivot"): their position and their labels, the values of the other rows do not matter.
+  A region without anchors is fingerprinted by the kind of its cells (text, number, date, bool, empty),
+- a known fingerprint gives the layout and the offsets of its template at once,
+- an unknown one falls back to a scan of the whole region read for the anchors of the layouts:
+  the row of the anchors is the first row of the table, the table starts at the column of the anchors less their
+  column in the table (anchor_columns of the layout spec). The template found is added to the cache of known
+  templates.
+
+The known templates are kept in memory by every worker and persisted, with their column plan (the header
+labels), in the LAYOUT_FINGERPRINTS_PATH folder ({path}/fingerprints.json) of the output storage account.
+The workers merge their templates into this file with conditional writes, a worker that saved after it was
+read merges again, up to SAVE_ATTEMPTS times.
+The layout found in the file name is kept when it disagrees with the template, and used with its own offsets
+when no anchor is found: the fb layout has no anchor in its header region, its templates are not detected and
+its workbooks are not read by the detection.
+A template at other offsets is converted with a variant of its layout, e.g. "ff@8:1", see
+shared_code.layouts.template_layout.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+from contextlib import closing
+
+from shared_code.excel_engines import iter_sheet_values
+from shared_code.layouts import LAYOUTS, template_layout
+from shared_code.storage import OUTPUT_CONNECTION, download_blob, download_blob_version, upload_blob
+
+
+REGION_ROWS = 16
+REGION_COLS = 16
+SCAN_ROWS = 64
+SCAN_COLS = 64
+
+FINGERPRINTS_FILE = "fingerprints.json"
+SAVE_ATTEMPTS = 5
+
+_enabled = os.environ.get("LAYOUT_DETECTION", "filename").lower() == "fingerprint"
+_fingerprints_path = os.environ.get("LAYOUT_FINGERPRINTS_PATH")
+_max_templates = int(os.environ.get("LAYOUT_FINGERPRINTS_MAX", 1000))
+
+_lock = threading.Lock()
+_templates = None
+_stats = {"known": 0, "scanned": 0, "undetected": 0}
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _anchors(spec: dict) -> dict:
+    """Return the header labels identifying the table of a layout and their column in the table."""
+    if "anchor_columns" in spec:
+        return dict(spec["anchor_columns"])
+    if spec.get("transpose") or not spec.get("id_column"):
+        # the id column of a transposed layout is the name of a row of the output, not a label of the sheet
+        return {}
+    return {spec["id_column"]: 0}
+
+
+ANCHORS = {name: _anchors(plan["spec"]) for name, plan in LAYOUTS.items()}
+_ANCHOR_LABELS = {anchor for anchors in ANCHORS.values() for anchor in anchors}
+
+
+def read_region(blob_content: bytes, rows: int, cols: int) -> list:
+    """Return the values of the first rows x cols cells of the sheet."""
+    _region = []
+    with closing(iter_sheet_values(blob_content, "sheetxml", max_cols=cols)) as sheet_rows:
+        for row in sheet_rows:
+            _region.append(list(row[:cols]))
+            if len(_region) == rows:
+                break
+    return _region
+
+
+def header_region(region: list) -> list:
+    """Return the first REGION_ROWS x REGION_COLS cells of a region read with more rows and columns."""
+    return [row[:REGION_COLS] for row in region[:REGION_ROWS]]
+
+
+def _labels(row: list) -> str:
+    """Return the labels of a row, the trailing empty cells left out whatever the width the row was read with."""
+    _values = list(row)
+    while _values and _values[-1] is None:
+        _values.pop()
+    return ",".join("" if value is None else str(value) for value in _values)
+
+
+def _token(value) -> str:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return "_"
+    if isinstance(value, str):
+        return f"={value}" if value in _ANCHOR_LABELS else "T"
+    if isinstance(value, bool):
+        return "B"
+    if isinstance(value, (int, float)):
+        return "N"
+    return "D"
+
+
+def _shape(row: list) -> str:
+    """Return the kinds of the cells of a row, repeated kinds collapsed and the trailing empty cells left out."""
+    _tokens = []
+    for value in row:
+        _token_value = _token(value)
+        if _tokens and _tokens[-1].rstrip("+") == _token_value:
+            _tokens[-1] = f"{_token_value}+"
+        else:
+            _tokens.append(_token_value)
+    while _tokens and _tokens[-1].rstrip("+") == "_":
+        _tokens.pop()
+    return ",".join(_tokens)
+
+
+def fingerprint(region: list) -> str:
+    """Return the fingerprint of the header region, see the module docstring."""
+    _anchor_rows = [
+        number for number, row in enumerate(region)
+        if any(isinstance(value, str) and value in _ANCHOR_LABELS for value in row)
+    ]
+    if _anchor_rows:
+        # the rows of the header and their labels, the rows above them only by their number
+        _parts = [f"{number}:{_labels(region[number])}" for number in _anchor_rows]
+    else:
+        _parts = [_shape(row) for row in region]
+    return hashlib.sha256("|".join(_parts).encode()).hexdigest()[:16]
+
+
+def scan(region: list, layouts: list):
+    """
+    Look for the anchors of the layouts in the region, return (layout, first row, skipped columns, columns)
+    of the first layout whose anchors are all on one row at their columns of the table, None if there is none.
+    """
+    for layout in layouts:
+        _anchors = ANCHORS[layout]
+        if not _anchors:
+            continue
+        for row_number, row in enumerate(region):
+            _positions = {value: col for col, value in enumerate(row) if isinstance(value, str) and value in _anchors}
+            if len(_positions) != len(_anchors):
+                continue
+            # every anchor is shifted by the columns inserted on the left of the table
+            _shifts = {_positions[anchor] - column for anchor, column in _anchors.items()}
+            if len(_shifts) != 1 or min(_shifts) < 0:
+                continue
+            _skip_cols = _shifts.pop()
+            _columns = [value for value in row[_skip_cols:]]
+            while _columns and _columns[-1] is None:
+                _columns.pop()
+            return layout, row_number, _skip_cols, [None if value is None else str(value) for value in _columns]
+    return None
+
+
+##### known templates #####
+
+def _load() -> dict:
+    """Return the known templates, read once per worker from the persisted cache."""
+    global _templates
+    with _lock:
+        if _templates is not None:
+            return _templates
+    _loaded = {}
+    if _fingerprints_path:
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            _loaded = json.loads(download_blob(_fingerprints_path, FINGERPRINTS_FILE, connection=OUTPUT_CONNECTION))
+        except ResourceNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning(f"Template fingerprints could not be read from {_fingerprints_path}: {e}")
+    with _lock:
+        if _templates is None:
+            _templates = _loaded
+        return _templates
+
+
+def _trim(known: dict):
+    """Keep at most LAYOUT_FINGERPRINTS_MAX templates, the oldest ones are forgotten first."""
+    while len(known) > _max_templates:
+        del known[min(known, key=lambda name: known[name].get("first_seen", ""))]
+
+
+def _save(key: str, template: dict):
+    """Add a template to the known templates and to the persisted cache. Failures are only logged."""
+    _known = _load()
+    with _lock:
+        _known[key] = template
+        _trim(_known)
+    if not _fingerprints_path:
+        return
+    try:
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+        for _attempt in range(1, SAVE_ATTEMPTS + 1):
+            # merge with the templates learnt by the other workers since the cache was read
+            try:
+                _content, _etag = download_blob_version(
+                    _fingerprints_path, FINGERPRINTS_FILE, connection=OUTPUT_CONNECTION
+                )
+                _persisted = json.loads(_content)
+            except ResourceNotFoundError:
+                _persisted, _etag = {}, None
+            with _lock:
+                for name, value in _persisted.items():
+                    _known.setdefault(name, value)
+                _trim(_known)
+                _snapshot = json.dumps(_known, indent=2)
+            try:
+                upload_blob(
+                    _fingerprints_path, FINGERPRINTS_FILE, _snapshot.encode(), etag=_etag, if_missing=_etag is None
+                )
+                return
+            except (ResourceExistsError, ResourceModifiedError):
+                # another worker saved its templates since they were read, merge them again
+                logging.info(f"Template fingerprints saved by another worker, attempt {_attempt} of {SAVE_ATTEMPTS}")
+        logging.warning(f"Template fingerprints could not be written to {_fingerprints_path}: too many conflicts")
+    except Exception as e:
+        logging.warning(f"Template fingerprints could not be written to {_fingerprints_path}: {e}")
+
+
+def detect(blob_content: bytes, layout: str = None, input_file: str = None):
+    """
+    Return (layout, detection) for the workbook: the layout or template variant to convert it with, and how it
+    was found ("known", "scanned" or "undetected"). layout is the layout found in the file name, None if there
+    is none: only its templates are detected, and it is returned as it is when none is found.
+    """
+    _candidates = [layout] if layout is not None else list(LAYOUTS)
+    if not any(ANCHORS[candidate] for candidate in _candidates):
+        # e.g. fb: there is nothing to look for in the header region
+        with _lock:
+            _stats["undetected"] += 1
+        return layout, "undetected"
+    try:
+        # the header region is the top-left corner of the scanned region, the workbook is read once
+        _region = read_region(blob_content, SCAN_ROWS, SCAN_COLS)
+    except Exception as e:
+        # a workbook that can't be read fails later with the error of its conversion
+        logging.info(f"The header region of {input_file} could not be read: {e}")
+        with _lock:
+            _stats["undetected"] += 1
+        return layout, "undetected"
+    _key = fingerprint(header_region(_region))
+
+    _template = _load().get(_key)
+    if _template is not None and _template["layout"] in _candidates:
+        _detection = "known"
+    else:
+        _found = scan(_region, _candidates)
+        if _found is None:
+            with _lock:
+                _stats["undetected"] += 1
+            logging.info(f"No template detected for {input_file}, layout {layout}")
+            return layout, "undetected"
+        _detection = "scanned"
+        _found_layout, _first_row, _skip_cols, _columns = _found
+        _template = {
+            "layout": _found_layout,
+            "first_row": _first_row,
+            "skip_cols": _skip_cols,
+            "columns": _columns,
+            "template": template_layout(_found_layout, _first_row, _skip_cols),
+            "source_file": input_file,
+            "first_seen": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        # a fingerprint of another layout than the file name is left to the scan of its own layout
+        if _key not in _load():
+            _save(_key, _template)
+        logging.info(f"Template {_template['template']} detected for {input_file}, fingerprint {_key}")
+
+    with _lock:
+        _stats[_detection] += 1
+    return template_layout(_template["layout"], _template["first_row"], _template["skip_cols"]), _detection
+
+
+def stats() -> dict:
+    """Number of workbooks whose template was known, scanned or not detected, as dimensions of the metrics."""
+    with _lock:
+        return {f"templates_{key}": value for key, value in _stats.items()}
+
@@ -0,0 +1,387 @@
+"""
+Layouts of the excel tables handled by the function app.
+
+Each layout groups the units of operation (specific processes in the PDP department) whose files share
+the same table structure, how the table is read from the sheet and how it is transformed before
+being written as csv:
+- fb (formulation team): DIL, DIS, TMIX, BBR, UFDF. The table is transposed.
+- ff (fill and finish team): STOB, LDIL, STOV, VIA.
+- analytical: Analytical.
+
+The layouts are described as data in LAYOUT_SPECS and compiled once, at import, into the execution plans
+of LAYOUTS: the reader options, the transformation steps and a precompiled matcher of the units of
+operation. A new unit of operation template is added with a new spec, without a new function.
+A template whose table moved in the sheet (e.g. a row inserted above the header) is read with a variant of its
+layout, "<layout>@<header row>:<skipped columns>", see template_layout and shared_code/layout_detection.py.
+
+Keys of a spec:
+- units_of_operation: tokens found in the names of the files of the layout,
+- read: offsets of the table in the sheet, the arguments of shared_code.workbook_reader.read_sheet,
+- transpose: the table is stored with one row per column of the output, the first column holds the names
+  and id_column is the name given to the row of the ids,
+- reset_index: number the rows of the output from 0 once the header row is dropped,
+- drop_non_string_columns: drop the columns whose header is not a text (empty or numeric headers),
+- drop_column_prefixes: drop the columns whose header starts with one of these prefixes,
+- id_column / drop_rows_matching: drop the rows without id and the rows whose id matches the regex,
+- rename: new names of columns,
+- key_column: the column identifying the rows of the output for the incremental outputs
+  (shared_code/delta.py), the renamed id_column by default,
+- dtypes: dtype hints of columns, "datetime" (invalid values become NaT) or "numeric" (become NaN),
+- anchor_columns: the header labels identifying the table and their column in it (0 the first column read),
+  the template detection finds a moved table from them (shared_code/layout_detection.py). The id_column is the
+  first column by default, a transposed layout has none,
+- read_transformed: "module:function" building the transformed table directly from the workbook,
+  returning None when the generic read and transformation are needed,
+- chunked: the layout can be converted batch by batch, see shared_code/chunked_analytical.py,
+- memory_factor: peak memory of a conversion per byte of workbook, see shared_code/admission.py.
+
+pandas and the excel engines are only imported by the functions using them, so that importing this
+module (and the blueprints) at worker startup stays cheap.
+"""
+
+import functools
+import importlib
+import logging
+import re
+from typing import TYPE_CHECKING
+
+from shared_code.instrumentation import lazy
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# version of the parsing logic, bump it whenever the output of a layout changes
+# so that the result cache does not serve files produced by the previous version
+PARSER_VERSION = "2"
+
+
+LAYOUT_SPECS = {
+    "fb": {
+        "units_of_operation": ["DIL", "DIS", "TMIX", "BBR", "UFDF"],
+        # the header row, the first 2 rows and the first 6 columns are skipped
+        "read": {"header": 0, "skip_rows": 2, "skip_cols": 6},
+        "transpose": True,
+        "id_column": "Experiment_ID",
+        "drop_column_prefixes": ["↑", "↓"],
+        "drop_rows_matching": "Template",
+        "read_transformed": "shared_code.transposed_reader:read_fb",
+        "memory_factor": 25,
+    },
+    "ff": {
+        "units_of_operation": ["STOB", "LDIL", "STOV", "VIA"],
+        # the header row, rows 0 to 5 and the first column are skipped
+        "read": {"header": 0, "skip_rows": 6, "skip_cols": 1},
+        "drop_non_string_columns": True,
+        "drop_column_prefixes": ["↑", "↓"],
+        "id_column": "Parameter name pivot",
+        "drop_rows_matching": "---|Insert",
+        "rename": {"Parameter name pivot": "Experiment ID"},
+        "anchor_columns": {"Parameter name pivot": 0},
+        "memory_factor": 20,
+    },
+    "analytical": {
+        "units_of_operation": ["Analytical"],
+        # the first four rows are skipped
+        "read": {"header": None, "skip_rows": 4},
+        "reset_index": True,
+        "dtypes": {"Spalte_Compiling_Timestamp": "datetime"},
+        # the timestamp is the second column, after the sample name
+        "anchor_columns": {"Spalte_Compiling_Timestamp": 1},
+        "chunked": True,
+        "memory_factor": 22,
+    },
+}
+
+_SPEC_KEYS = {
+    "units_of_operation", "read", "transpose", "reset_index", "drop_non_string_columns", "drop_column_prefixes",
+    "id_column", "drop_rows_matching", "rename", "key_column", "dtypes", "anchor_columns", "read_transformed",
+    "chunked", "memory_factor",
+}
+_DTYPE_HINTS = {"datetime", "numeric"}
+DEFAULT_MEMORY_FACTOR = 25
+
+
+##### transformation steps #####
+
+def _transpose(_df: "pd.DataFrame", id_column: str) -> "pd.DataFrame":
+    """Transpose a table stored with one row per output column, the first row becomes the header."""
+    import pandas as pd
+
+    # delete header
+    _df.columns = [None] * len(_df.columns)
+
+    # Add new column name for experiment id
+    _df.iloc[0, 0] = id_column
+
+    # reset index
+    _df.reset_index(drop=True, inplace=True)
+
+    # transpose the dataframe
+    _df_transposed = _df.T
+
+    # delete header again
+    _df_transposed.columns = [None] * len(_df_transposed.columns)
+
+    # delete empty columns and rows
+    _df_transposed.dropna(axis=1, how='all', inplace=True)
+    _df_transposed.dropna(axis=0, how='all', inplace=True)
+
+    # set first row as header
+    new_header = _df_transposed.iloc[0]
+    _df_transposed = _df_transposed[1:]
+    _df_transposed.columns = new_header
+
+    # optinal add index column
+    idx = pd.Series(
+        range(1, len(_df_transposed) + 1))
+    _df_transposed.set_index(idx, inplace=True)
+    _df_transposed.index.name = 'id'
+    return _df_transposed
+
+
+def _first_row_header(_df: "pd.DataFrame") -> "pd.DataFrame":
+    """Make the first row the header and drop it."""
+    _df.columns = _df.iloc[0]
+    logging.debug("Columns set to: %s", lazy(lambda: _df.columns.tolist()))
+    return _df[1:]
+
+
+def _reset_index(_df: "pd.DataFrame") -> "pd.DataFrame":
+    _df.reset_index(drop=True, inplace=True)
+    return _df
+
+
+def _drop_non_string_columns(_df: "pd.DataFrame") -> "pd.DataFrame":
+    non_string_columns = [col for col in _df.columns if not isinstance(col, str)]
+    return _df.drop(non_string_columns, axis=1)
+
+
+def _drop_column_prefixes(_df: "pd.DataFrame", prefixes: tuple) -> "pd.DataFrame":
+    special_character_columns = [col for col in _df.columns if col.startswith(prefixes)]
+    return _df.drop(special_character_columns, axis=1)
+
+
+def _drop_rows(_df: "pd.DataFrame", id_column: str, pattern: "re.Pattern") -> "pd.DataFrame":
+    """Drop the rows without id, and the rows whose id matches the pattern."""
+    _df = _df.dropna(subset=[id_column])
+    if pattern is not None:
+        _df = _df[~_df[id_column].str.contains(pattern, na=False)]
+    return _df
+
+
+def _rename(_df: "pd.DataFrame", columns: dict) -> "pd.DataFrame":
+    return _df.rename(columns=columns)
+
+
+def _apply_dtypes(_df: "pd.DataFrame", dtypes: dict) -> "pd.DataFrame":
+    import pandas as pd
+
+    for column, hint in dtypes.items():
+        if hint == "datetime":
+            # correct error in datetime colums
+            _df[column] = pd.to_datetime(_df[column], errors='coerce')
+        else:
+            _df[column] = pd.to_numeric(_df[column], errors='coerce')
+    return _df
+
+
+def _rebase_index(_df: "pd.DataFrame", offset: int) -> "pd.DataFrame":
+    """Shift the row labels of the table read by a template variant, the table read may be cached."""
+    return _df.set_axis(_df.index + offset, axis=0) if offset else _df
+
+
+##### compilation of the specs #####
+
+def _import_reader(path: str):
+    """Return a function importing "module:function" on first call, the readers import pandas."""
+    _module, _function = path.split(":")
+
+    def reader(blob_content: bytes, engine: str):
+        return getattr(importlib.import_module(_module), _function)(blob_content, engine)
+
+    reader.__qualname__ = f"read_transformed[{path}]"
+    return reader
+
+
+def _run_steps(_df: "pd.DataFrame", layout: str, steps: list) -> "pd.DataFrame":
+    for name, step in steps:
+        _df = step(_df)
+        logging.debug("%s %s: shape %s", layout, name, _df.shape)
+    return _df
+
+
+def compile_layout(name: str, spec: dict) -> dict:
+    """Compile the spec of a layout into its execution plan, raise ValueError for an invalid spec."""
+    _unknown = set(spec) - _SPEC_KEYS
+    if _unknown:
+        raise ValueError(f"Unknown keys {sorted(_unknown)} in the spec of layout {name}")
+    if not spec.get("units_of_operation"):
+        raise ValueError(f"The layout {name} has no units of operation")
+    _hints = set(spec.get("dtypes", {}).values()) - _DTYPE_HINTS
+    if _hints:
+        raise ValueError(f"Unknown dtype hints {sorted(_hints)} in the spec of layout {name}")
+
+    _steps = []
+    if spec.get("transpose"):
+        _steps.append(("transpose", functools.partial(_transpose, id_column=spec["id_column"])))
+    else:
+        _steps.append(("header", _first_row_header))
+    if spec.get("reset_index"):
+        _steps.append(("reset_index", _reset_index))
+    if spec.get("drop_non_string_columns"):
+        _steps.append(("drop_non_string_columns", _drop_non_string_columns))
+    if spec.get("drop_column_prefixes"):
+        _steps.append((
+            "drop_column_prefixes", functools.partial(_drop_column_prefixes, prefixes=tuple(spec["drop_column_prefixes"]))
+        ))
+    if spec.get("id_column"):
+        _pattern = re.compile(spec["drop_rows_matching"]) if spec.get("drop_rows_matching") else None
+        _steps.append(("drop_rows", functools.partial(_drop_rows, id_column=spec["id_column"], pattern=_pattern)))
+    if spec.get("rename"):
+        _steps.append(("rename", functools.partial(_rename, columns=dict(spec["rename"]))))
+    if spec.get("dtypes"):
+        _steps.append(("dtypes", functools.partial(_apply_dtypes, dtypes=dict(spec["dtypes"]))))
+
+    _key_column = spec.get("key_column")
+    if _key_column is None and spec.get("id_column"):
+        _key_column = spec.get("rename", {}).get(spec["id_column"], spec["id_column"])
+
+    _units = sorted(spec["units_of_operation"], key=lambda unit: (-len(unit), unit))
+    return {
+        "name": name,
+        "spec": spec,
+        "units_of_operation": set(_units),
+        # longest units first, so that e.g. LDIL is matched before DIL
+        "matcher": re.compile("|".join(re.escape(unit) for unit in _units)),
+        "read": dict(spec["read"]),
+        "steps": [step_name for step_name, _ in _steps],
+        "transform": functools.partial(_run_steps, layout=name, steps=_steps),
+        "key_column": _key_column,
+        "read_transformed": _import_reader(spec["read_transformed"]) if spec.get("read_transformed") else None,
+        "chunked": bool(spec.get("chunked")),
+        "memory_factor": spec.get("memory_factor", DEFAULT_MEMORY_FACTOR),
+    }
+
+
+def compile_layouts(specs: dict):
+    """Return the execution plans of the layouts and the matcher of all their units of operation."""
+    _plans = {name: compile_layout(name, spec) for name, spec in specs.items()}
+    _owners = {}
+    for name, plan in _plans.items():
+        for unit in plan["units_of_operation"]:
+            if unit in _owners:
+                raise ValueError(f"The unit of operation {unit} belongs to the layouts {_owners[unit]} and {name}")
+            _owners[unit] = name
+    # a lookahead finds the longest unit starting at every position, also inside a longer unit
+    _units = sorted(_owners, key=lambda unit: (-len(unit), unit))
+    _matcher = re.compile("(?=(" + "|".join(re.escape(unit) for unit in _units) + "))")
+    return _plans, _matcher, _owners
+
+
+LAYOUTS, _UNIT_MATCHER, _UNIT_LAYOUTS = compile_layouts(LAYOUT_SPECS)
+
+# variants of the layouts reading their table at other offsets, compiled on first use
+TEMPLATE_LAYOUTS = {}
+
+
+def header_row(read: dict) -> int:
+    """Return the 0-based sheet row of the first row of the table read with the read options of a layout."""
+    _header_rows = 0 if read.get("header") is None else read["header"] + 1
+    return _header_rows + read.get("skip_rows", 0)
+
+
+def template_layout(layout: str, first_row: int, skip_cols: int) -> str:
+    """
+    Return the name of the layout reading its table from the sheet row first_row, after skip_cols columns.
+    The layout itself for its own offsets, else a variant named <layout>@<first_row>:<skip_cols>.
+    The readers of the layout bound to its offsets (read_transformed, chunked) are not used by the variants.
+    """
+    _spec = LAYOUTS[layout]["spec"]
+    _read = dict(_spec["read"])
+    if header_row(_read) == first_row and _read.get("skip_cols", 0) == skip_cols:
+        return layout
+
+    _name = f"{layout}@{first_row}:{skip_cols}"
+    if _name not in TEMPLATE_LAYOUTS:
+        _header_rows = 0 if _read.get("header") is None else _read["header"] + 1
+        if first_row < _header_rows:
+            # the discarded header row of the layout is gone
+            _read = {"header": None, "skip_rows": first_row}
+        else:
+            _read["skip_rows"] = first_row - _header_rows
+        _read["skip_cols"] = skip_cols
+        _plan = compile_layout(_name, {**_spec, "read": _read, "read_transformed": None, "chunked": False})
+        # the rows keep the index they have in the template of the layout, the output is the same
+        _rebase = functools.partial(_rebase_index, offset=_spec["read"].get("skip_rows", 0) - _read["skip_rows"])
+        _plan["steps"] = ["rebase_index", *_plan["steps"]]
+        _plan["transform"] = functools.partial(
+            _run_steps, layout=_name, steps=[("rebase_index", _rebase), (layout, _plan["transform"])]
+        )
+        TEMPLATE_LAYOUTS[_name] = _plan
+    return _name
+
+
+def base_layout(layout: str) -> str:
+    """Return the layout of a template variant, e.g. ff for ff@8:1."""
+    return layout.partition("@")[0]
+
+
+def layout_plan(layout: str) -> dict:
+    """Return the execution plan of a layout or of a template variant."""
+    if "@" not in layout:
+        return LAYOUTS[layout]
+    if layout not in TEMPLATE_LAYOUTS:
+        _base, _, _offsets = layout.partition("@")
+        _first_row, _, _skip_cols = _offsets.partition(":")
+        template_layout(_base, int(_first_row), int(_skip_cols))
+    return TEMPLATE_LAYOUTS[layout]
+
+
+def find_layout(input_file: str):
+    """
+    Return the name of the layout of the file from the unit of operation in its name, None if there is none.
+    The longest unit found in the name wins, so that e.g. LDIL (ff) is not taken for DIL (fb).
+    """
+    _matches = [(len(unit), _UNIT_LAYOUTS[unit]) for unit in _UNIT_MATCHER.findall(input_file)]
+    if not _matches:
+        return None
+    return max(_matches)[1]
+
+
+def find_unit(input_file: str):
+    """Return the unit of operation found in the name of the file, the longest one, None if there is none."""
+    _units = _UNIT_MATCHER.findall(input_file)
+    if not _units:
+        return None
+    return max(_units, key=lambda unit: (len(unit), unit))
+
+
+def matches_layout(input_file: str, layout: str) -> bool:
+    """Return True if a unit of operation of the layout is found in the name of the file."""
+    return LAYOUTS[layout]["matcher"].search(input_file) is not None
+
+
+def read_layout(blob_content: bytes, layout: str, engine: str) -> "pd.DataFrame":
+    """
+    Read the table of the layout from the workbook.
+    The layouts with a read_transformed reader get the transformed table directly when it can build it,
+    the table is flagged in its attrs so that transform_layout leaves it as it is.
+    """
+    _read_transformed = layout_plan(layout)["read_transformed"]
+    if _read_transformed is not None:
+        _df = _read_transformed(blob_content, engine)
+        if _df is not None:
+            _df.attrs["transformed"] = layout
+            return _df
+
+    from shared_code.workbook_reader import read_sheet
+
+    return read_sheet(blob_content, engine=engine, **layout_plan(layout)["read"])
+
+
+def transform_layout(_df: "pd.DataFrame", layout: str) -> "pd.DataFrame":
+    """Apply the transformation of the layout to the table read by read_layout."""
+    if _df.attrs.get("transformed") == layout:
+        return _df
+    return layout_plan(layout)["transform"](_df)
@@ -0,0 +1,220 @@
+"""
+Serialization of the transformed tables to the output formats.
+
+- csv: the historical output, every value is written as text (default). It can be gzip or zstd compressed,
+  the text is compressed while it is written, the uncompressed csv is never held in memory.
+- parquet: columnar output written with pyarrow. The columns are typed first, see typed_frame.
+  The compression codec is chosen with output_compression (snappy by default).
+
+The compression level is chosen with output_compression_level: a preset (fast, balanced, small) or the level
+of the codec, the default level of the codec otherwise (9 for gzip csv, 3 for zstd).
+The blobs are written with the content type of the format and the content encoding of a compressed csv.
+zstd compression of csv outputs needs the zstandard package.
+
+pandas is only imported by the serialization functions, resolve_output is cheap to import.
+"""
+
+import datetime
+import importlib.util
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+OUTPUT_FORMATS = {"csv", "parquet"}
+DEFAULT_OUTPUT_FORMAT = "csv"
+
+PARQUET_COMPRESSIONS = {"snappy", "gzip", "zstd", "brotli", "lz4", "none"}
+DEFAULT_PARQUET_COMPRESSION = "snappy"
+
+CSV_COMPRESSIONS = {"gzip", "zstd", "none"}
+
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet"}
+COMPRESSED_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+CONTENT_TYPES = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+# levels of the codecs having one, and the presets trading CPU for size
+COMPRESSION_LEVEL_RANGES = {"gzip": (0, 9), "zstd": (1, 22), "brotli": (0, 11)}
+COMPRESSION_LEVEL_PRESETS = {
+    "fast": {"gzip": 1, "zstd": 1, "brotli": 1},
+    "balanced": {"gzip": 6, "zstd": 3, "brotli": 5},
+    "small": {"gzip": 9, "zstd": 19, "brotli": 11},
+}
+
+
+def resolve_output(output_format: str = None, output_compression: str = None):
+    """
+    Return the (output_format, output_compression) of a request with the defaults applied.
+    Raise ValueError for an unknown format or compression.
+    """
+    _format = output_format or DEFAULT_OUTPUT_FORMAT
+    if _format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{_format}', expected one of {sorted(OUTPUT_FORMATS)}")
+
+    if _format == "parquet":
+        _compression = output_compression or DEFAULT_PARQUET_COMPRESSION
+        if _compression not in PARQUET_COMPRESSIONS:
+            raise ValueError(
+                f"Unknown parquet compression '{_compression}', expected one of {sorted(PARQUET_COMPRESSIONS)}"
+            )
+    else:
+        _compression = output_compression or "none"
+        if _compression not in CSV_COMPRESSIONS:
+            raise ValueError(f"Compression '{_compression}' is not supported for {_format} output")
+        if _compression == "zstd" and importlib.util.find_spec("zstandard") is None:
+            raise ValueError("zstd compression of csv outputs needs the zstandard package")
+    return _format, _compression
+
+
+def resolve_compression_level(output_compression: str, output_compression_level=None):
+    """
+    Return the compression level of a request: None for the default level of the codec, else the level
+    of the preset or the level given. Raise ValueError for an unknown preset, a level out of the range
+    of the codec or a codec without levels.
+    """
+    if output_compression_level is None:
+        return None
+    if output_compression not in COMPRESSION_LEVEL_RANGES:
+        raise ValueError(f"Compression '{output_compression}' has no compression level")
+    if isinstance(output_compression_level, str):
+        if output_compression_level not in COMPRESSION_LEVEL_PRESETS:
+            raise ValueError(
+                f"Unknown compression level '{output_compression_level}', "
+                f"expected one of {sorted(COMPRESSION_LEVEL_PRESETS)} or a number"
+            )
+        return COMPRESSION_LEVEL_PRESETS[output_compression_level][output_compression]
+    _low, _high = COMPRESSION_LEVEL_RANGES[output_compression]
+    if isinstance(output_compression_level, bool) or not isinstance(output_compression_level, int) \
+            or not _low <= output_compression_level <= _high:
+        raise ValueError(
+            f"The {output_compression} compression level must be a number from {_low} to {_high}, "
+            f"got {output_compression_level!r}"
+        )
+    return output_compression_level
+
+
+def csv_compression(output_compression: str = None, output_compression_level: int = None):
+    """Return the compression argument of to_csv for the output, None for an uncompressed csv."""
+    if output_compression in (None, "none"):
+        return None
+    if output_compression == "gzip":
+        # mtime=0 keeps the output identical from one conversion to the next
+        _compression = {"method": "gzip", "mtime": 0}
+        if output_compression_level is not None:
+            _compression["compresslevel"] = output_compression_level
+        return _compression
+    _compression = {"method": output_compression}
+    if output_compression_level is not None:
+        _compression["level"] = output_compression_level
+    return _compression
+
+
+def digest_options(output_format: str, output_compression: str, output_compression_level: int = None) -> dict:
+    """Options of the output changing its content, for the result cache digest."""
+    _options = {"output_format": output_format, "output_compression": output_compression}
+    if output_compression_level is not None:
+        _options["output_compression_level"] = output_compression_level
+    return _options
+
+
+def is_streamed_compression(output_format: str, output_compression: str = None) -> bool:
+    """
+    Return True for the compressed csv outputs: the content encoding of a blob can only be set when it is
+    uploaded with the storage SDK, they are always streamed to the blob instead of the output binding.
+    """
+    return output_format == "csv" and output_compression not in (None, "none")
+
+
+def content_settings(output_format: str, output_compression: str = None):
+    """Return the ContentSettings of the output blob: content type, and content encoding of a compressed csv."""
+    from azure.storage.blob import ContentSettings
+
+    _encoding = None
+    if output_format == "csv" and output_compression not in (None, "none"):
+        _encoding = output_compression
+    return ContentSettings(content_type=CONTENT_TYPES[output_format], content_encoding=_encoding)
+
+
+def extension(output_format: str, output_compression: str = None) -> str:
+    """Return the file extension of the output, e.g. .csv.gz for a gzip compressed csv."""
+    _extension = EXTENSIONS[output_format]
+    if output_format == "csv":
+        _extension += COMPRESSED_EXTENSIONS.get(output_compression, "")
+    return _extension
+
+
+def _column_kind(values: "pd.Series") -> str:
+    """Return the kind of values a column holds once the empty cells are left out."""
+    import pandas as pd
+
+    _values = values.dropna()
+    if _values.empty:
+        return "empty"
+    if all(isinstance(value, bool) for value in _values):
+        return "bool"
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in _values):
+        return "number"
+    if all(isinstance(value, (datetime.datetime, pd.Timestamp)) for value in _values):
+        return "datetime"
+    return "string"
+
+
+def typed_frame(_df: "pd.DataFrame") -> "pd.DataFrame":
+    """
+    Return a copy of the table with one type per column, as columnar formats require:
+    numbers as float64, dates as datetime64, booleans as boolean and everything else as text.
+    The column names become unique strings.
+    """
+    import pandas as pd
+
+    _typed = {}
+    for position in range(_df.shape[1]):
+        _values = _df.iloc[:, position]
+        if _values.dtype != object:
+            _typed[position] = _values
+            continue
+        _kind = _column_kind(_values)
+        if _kind == "number" or _kind == "empty":
+            _typed[position] = pd.to_numeric(_values, errors="coerce").astype("float64")
+        elif _kind == "datetime":
+            _typed[position] = pd.to_datetime(_values, errors="coerce")
+        elif _kind == "bool":
+            _typed[position] = _values.astype("boolean")
+        else:
+            _typed[position] = _values.map(lambda value: None if pd.isna(value) else str(value)).astype(object)
+
+    _result = pd.DataFrame(_typed, index=_df.index)
+    _result.columns = unique_names(_df.columns)
+    return _result
+
+
+def unique_names(columns) -> list:
+    """Column names as unique strings, duplicated names get a .1, .2, ... suffix like pandas does."""
+    import pandas as pd
+
+    _names = []
+    _seen = {}
+    for col in columns:
+        _name = "" if pd.isna(col) else str(col)
+        if _name in _seen:
+            _seen[_name] += 1
+            _name = f"{_name}.{_seen[_name]}"
+        _seen.setdefault(_name, 0)
+        _names.append(_name)
+    return _names
+
+
+def write_output(
+    _df: "pd.DataFrame", buffer, output_format: str = DEFAULT_OUTPUT_FORMAT, output_compression: str = None,
+    output_compression_level: int = None
+):
+    """Write the table to the binary buffer in the output format."""
+    if output_format == "parquet":
+        _compression = None if output_compression in (None, "none") else output_compression
+        _options = {} if output_compression_level is None else {"compression_level": output_compression_level}
+        typed_frame(_df).to_parquet(buffer, engine="pyarrow", compression=_compression, index=True, **_options)
+    else:
+        # the text is compressed as it is written to the buffer
+        _df.to_csv(buffer, index=True, compression=csv_compression(output_compression, output_compression_level))
@@ -0,0 +1,171 @@
+"""
+In-process reuse of the parsed tables by the invocations of a warm worker.
+
+Data Factory retries and overlapping pipelines often send the same workbook several times within seconds,
+possibly to different outputs or output formats. Instead of downloading and parsing it again:
+- concurrent identical requests are coalesced (single flight): the first one downloads and parses the
+  workbook, the others wait for its result,
+- the parsed tables are kept in a LRU bounded by their memory size (PARSED_CACHE_MB app setting,
+  256 MB by default, 0 disables it), keyed by the hash of the workbook content, the layout and the engine,
+- the routes downloading the blobs themselves remember the content hash of each blob version (etag),
+  so that a cached table is reused without downloading the blob again.
+
+Every caller gets its own copy of the table, the transformations modify it in place.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+_max_bytes = int(float(os.environ.get("PARSED_CACHE_MB", 256)) * 2**20)
+
+# number of blob versions whose content hash is remembered
+_max_etags = 1024
+
+
+class SingleFlight:
+    """Run a function once for concurrent calls with the same key, the other callers wait for its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """Return (result of func, True if the result was produced by a concurrent call)."""
+        with self._lock:
+            _call = self._calls.get(key)
+            _leader = _call is None
+            if _leader:
+                _call = self._calls[key] = Future()
+        if not _leader:
+            return _call.result(), True
+
+        try:
+            _call.set_result(func())
+        except BaseException as e:
+            _call.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return _call.result(), False
+
+
+class TableCache:
+    """LRU of tables bounded by the sum of their memory size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._tables = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return a copy of the cached table, None if it is not cached."""
+        with self._lock:
+            _entry = self._tables.get(key)
+            if _entry is None:
+                self.misses += 1
+                return None
+            self._tables.move_to_end(key)
+            self.hits += 1
+        return _entry[0].copy()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._tables
+
+    def put(self, key, table):
+        """Cache the table, the least recently used tables are evicted to stay within max_bytes."""
+        if self.max_bytes <= 0:
+            return
+        _size = int(table.memory_usage(index=True, deep=True).sum())
+        if _size > self.max_bytes:
+            logging.info(f"Parsed table of {_size} bytes is larger than the cache, not cached")
+            return
+        with self._lock:
+            if key in self._tables:
+                self._size -= self._tables.pop(key)[1]
+            self._tables[key] = (table, _size)
+            self._size += _size
+            while self._size > self.max_bytes:
+                _, (_, _evicted_size) = self._tables.popitem(last=False)
+                self._size -= _evicted_size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tables": len(self._tables),
+                "size_mb": round(self._size / 2**20, 1),
+                "max_mb": round(self.max_bytes / 2**20, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_flights = SingleFlight()
+_tables = TableCache(_max_bytes)
+_etags = OrderedDict()
+_etags_lock = threading.Lock()
+
+
+def content_hash(blob_content: bytes) -> str:
+    """Return the hash of the blob content, it identifies the workbook whatever its name."""
+    return hashlib.sha256(blob_content).hexdigest()
+
+
+def remember_etag(source: tuple, etag: str, blob_hash: str):
+    """Remember the content hash of a version of a blob, source identifies the blob (connection, path, file)."""
+    with _etags_lock:
+        _etags[(source, etag)] = blob_hash
+        _etags.move_to_end((source, etag))
+        while len(_etags) > _max_etags:
+            _etags.popitem(last=False)
+
+
+def hash_for_etag(source: tuple, etag: str):
+    """Return the content hash of a version of a blob, None if it is not known."""
+    with _etags_lock:
+        return _etags.get((source, etag))
+
+
+def is_cached(blob_hash: str, layout: str, engine: str) -> bool:
+    """Return True if the table of the workbook is cached, i.e. the workbook does not have to be downloaded."""
+    return (blob_hash, layout, engine) in _tables
+
+
+def coalesce(key, func):
+    """Run func once for concurrent calls with the same key (e.g. the download of a blob version)."""
+    return _flights.do(key, func)[0]
+
+
+def read_table(load_content, blob_hash: str, layout: str, engine: str):
+    """
+    Return (table, status) for the workbook with the given content hash, read with read_layout on a miss.
+    load_content returns the workbook content, it is only called when the table has to be parsed.
+    The status is "hit" (cached table), "coalesced" (parsed by a concurrent request) or "miss".
+    """
+    from shared_code.layouts import read_layout
+
+    _key = (blob_hash, layout, engine)
+    _table = _tables.get(_key)
+    if _table is not None:
+        return _table, "hit"
+
+    def parse():
+        _parsed = read_layout(load_content(), layout, engine)
+        _tables.put(_key, _parsed)
+        return _parsed
+
+    _parsed, _coalesced = _flights.do(("parse",) + _key, parse)
+    return _parsed.copy(), "coalesced" if _coalesced else "miss"
+
+
+def stats() -> dict:
+    """State of the parsed tables cache, as dimensions of the conversion metrics."""
+    return {f"parsed_cache_{key}": value for key, value in _tables.stats().items()}
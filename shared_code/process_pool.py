@@ -0,0 +1,221 @@
+"""
+Process pool running the CPU bound stages of the conversions on several cores.
+
+openpyxl and pandas hold the GIL while they parse, transform and serialize a workbook: the invocations run
+concurrently by a Python worker all share one core. With the PARSE_POOL_WORKERS app setting (0, the default,
+disables it) the read, transform and serialize stages run in a pool of worker processes instead:
+- the pool is created on first use and reused by the following invocations of the worker,
+- the workbook goes to the worker process through a shared memory block, not through the pipe of the pool,
+- the worker process returns the serialized output as bytes, with the first rows for the response,
+- a worker process is replaced after PARSE_POOL_MAX_TASKS conversions (default 20, 0 never replaces it),
+  so that the memory fragmented by large workbooks is given back to the system,
+- a conversion taking more than PARSE_POOL_TIMEOUT seconds (default 300) fails and its worker process is
+  killed, so that it does not keep its slot of the pool. A broken pool (a worker process killed, e.g. out of
+  memory or after a timeout) is replaced by a new one for the next conversions, the conversions running in a
+  pool broken by the kill after a timeout run again once in the new pool.
+
+The worker processes are started with "spawn" and warmed up (shared_code/warmup.py) when they start.
+The parsed tables of the pool are not kept in the parsed tables cache of the worker, the conversions
+needing the table itself (several outputs, incremental outputs) run in the worker as before.
+"""
+
+import io
+import logging
+import os
+import signal
+import struct
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+_workers = int(os.environ.get("PARSE_POOL_WORKERS", 0))
+_max_tasks = int(os.environ.get("PARSE_POOL_MAX_TASKS", 20))
+_timeout = float(os.environ.get("PARSE_POOL_TIMEOUT", 300))
+
+_lock = threading.Lock()
+_executor = None
+_stats = {"submitted": 0, "completed": 0, "failed": 0, "restarts": 0}
+
+# the pools broken by the kill of a worker process after a timeout
+_timed_out = weakref.WeakSet()
+
+# the worker process running a conversion writes its pid after the workbook, in the shared memory block
+_PID = struct.Struct("q")
+
+
+def is_enabled() -> bool:
+    return _workers > 0
+
+
+def _initialize():
+    """Warm up a new worker process, the heavy libraries are imported before its first conversion."""
+    from shared_code.warmup import warm_up
+
+    try:
+        warm_up()
+    except Exception as e:
+        logging.warning(f"Warm-up of the parse pool process failed: {e}")
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            import multiprocessing
+
+            _executor = ProcessPoolExecutor(
+                max_workers=_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize,
+                max_tasks_per_child=_max_tasks or None,
+            )
+        return _executor
+
+
+def _replace(executor: ProcessPoolExecutor, timed_out: bool = False):
+    """Drop a broken pool, the next conversion creates a new one."""
+    global _executor
+    with _lock:
+        if timed_out:
+            _timed_out.add(executor)
+        if _executor is executor:
+            _executor = None
+            _stats["restarts"] += 1
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _attach(shm_name: str, size: int) -> bytes:
+    """Return the workbook of the shared memory block and write the pid of the worker process after it."""
+    from multiprocessing.shared_memory import SharedMemory
+
+    # the block belongs to the caller, it unlinks it (the spawned processes share its resource tracker)
+    _shm = SharedMemory(name=shm_name)
+    try:
+        _PID.pack_into(_shm.buf, size, os.getpid())
+        return bytes(_shm.buf[:size])
+    finally:
+        _shm.close()
+
+
+def _stop(future, shm, size: int):
+    """Kill the worker process running the conversion, or cancel the conversion if it has not started."""
+    _pid = _PID.unpack_from(shm.buf, size)[0]
+    if not _pid:
+        # a conversion already handed to a worker process cannot be cancelled, it fails on the unlinked block
+        future.cancel()
+        return
+    try:
+        os.kill(_pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _convert(
+    shm_name: str, size: int, layout: str, engine: str, output_format: str, output_compression: str,
+    output_compression_level: int = None
+) -> dict:
+    """
+    Convert the workbook of the shared memory block, run in a worker process of the pool.
+    Return the output bytes, the first 5 rows and the number of rows, or the stage that failed.
+    """
+    from shared_code.layouts import read_layout, transform_layout
+    from shared_code.outputs import write_output
+
+    blob_content = _attach(shm_name, size)
+
+    try:
+        _df = read_layout(blob_content, layout, engine)
+    except Exception as e:
+        return {"error": "read", "message": str(e)}
+    del blob_content
+    if _df.empty:
+        return {"error": "empty", "message": "EMPTY DATAFRAME"}
+
+    try:
+        _df = transform_layout(_df, layout)
+        buffer = io.BytesIO()
+        write_output(_df, buffer, output_format, output_compression, output_compression_level)
+    except Exception as e:
+        return {"error": "transform", "message": str(e)}
+    return {"output": buffer.getvalue(), "head": _df.head().to_json(orient='records'), "rows": len(_df)}
+
+
+def convert(
+    blob_content: bytes, layout: str, engine: str, output_format: str, output_compression: str,
+    output_compression_level: int = None
+) -> dict:
+    """
+    Convert the workbook in a worker process of the pool and return its result, see _convert.
+    Raise BrokenProcessPool if the worker process died and TimeoutError after PARSE_POOL_TIMEOUT seconds,
+    the worker process is then killed.
+    """
+    from multiprocessing.shared_memory import SharedMemory
+
+    _size = len(blob_content)
+    _shm = SharedMemory(create=True, size=_size + _PID.size)
+    try:
+        _shm.buf[:_size] = blob_content
+        with _lock:
+            _stats["submitted"] += 1
+        for _attempt in (1, 2):
+            _PID.pack_into(_shm.buf, _size, 0)
+            _executor = _get_executor()
+            _future = _executor.submit(
+                _convert, _shm.name, _size, layout, engine, output_format, output_compression, output_compression_level
+            )
+            try:
+                _result = _future.result(timeout=_timeout)
+                break
+            except TimeoutError:
+                logging.error(f"A conversion of the parse pool took more than {_timeout} seconds, its process is killed")
+                # the pool is marked before the kill breaks it, for the conversions running next to this one
+                _replace(_executor, timed_out=True)
+                _stop(_future, _shm, _size)
+                _failed()
+                raise
+            except BrokenProcessPool:
+                if _attempt == 1 and _executor in _timed_out:
+                    logging.warning("The parse pool was broken by the kill of a conversion that timed out, retrying")
+                    continue
+                logging.error("A process of the parse pool died, the pool is replaced")
+                _replace(_executor)
+                _failed()
+                raise
+            except Exception:
+                _failed()
+                raise
+        with _lock:
+            _stats["completed" if "error" not in _result else "failed"] += 1
+        return _result
+    finally:
+        _shm.close()
+        _shm.unlink()
+
+
+def _failed():
+    with _lock:
+        _stats["failed"] += 1
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def prestart():
+    """Start and warm up the worker processes of the pool before the first conversion."""
+    if not is_enabled():
+        return
+    _executor = _get_executor()
+    _pids = {future.result() for future in [_executor.submit(_ping) for _ in range(_workers)]}
+    logging.info(f"Parse pool started with {len(_pids)} processes")
+
+
+def stats() -> dict:
+    """State of the parse pool, as dimensions of the conversion metrics."""
+    with _lock:
+        return {
+            "parse_pool_workers": _workers,
+            **{f"parse_pool_{key}": value for key, value in _stats.items()},
+        }
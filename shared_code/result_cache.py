@@ -0,0 +1,78 @@
+"""
+Result cache skipping the conversion of workbooks that did not change since their last conversion.
+
+The digest of a conversion is computed from the hash of the blob content, the layout, the parser version
+(shared_code.layouts.PARSER_VERSION) and the options changing the output. After a successful
+conversion a small manifest is written next to the output, in {output_path}/_manifest/{output_file}.json.
+The next conversion of the same output is skipped if the manifest has the same digest and the output
+blob still exists with the size recorded in the manifest.
+
+The cache is enabled by default, it can be disabled with the RESULT_CACHE app setting ("false")
+or bypassed for a single request with "force": true.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+
+from shared_code.layouts import PARSER_VERSION
+from shared_code.storage import OUTPUT_CONNECTION, download_blob, get_blob_size, upload_blob
+
+
+MANIFEST_FOLDER = "_manifest"
+
+
+def is_enabled(force: bool = False) -> bool:
+    """Return True if the cache should be used for the request."""
+    if force:
+        return False
+    return os.environ.get("RESULT_CACHE", "true").lower() not in ("false", "0", "no")
+
+
+def compute_digest(blob_hash: str, layout: str, **options) -> str:
+    """Return the digest of a conversion of the blob content (shared_code.parsed_cache.content_hash) with the layout and the output options."""
+    _key = json.dumps([PARSER_VERSION, layout, options, blob_hash], sort_keys=True, default=str)
+    return hashlib.sha256(_key.encode()).hexdigest()
+
+
+def _manifest_location(output_path: str, output_file: str):
+    return f"{output_path.rstrip('/')}/{MANIFEST_FOLDER}", f"{output_file}.json"
+
+
+def lookup(output_path: str, output_file: str, digest: str):
+    """
+    Return the manifest of the output if it was produced from the same digest and still exists, else None.
+    Any storage error is a cache miss, the cache never makes a conversion fail.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        _manifest = json.loads(download_blob(*_manifest_location(output_path, output_file), connection=OUTPUT_CONNECTION))
+        if _manifest.get("digest") != digest:
+            return None
+        if get_blob_size(output_path, output_file) != _manifest.get("output_size"):
+            return None
+        return _manifest
+    except ResourceNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Result cache lookup failed for {output_path}/{output_file}: {e}")
+        return None
+
+
+def record(output_path: str, output_file: str, digest: str, output_size: int, input_path: str, input_file: str):
+    """Write the manifest of a successful conversion. Failures are only logged."""
+    _manifest = {
+        "digest": digest,
+        "parser_version": PARSER_VERSION,
+        "input_path": input_path,
+        "input_file": input_file,
+        "output_size": output_size,
+        "converted_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    try:
+        upload_blob(*_manifest_location(output_path, output_file), json.dumps(_manifest).encode())
+    except Exception as e:
+        logging.warning(f"Result cache record failed for {output_path}/{output_file}: {e}")
@@ -0,0 +1,327 @@
+"""
+Direct access to the storage accounts used by the function bindings.
+
+The blob bindings only work for a single {input_path}/{input_file} per invocation. The routes
+handling several files at once read and write the blobs with azure-storage-blob instead, using the
+same connection app settings as the bindings (DATALAKE_STORAGE and DATALAKE_STORAGE_OUTPUT).
+The clients are cached, so a warm worker reuses its connections across invocations.
+
+Large inputs can be downloaded with download_blob_ranged: the blob is fetched with concurrent ranged
+GETs by the async client into a preallocated buffer. The async clients live on an event loop owned by
+this module (one background thread per worker), so their connections are reused across invocations.
+
+Large outputs can be streamed with BlockBlobWriter: the serialized output is cut into blocks that are
+staged concurrently while the next rows are serialized, and the block list is committed at the end.
+
+All the clients are built from connection strings, "UseDevelopmentStorage=true" targets the Azurite emulator.
+azure-storage-blob is only imported when a client is first needed, it is not paid at worker startup.
+"""
+
+import asyncio
+import base64
+import functools
+import io
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+INPUT_CONNECTION = "DATALAKE_STORAGE"
+OUTPUT_CONNECTION = "DATALAKE_STORAGE_OUTPUT"
+
+# size of the ranges of the ranged downloads and number of ranges downloaded at the same time
+_download_chunk_size = int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 4 * 1024 * 1024))
+_download_concurrency = int(os.environ.get("DOWNLOAD_CONCURRENCY", 8))
+
+# size of the blocks of the streamed outputs and number of blocks staged at the same time
+_block_size = int(os.environ.get("OUTPUT_BLOCK_SIZE", 4 * 1024 * 1024))
+_upload_concurrency = int(os.environ.get("OUTPUT_UPLOAD_CONCURRENCY", 4))
+
+
+@functools.lru_cache(maxsize=None)
+def get_blob_service_client(connection: str):
+    """Return the client of the storage account of the connection app setting."""
+    from azure.storage.blob import BlobServiceClient
+
+    return BlobServiceClient.from_connection_string(_connection_string(connection))
+
+
+def _connection_string(connection: str) -> str:
+    _value = os.environ.get(connection)
+    if not _value:
+        raise ValueError(f"The app setting {connection} is not defined")
+    return _value
+
+
+def split_blob_path(path: str, file: str):
+    """Split the binding path {path}/{file} into container and blob name."""
+    _container, _, _folder = path.strip("/").partition("/")
+    _blob_name = f"{_folder}/{file}" if _folder else file
+    return _container, _blob_name
+
+
+def get_blob_client(connection: str, path: str, file: str):
+    _container, _blob_name = split_blob_path(path, file)
+    return get_blob_service_client(connection).get_blob_client(_container, _blob_name)
+
+
+def download_blob(path: str, file: str, connection: str = INPUT_CONNECTION) -> bytes:
+    """Return the content of the blob {path}/{file}."""
+    return get_blob_client(connection, path, file).download_blob().readall()
+
+
+def download_blob_version(path: str, file: str, connection: str = INPUT_CONNECTION):
+    """Return the content of the blob {path}/{file} and its etag."""
+    _downloader = get_blob_client(connection, path, file).download_blob()
+    return _downloader.readall(), _downloader.properties.etag
+
+
+def upload_blob(
+    path: str, file: str, data: bytes, connection: str = OUTPUT_CONNECTION, etag: str = None, if_missing: bool = False
+):
+    """
+    Write data to the blob {path}/{file}, overwriting it if it exists.
+    With etag, the blob is only overwritten if it is still at that version (ResourceModifiedError otherwise),
+    with if_missing it is only written if it does not exist (ResourceExistsError otherwise).
+    """
+    _blob_client = get_blob_client(connection, path, file)
+    if etag is not None:
+        from azure.core import MatchConditions
+
+        _blob_client.upload_blob(data, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+    else:
+        _blob_client.upload_blob(data, overwrite=not if_missing)
+
+
+def delete_blob(path: str, file: str, connection: str = OUTPUT_CONNECTION):
+    """Delete the blob {path}/{file}, nothing happens if it does not exist."""
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        get_blob_client(connection, path, file).delete_blob()
+    except ResourceNotFoundError:
+        pass
+
+
+##### ranged downloads #####
+
+_loop = None
+_loop_lock = threading.Lock()
+_async_clients = {}
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop of the async clients, started on first use in a daemon thread."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="blob-download-loop", daemon=True).start()
+    return _loop
+
+
+def _get_async_blob_client(connection: str, path: str, file: str):
+    # only called from the loop thread, the clients are bound to the loop
+    from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+    if connection not in _async_clients:
+        _async_clients[connection] = AsyncBlobServiceClient.from_connection_string(_connection_string(connection))
+    _container, _blob_name = split_blob_path(path, file)
+    return _async_clients[connection].get_blob_client(_container, _blob_name)
+
+
+async def _download_ranged(
+    connection: str, path: str, file: str, chunk_size: int, concurrency: int, etag: str = None
+) -> bytearray:
+    from azure.core import MatchConditions
+
+    _blob_client = _get_async_blob_client(connection, path, file)
+
+    # the first range also tells the size of the blob and its etag
+    if etag is not None:
+        _first = await _blob_client.download_blob(
+            offset=0, length=chunk_size, etag=etag, match_condition=MatchConditions.IfNotModified
+        )
+    else:
+        _first = await _blob_client.download_blob(offset=0, length=chunk_size)
+    _first_chunk = await _first.readall()
+    _content_range = _first.properties.content_range
+    _size = int(_content_range.rsplit("/", 1)[1]) if _content_range else len(_first_chunk)
+    _etag = _first.properties.etag
+
+    _buffer = bytearray(_size)
+    _view = memoryview(_buffer)
+    _view[:len(_first_chunk)] = _first_chunk
+    _semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(offset: int):
+        async with _semaphore:
+            # fail rather than mixing two versions of a blob modified during the download
+            _downloader = await _blob_client.download_blob(
+                offset=offset, length=min(chunk_size, _size - offset),
+                etag=_etag, match_condition=MatchConditions.IfNotModified
+            )
+            _chunk = await _downloader.readall()
+        _view[offset:offset + len(_chunk)] = _chunk
+
+    await asyncio.gather(*(fetch(offset) for offset in range(len(_first_chunk), _size, chunk_size)))
+    return _buffer
+
+
+def download_blob_ranged(
+    path: str, file: str, connection: str = INPUT_CONNECTION, chunk_size: int = None, concurrency: int = None,
+    etag: str = None
+) -> bytearray:
+    """
+    Return the content of the blob {path}/{file}, downloaded with concurrent ranged GETs.
+    Blobs smaller than a chunk are downloaded with a single request.
+    With an etag, the download fails if the blob is not at that version anymore.
+    """
+    _future = asyncio.run_coroutine_threadsafe(
+        _download_ranged(
+            connection, path, file, chunk_size or _download_chunk_size, concurrency or _download_concurrency, etag
+        ),
+        _get_loop()
+    )
+    return _future.result()
+
+
+def get_blob_size(path: str, file: str, connection: str = OUTPUT_CONNECTION):
+    """Return the size of the blob {path}/{file}, None if it does not exist."""
+    from azure.core.exceptions import ResourceNotFoundError
+
+    try:
+        return get_blob_client(connection, path, file).get_blob_properties().size
+    except ResourceNotFoundError:
+        return None
+
+
+def list_blob_names(path: str, connection: str = INPUT_CONNECTION) -> list:
+    """Return the names of the blobs directly in the folder {path}, without the blobs of its subfolders."""
+    _container, _folder = split_blob_path(path, "")
+    _prefix = _folder
+    _client = get_blob_service_client(connection).get_container_client(_container)
+    _names = []
+    for blob in _client.list_blobs(name_starts_with=_prefix or None):
+        _name = blob.name[len(_prefix):]
+        if _name and "/" not in _name:
+            _names.append(_name)
+    return _names
+
+
+def get_blob_properties(path: str, file: str, connection: str = INPUT_CONNECTION):
+    """
+    Return the properties of the blob {path}/{file}: its size and its etag,
+    the etag changes whenever the blob is rewritten.
+    """
+    return get_blob_client(connection, path, file).get_blob_properties()
+
+
+class BlockBlobWriter(io.RawIOBase):
+    """
+    Binary file object uploading what is written to a block blob.
+
+    The written bytes are staged as blocks of block_size bytes by a pool of max_concurrency threads.
+    At most max_concurrency blocks are in flight, so the memory used is bounded by
+    (max_concurrency + 1) * block_size whatever the size of the output.
+    The blob is only committed when the writer is closed without error, an exception raised
+    inside the with block or by a previous write, or a writer collected without being closed,
+    leaves the previous version of the blob untouched.
+    The block ids start with a token of the writer, two writers of the same blob never share a block.
+    """
+
+    def __init__(self, blob_client, block_size: int = None, max_concurrency: int = None, content_settings=None):
+        super().__init__()
+        self._blob_client = blob_client
+        self._block_size = block_size or _block_size
+        self._max_concurrency = max_concurrency or _upload_concurrency
+        self._content_settings = content_settings
+        self._executor = ThreadPoolExecutor(max_workers=self._max_concurrency)
+        self._buffer = bytearray()
+        self._block_ids = []
+        self._pending = []
+        self._token = uuid.uuid4().hex
+        self._failed = False
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.size
+
+    def write(self, data) -> int:
+        if self._failed:
+            raise OSError("A previous block of the blob failed to upload")
+        self._buffer += data
+        self.size += len(data)
+        try:
+            while len(self._buffer) >= self._block_size:
+                self._stage(bytes(self._buffer[:self._block_size]))
+                del self._buffer[:self._block_size]
+        except BaseException:
+            self._failed = True
+            raise
+        return len(data)
+
+    def _stage(self, block: bytes):
+        # wait for the oldest block when too many blocks are in flight
+        while len(self._pending) >= self._max_concurrency:
+            self._pending.pop(0).result()
+        _block_id = base64.b64encode(f"{self._token}-{len(self._block_ids):08d}".encode()).decode()
+        self._block_ids.append(_block_id)
+        self._pending.append(self._executor.submit(self._blob_client.stage_block, _block_id, block, len(block)))
+
+    def close(self):
+        """Stage the last block and commit the block list."""
+        from azure.storage.blob import BlobBlock
+
+        if self.closed:
+            return
+        if self._failed:
+            self.abort()
+            raise OSError("The blob was not committed, a block failed to upload")
+        try:
+            if self._buffer or not self._block_ids:
+                self._stage(bytes(self._buffer))
+                self._buffer.clear()
+            for future in self._pending:
+                future.result()
+            self._blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for block_id in self._block_ids],
+                content_settings=self._content_settings
+            )
+        finally:
+            self._executor.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        """Drop the staged blocks without committing them."""
+        if self.closed:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._buffer.clear()
+        super().close()
+
+    def __del__(self):
+        # io.IOBase closes a collected file, which would commit a partial blob
+        self.abort()
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def open_blob_writer(path: str, file: str, connection: str = OUTPUT_CONNECTION, content_settings=None) -> BlockBlobWriter:
+    """Return a BlockBlobWriter streaming to the blob {path}/{file}."""
+    return BlockBlobWriter(get_blob_client(connection, path, file), content_settings=content_settings)
+
+
+def is_stream_output(stream_output: bool = None) -> bool:
+    """Return True if the output should be streamed, from the request or the STREAM_OUTPUT app setting."""
+    if stream_output is not None:
+        return bool(stream_output)
+    return os.environ.get("STREAM_OUTPUT", "false").lower() in ("true", "1", "yes")
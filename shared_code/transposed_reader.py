@@ -0,0 +1,158 @@
+"""
+Column-wise reader of the fb layout.
+
+The fb tables are stored transposed: one row per process parameter, one column per experiment.
+The generic path reads the whole table, transposes it with _df.T (every cell becomes an object and the
+table is copied), drops the empty rows and columns twice and scans the experiment ids for "Template".
+read_fb builds the transposed table directly from the row stream instead: every sheet row is a parameter,
+i.e. an output column, so
+- the experiments kept (with an id, not a "Template") are known as soon as the id row is read,
+- each parameter row becomes one output column holding only the kept experiments,
+- the empty rows and the "↑"/"↓" parameters are dropped as they are read,
+- each output column gets a single dtype when the csv written is the same: int64, float64,
+  datetime64 or bool, object otherwise.
+
+The values are converted with the rules pd.read_excel applies (shared_code.workbook_reader): empty cells,
+error cells and the NA strings are missing, True and 1 (False and 0) collapse to the first one met in
+an experiment column. The result is the same table as the transform of the fb layout applied to read_sheet(...).
+
+Sheets read_fb can not convert with the same result (numeric experiment ids or parameter names, parameters
+without a name, no experiment left...) return None, they go through the generic path, which also raises
+the same errors as before.
+"""
+
+import datetime
+import math
+
+import pandas as pd
+
+from shared_code.excel_engines import DEFAULT_ENGINE, NA_STRINGS, iter_sheet_values
+from shared_code.workbook_reader import convert_value, forces_object, is_interned
+
+
+# offsets of the fb layout, see LAYOUTS["fb"]["read"]: header row + 2 skipped rows, 6 leading columns
+_SKIPPED_ROWS = 3
+_SKIPPED_COLS = 6
+
+_ID_COLUMN = "Experiment_ID"
+_BOOL_STRINGS = {"True", "TRUE", "true", "False", "FALSE", "false"}
+
+
+def _is_missing(value) -> bool:
+    """Return True for the converted values pandas reads as NaN."""
+    if isinstance(value, str):
+        return value in NA_STRINGS
+    return isinstance(value, float) and math.isnan(value)
+
+
+def _is_plain_name(value) -> bool:
+    """Return True for the ids and names kept as they are by pandas: non numeric, non boolean strings."""
+    return isinstance(value, str) and forces_object(value) and value not in _BOOL_STRINGS
+
+
+def _typed_column(values: list) -> pd.Series:
+    """
+    Return the values of an output column (None for the missing ones) with a single dtype when its csv
+    is unchanged, else with the object dtype.
+    """
+    _present = [value for value in values if value is not None]
+    if len(_present) == len(values):
+        if all(type(value) is int and -2**63 <= value < 2**63 for value in _present):
+            return pd.Series(values, dtype="int64")
+        if all(type(value) is bool for value in _present):
+            return pd.Series(values, dtype=bool)
+    if all(type(value) is float for value in _present):
+        return pd.Series([math.nan if value is None else value for value in values], dtype="float64")
+    if (
+        all(type(value) is datetime.datetime and not value.microsecond for value in _present)
+        # a column of dates only would be written without the times
+        and any(value.time() != datetime.time() for value in _present)
+    ):
+        return pd.to_datetime(pd.Series(values, dtype=object))
+    return pd.Series([math.nan if value is None else value for value in values], dtype=object)
+
+
+def read_fb(blob_content: bytes, engine: str = DEFAULT_ENGINE):
+    """Return the transformed table of a fb workbook built column-wise from the sheet rows, None if it can not."""
+    _rows = iter_sheet_values(blob_content, engine)
+
+    # the values of the skipped rows are met first by the interning of pandas
+    _first_seen = {}
+    for row_number, row in enumerate(_rows):
+        if row_number >= 1:
+            for col, value in enumerate(row[_SKIPPED_COLS + 1:]):
+                _value = convert_value(value)
+                if is_interned(_value):
+                    _first_seen.setdefault(col, {}).setdefault(_value, _value)
+        if row_number == _SKIPPED_ROWS - 1:
+            break
+
+    # the id row tells which experiments are kept
+    _id_row = next(_rows, None)
+    if _id_row is None:
+        return None
+    _ids = [convert_value(value) for value in _id_row[_SKIPPED_COLS + 1:]]
+    _kept = []
+    for col, value in enumerate(_ids):
+        if _is_missing(value):
+            continue
+        if not _is_plain_name(value):
+            return None
+        if "Template" not in value:
+            _kept.append(col)
+    if not _kept:
+        return None
+    _memos = [_first_seen.get(col, {}) for col in _kept]
+
+    # the output numbers the experiments with any value in the table, before the dropped ones are removed,
+    # only the experiments left of the last kept one matter and most of them are kept
+    _non_empty = {col for col, value in enumerate(_ids) if not _is_missing(value)}
+    _unknown = {col for col in range(_kept[-1]) if col not in _non_empty}
+    _names = [_ID_COLUMN]
+    _columns = [[_ids[col] for col in _kept]]
+
+    for row in _rows:
+        _name = convert_value(row[_SKIPPED_COLS]) if len(row) > _SKIPPED_COLS else ""
+        _cells = row[_SKIPPED_COLS + 1:]
+        _width = len(_cells)
+
+        _column = []
+        _any_value = False
+        for col, memo in zip(_kept, _memos):
+            if col >= _width:
+                _column.append(None)
+                continue
+            _value = convert_value(_cells[col])
+            _type = type(_value)
+            if (_type is str and _value in NA_STRINGS) or (_type is float and _value != _value):
+                _value = None
+            else:
+                _any_value = True
+                if _type is bool or (_type is int and (_value == 0 or _value == 1)):
+                    _value = memo.setdefault(_value, _value)
+            _column.append(_value)
+
+        if _is_missing(_name):
+            if _any_value or any(not _is_missing(convert_value(value)) for value in _cells):
+                # a parameter without a name
+                return None
+            # empty rows are dropped
+            continue
+        if not _is_plain_name(_name) or _name == _ID_COLUMN:
+            return None
+        if _unknown:
+            _unknown.difference_update(
+                [col for col in _unknown if col < _width and not _is_missing(convert_value(_cells[col]))]
+            )
+
+        if _name.startswith("↑") or _name.startswith("↓"):
+            continue
+        _names.append(_name)
+        _columns.append(_column)
+
+    _non_empty.update(col for col in range(_kept[-1]) if col not in _unknown)
+    _numbers = {col: number for number, col in enumerate(sorted(_non_empty), start=1)}
+    _df = pd.DataFrame({position: _typed_column(values) for position, values in enumerate(_columns)})
+    _df.index = pd.Index([_numbers[col] for col in _kept], dtype="int64", name="id")
+    _df.columns = pd.Index(_names, dtype=object)
+    return _df
@@ -0,0 +1,190 @@
+"""
+Validation (dry run) of a workbook: "mode": "validate" in the request body.
+
+Data Factory only needs to know whether a file can be converted: right unit of operation, expected
+headers (e.g. "Parameter name pivot" for ff, "Spalte_Compiling_Timestamp" for analytical) and data
+after them. The validation streams the sheet rows only as far as the header region of the layout
+(shared_code.layouts.LAYOUT_SPECS) and a few data rows, nothing is written:
+- ff, analytical: the header row of the table and SAMPLE_ROWS rows after it,
+- fb (transposed): the experiment ids row, then the parameter names column and the first SAMPLE_ROWS
+  experiments of every parameter, the cells right of them are not converted.
+It returns the schema of the output (column names and the kind of values seen in the sampled rows),
+an estimate of the number of rows of the output and the problems found.
+
+pandas is not imported, a validation stays fast on a worker that has not converted anything yet.
+"""
+
+import datetime
+import re
+from contextlib import closing
+
+from shared_code.excel_engines import ERROR_CODES, NA_STRINGS, estimate_sheet_rows, iter_sheet_values
+from shared_code.layouts import header_row, layout_plan
+
+
+SAMPLE_ROWS = 5
+
+# the sheetxml engine only parses the sheet part, the workbook is not loaded: a validation of a large
+# workbook takes milliseconds instead of the second openpyxl needs to open it
+DEFAULT_VALIDATION_ENGINE = "sheetxml"
+
+# the strings pandas reads as missing values and the error codes of the cells
+_MISSING_STRINGS = NA_STRINGS | ERROR_CODES
+
+
+def _is_missing(value) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return value in _MISSING_STRINGS
+    return isinstance(value, float) and value != value
+
+
+def _kind(values: list) -> str:
+    """Return the kind of the sampled values of a column: number, text, datetime, bool, mixed or empty."""
+    _kinds = set()
+    for value in values:
+        if _is_missing(value):
+            continue
+        if isinstance(value, bool):
+            _kinds.add("bool")
+        elif isinstance(value, (int, float)):
+            _kinds.add("number")
+        elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            _kinds.add("datetime")
+        else:
+            _kinds.add("text")
+    if not _kinds:
+        return "empty"
+    return _kinds.pop() if len(_kinds) == 1 else "mixed"
+
+
+def _json_name(name):
+    """Column names as they are written in the csv header, None for a missing one."""
+    return name if name is None or isinstance(name, str) else str(name)
+
+
+def _cell(row, col):
+    return row[col] if col < len(row) else None
+
+
+def _validate_table(blob_content: bytes, engine: str, spec: dict, problems: list):
+    """Validate a layout whose header is the first row of the table, return (schema, data rows read)."""
+    _skip_cols = spec["read"].get("skip_cols", 0)
+    _header_row = header_row(spec["read"])
+
+    _header = None
+    _sample = []
+    # the engine is stopped once the sample is read, the rest of the sheet is never parsed
+    with closing(iter_sheet_values(blob_content, engine)) as rows:
+        for row_number, row in enumerate(rows):
+            if row_number < _header_row:
+                continue
+            if row_number == _header_row:
+                _header = list(row[_skip_cols:])
+                while _header and _is_missing(_header[-1]):
+                    _header.pop()
+                continue
+            _sample.append(row)
+            if len(_sample) == SAMPLE_ROWS:
+                break
+
+    if not _header:
+        problems.append(f"The header row {_header_row + 1} of the table is empty or missing")
+        return [], 0
+
+    _prefixes = tuple(spec.get("drop_column_prefixes", ()))
+    _rename = spec.get("rename", {})
+    _schema = []
+    _positions = {}
+    for position, name in enumerate(_header):
+        _name = None if _is_missing(name) else name
+        if spec.get("drop_non_string_columns") and not isinstance(_name, str):
+            continue
+        if isinstance(_name, str) and _prefixes and _name.startswith(_prefixes):
+            continue
+        _positions.setdefault(_name, position)
+        _values = [_cell(row, _skip_cols + position) for row in _sample]
+        _schema.append({"name": _json_name(_rename.get(_name, _name)), "kind": _kind(_values)})
+
+    for column in [spec.get("id_column"), *spec.get("dtypes", {})]:
+        if column is not None and column not in _positions:
+            problems.append(f"The column '{column}' is missing from the header row {_header_row + 1}")
+
+    _id_column = spec.get("id_column")
+    if _id_column in _positions:
+        _ids = [_cell(row, _skip_cols + _positions[_id_column]) for row in _sample]
+        if all(_is_missing(value) for value in _ids):
+            problems.append(f"The first rows after the header have no '{_id_column}'")
+    elif not any(not _is_missing(value) for row in _sample for value in row[_skip_cols:]):
+        problems.append("There is no data after the header row")
+    return _schema, len(_sample)
+
+
+def _validate_transposed(blob_content: bytes, engine: str, spec: dict, problems: list):
+    """Validate a transposed layout, return (schema, number of experiments kept)."""
+    _skip_cols = spec["read"].get("skip_cols", 0)
+    _id_row = header_row(spec["read"])
+    _pattern = re.compile(spec["drop_rows_matching"]) if spec.get("drop_rows_matching") else None
+    _prefixes = tuple(spec.get("drop_column_prefixes", ()))
+
+    # the ids row tells which experiments are kept
+    _kept = None
+    with closing(iter_sheet_values(blob_content, engine)) as rows:
+        for row_number, row in enumerate(rows):
+            if row_number < _id_row:
+                continue
+            _ids = [(col, value) for col, value in enumerate(row) if col > _skip_cols and not _is_missing(value)]
+            _kept = [
+                col for col, value in _ids
+                if _pattern is None or not (isinstance(value, str) and _pattern.search(value))
+            ]
+            if not _ids:
+                problems.append(f"The experiment ids row {_id_row + 1} is empty")
+            elif not _kept:
+                problems.append(f"Every experiment of row {_id_row + 1} is dropped ({spec['drop_rows_matching']})")
+            break
+    if _kept is None:
+        problems.append(f"The sheet ends before the experiment ids row {_id_row + 1}")
+        return [], 0
+
+    # the parameters are read from the names column and the first experiments only
+    _schema = [{"name": spec["id_column"], "kind": "text"}]
+    _max_cols = max([_skip_cols, *_kept[:SAMPLE_ROWS]]) + 1
+    with closing(iter_sheet_values(blob_content, engine, max_cols=_max_cols)) as rows:
+        for row_number, row in enumerate(rows):
+            if row_number <= _id_row:
+                continue
+            _name = _cell(row, _skip_cols)
+            if _is_missing(_name):
+                continue
+            if isinstance(_name, str) and _prefixes and _name.startswith(_prefixes):
+                continue
+            _values = [_cell(row, col) for col in _kept[:SAMPLE_ROWS]]
+            _schema.append({"name": _json_name(_name), "kind": _kind(_values)})
+
+    if len(_schema) == 1:
+        problems.append(f"No parameter name in column {_skip_cols + 1}")
+    return _schema, len(_kept)
+
+
+def validate_workbook(blob_content: bytes, layout: str, engine: str = DEFAULT_VALIDATION_ENGINE) -> dict:
+    """Return the schema, the estimated number of rows and the problems of the workbook for the layout."""
+    _spec = layout_plan(layout)["spec"]
+    _problems = []
+    if _spec.get("transpose"):
+        _schema, _estimated_rows = _validate_transposed(blob_content, engine, _spec, _problems)
+    else:
+        _schema, _sampled = _validate_table(blob_content, engine, _spec, _problems)
+        # the rows are not read, the estimate counts the rows after the header, dropped ones included
+        _sheet_rows = estimate_sheet_rows(blob_content) or 0
+        _estimated_rows = max(_sampled, _sheet_rows - header_row(_spec["read"]) - 1)
+
+    if _estimated_rows == 0 and not _problems:
+        _problems.append("The table is empty")
+    return {
+        "valid": not _problems,
+        "schema": _schema,
+        "estimated_rows": _estimated_rows,
+        "problems": _problems,
+    }
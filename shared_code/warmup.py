@@ -0,0 +1,82 @@
+"""
+Warm-up of a new worker, so that the first conversion it serves does not pay the cold start.
+
+The heavy libraries (pandas, openpyxl, pyarrow, azure-storage-blob) are only imported on first use,
+warm_up imports them and runs a tiny in-memory workbook of every layout through the whole parse path:
+read_layout, transform_layout and write_output. Nothing is read from or written to the storage accounts.
+"""
+
+import io
+import logging
+import os
+
+from shared_code.excel_engines import resolve_engine
+from shared_code.instrumentation import StageTimer
+from shared_code.layouts import LAYOUTS, read_layout, transform_layout
+from shared_code.outputs import resolve_output, write_output
+
+
+# a few rows with the structure of each layout, enough for the transformations to run
+SAMPLE_ROWS = {
+    "fb": [
+        ["Meta"] * 6 + ["Header", "h1", "h2"],
+        [None] * 6 + ["row2", 1, None],
+        [None] * 6 + ["row3", 2.5, None],
+        [None] * 6 + ["ID", "EXP-001", "Template 1"],
+        [None] * 6 + ["param_1", 10, 20],
+        [None] * 6 + ["↑ param_2", 1.5, 2.5],
+    ],
+    "ff": [
+        ["Title"],
+        *[[None, f"info{i}"] for i in range(6)],
+        [None, "Parameter name pivot", "col_1", "↓ col_2"],
+        [None, "E001", 1, "x"],
+        [None, "---", None, None],
+    ],
+    "analytical": [
+        ["Analytical export"],
+        [],
+        ["Generated"],
+        [],
+        ["Sample", "Spalte_Compiling_Timestamp", "Value"],
+        ["S1", "2024-02-02 10:00", 1.5],
+    ],
+}
+
+
+def sample_workbook(layout: str) -> bytes:
+    """Return a small xlsx workbook with the structure of the layout."""
+    from openpyxl import Workbook
+
+    _workbook = Workbook()
+    _sheet = _workbook.active
+    for row in SAMPLE_ROWS[layout]:
+        _sheet.append(row)
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    return _buffer.getvalue()
+
+
+def warm_up(engine: str = None, output_formats: list = None) -> dict:
+    """
+    Run the sample workbook of every layout through the parse path and return the timings.
+    The output formats default to the WARMUP_OUTPUT_FORMATS app setting (comma separated, "csv" by default).
+    """
+    _engine = resolve_engine(engine)
+    if output_formats is None:
+        output_formats = [
+            name.strip() for name in os.environ.get("WARMUP_OUTPUT_FORMATS", "csv").split(",") if name.strip()
+        ]
+
+    _timer = StageTimer()
+    for layout in LAYOUTS:
+        with _timer.stage(f"{layout}_parse"):
+            _df = transform_layout(read_layout(sample_workbook(layout), layout, _engine), layout)
+        for output_format in output_formats:
+            _format, _compression = resolve_output(output_format)
+            with _timer.stage(f"{layout}_{_format}"):
+                write_output(_df, io.BytesIO(), _format, _compression)
+
+    logging.info(f"Worker warmed up with engine {_engine} in {_timer.as_dict()['total_s']}s")
+    _timer.emit("warmup", engine=_engine)
+    return _timer.as_dict()
@@ -0,0 +1,147 @@
+"""
+Streaming reader for the xlsm workbooks handled by the blueprints.
+
+pd.read_excel materialises the whole first sheet as a DataFrame before the blueprints throw
+away the leading rows and columns with iloc. The reader in this module walks the sheet row by
+row instead (openpyxl read_only / values_only mode, or one of the faster engines of
+shared_code.excel_engines), so that:
+- the header offsets (rows above the table and columns left of it) are never materialised,
+- trailing empty rows are never materialised,
+- only the kept table is handed to pandas.
+
+The resulting DataFrame is the same as pd.read_excel(..., engine='openpyxl').iloc[skip_rows:, skip_cols:],
+including the index labels, so the existing transforms keep working on it unchanged.
+"""
+
+import math
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+from shared_code.excel_engines import DEFAULT_ENGINE, ERROR_CODES, NA_STRINGS, iter_sheet_values
+
+
+def convert_value(value):
+    """
+    Convert a raw cell value the same way pandas does for the openpyxl engine:
+    empty cells become "", error cells become NaN and integral numbers become int.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        _int_value = int(value)
+        if _int_value == value:
+            return _int_value
+        return float(value)
+    if isinstance(value, str) and value in ERROR_CODES:
+        # values_only does not expose the cell type, error cells come back as their code
+        return math.nan
+    return value
+
+
+def _trimmed_length(row) -> int:
+    """Return the length of the converted row once the trailing empty cells are removed."""
+    _length = len(row)
+    while _length and row[_length - 1] == "":
+        _length -= 1
+    return _length
+
+
+def forces_object(value) -> bool:
+    """
+    Return True if a value in a skipped data row would have made pandas keep its column as object.
+    Only non numeric strings are taken into account, this is what the header rows of the templates contain.
+    """
+    if not isinstance(value, str) or value in NA_STRINGS:
+        return False
+    try:
+        float(value)
+    except ValueError:
+        return True
+    return False
+
+
+def is_interned(value) -> bool:
+    """
+    Return True for the values pandas may substitute with an equal value seen earlier in the same column.
+    pandas interns the values of object columns, so True and 1 (or False and 0) collapse to the first one met.
+    """
+    return isinstance(value, bool) or (isinstance(value, int) and value in (0, 1))
+
+
+def parse_rows(rows: list, dtype: dict = None) -> pd.DataFrame:
+    """
+    Parse rows of converted cell values into a DataFrame with the parser pd.read_excel hands the sheet rows to,
+    so that the columns get the same dtypes and values as with pd.read_excel.
+    TextParser is not exported by the pandas namespace, it is only used here: the supported pandas versions
+    are pinned in requirements.txt and tests/test_engines.py compares read_sheet with pd.read_excel.
+    """
+    return TextParser(rows, header=None, skip_blank_lines=False, dtype=dtype).read()
+
+
+def read_sheet(
+    blob_content: bytes, header=0, skip_rows: int = 0, skip_cols: int = 0, engine: str = DEFAULT_ENGINE
+) -> pd.DataFrame:
+    """
+    Read the first worksheet of the workbook, equivalent to
+    pd.read_excel(blob, engine='openpyxl', header=header).iloc[skip_rows:, skip_cols:].
+
+    header: 0 if the first sheet row is the (discarded) header row, None otherwise.
+    skip_rows: number of data rows to skip, after the header row if any.
+    skip_cols: number of leading columns to skip.
+    engine: name of the engine reading the sheet rows, see shared_code.excel_engines.
+    """
+    _header_rows = 0 if header is None else header + 1
+    _skipped_rows = _header_rows + skip_rows
+
+    _width = 0
+    _skipped = []
+    _data = []
+    _pending_blank_rows = 0
+
+    for row_number, row in enumerate(iter_sheet_values(blob_content, engine)):
+        if row_number < _skipped_rows:
+            _converted = [convert_value(value) for value in row]
+            _width = max(_width, _trimmed_length(_converted))
+            if row_number >= _header_rows:
+                # the skipped data rows take part in the dtypes and the interning of the columns
+                _skipped.append(_converted[skip_cols:])
+            continue
+
+        _converted = [convert_value(value) for value in row[skip_cols:]]
+        _length = _trimmed_length(_converted)
+        if _length:
+            _row_width = skip_cols + _length
+        else:
+            _row_width = _trimmed_length([convert_value(value) for value in row[:skip_cols]])
+
+        if not _row_width:
+            # blank rows are only kept if more data follows, the trailing empty region is dropped
+            _pending_blank_rows += 1
+            continue
+
+        _width = max(_width, _row_width)
+        _data.extend([] for _ in range(_pending_blank_rows))
+        _pending_blank_rows = 0
+        del _converted[_length:]
+        _data.append(_converted)
+
+    _columns = _width - skip_cols
+    if not _data or _columns <= 0:
+        return pd.DataFrame(index=pd.RangeIndex(skip_rows, skip_rows + len(_data)))
+
+    _rows = _skipped + _data
+    for row in _rows:
+        del row[_columns:]
+        if len(row) < _columns:
+            row.extend([""] * (_columns - len(row)))
+
+    # the columns are typed over the skipped rows as well, as pd.read_excel does, then these rows are dropped
+    _df = parse_rows(_rows)
+    _df = _df.iloc[len(_skipped):]
+
+    _df.index = pd.RangeIndex(skip_rows, skip_rows + len(_df))
+    _df.columns = pd.RangeIndex(skip_cols, skip_cols + len(_df.columns))
+    return _df
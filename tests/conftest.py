@@ -0,0 +1,171 @@
+"""
+Shared fixtures of the test suite, run from the root of the repository:
+
+    pip install -r requirements-dev.txt
+    python -m pytest -q
+
+The tests marked azurite run against the storage emulator, they are skipped unless the AZURITE_CONNECTION
+environment variable holds its connection string, see tests/test_azurite.py.
+"""
+
+import datetime
+import io
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOLDEN = os.path.join(ROOT, "tests", "golden")
+sys.path.insert(0, ROOT)
+
+
+def golden_bytes(name: str) -> bytes:
+    with open(os.path.join(GOLDEN, name), "rb") as source:
+        return source.read()
+
+
+@pytest.fixture
+def golden():
+    return golden_bytes
+
+
+class MemoryWriter(io.BytesIO):
+    """Output blob kept in memory, stored in its container when closed like the block blob writer."""
+
+    def __init__(self, blobs: dict, key: tuple):
+        super().__init__()
+        self._blobs = blobs
+        self._key = key
+
+    @property
+    def size(self) -> int:
+        return len(self._blobs[self._key]) if self.closed else len(self.getbuffer())
+
+    def close(self):
+        if not self.closed:
+            self._blobs[self._key] = self.getvalue()
+        super().close()
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        super().close()
+
+
+class MemoryStorage:
+    """Blob containers in memory, patched over the storage functions a module imported."""
+
+    def __init__(self, monkeypatch):
+        self._monkeypatch = monkeypatch
+        self.blobs = {}
+        self._versions = {}
+
+    def put(self, path: str, file: str, data: bytes):
+        self.blobs[(path, file)] = data
+        # every write of the blob is a new version, as in the storage account
+        self._versions[(path, file)] = self._versions.get((path, file), 0) + 1
+
+    def get(self, path: str, file: str) -> bytes:
+        return self.blobs[(path, file)]
+
+    def properties(self, path: str, file: str, connection: str = None):
+        _data = self.download(path, file)
+        return SimpleNamespace(
+            size=len(_data), etag=f'"{hash(_data)}"',
+            last_modified=datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)
+        )
+
+    def download(self, path: str, file: str, connection: str = None, etag: str = None, **kwargs) -> bytes:
+        if (path, file) not in self.blobs:
+            raise ResourceNotFoundError(f"{path}/{file} does not exist")
+        return self.blobs[(path, file)]
+
+    def download_version(self, path: str, file: str, connection: str = None):
+        return self.download(path, file), self._etag(path, file)
+
+    def upload(self, path: str, file: str, data: bytes, connection: str = None, etag: str = None, if_missing: bool = False):
+        if etag is not None and etag != self._etag(path, file):
+            raise ResourceModifiedError(f"{path}/{file} was modified")
+        if if_missing and (path, file) in self.blobs:
+            raise ResourceExistsError(f"{path}/{file} already exists")
+        self.put(path, file, data)
+
+    def delete(self, path: str, file: str, connection: str = None):
+        self.blobs.pop((path, file), None)
+
+    def _etag(self, path: str, file: str) -> str:
+        return f'"{self._versions.get((path, file), 0)}"'
+
+    def names(self, path: str, connection: str = None) -> list:
+        return sorted(file for blob_path, file in self.blobs if blob_path == path)
+
+    def size(self, path: str, file: str, connection: str = None):
+        return len(self.blobs[(path, file)]) if (path, file) in self.blobs else None
+
+    def writer(self, path: str, file: str, connection: str = None, content_settings=None) -> MemoryWriter:
+        return MemoryWriter(self.blobs, (path, file))
+
+    def patch(self, module):
+        """Replace the storage functions imported by the module, return the storage."""
+        for name, replacement in {
+            "get_blob_properties": self.properties, "download_blob_ranged": self.download,
+            "download_blob": self.download, "open_blob_writer": self.writer, "upload_blob": self.upload,
+            "get_blob_size": self.size, "download_blob_version": self.download_version,
+            "list_blob_names": self.names, "delete_blob": self.delete,
+        }.items():
+            if hasattr(module, name):
+                self._monkeypatch.setattr(module, name, replacement)
+        return self
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE", "false")
+    return MemoryStorage(monkeypatch)
+
+
+class OutputBinding:
+    """Output binding of a blob, keeps what the function sets."""
+
+    def __init__(self):
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def http_request(body, route: str = "http-parse-to-csv"):
+    """POST request of the route with a JSON body, bytes are sent as they are."""
+    import azure.functions as func
+
+    _body = body if isinstance(body, bytes) else json.dumps(body).encode()
+    return func.HttpRequest("POST", f"/api/{route}", body=_body)
+
+
+def input_stream(data: bytes, name: str = "input/table.xlsx"):
+    """Input binding of a blob holding data."""
+    import azure.functions as func
+
+    return func.blob.InputStream(data=data, name=name, length=len(data))
+
+
+@pytest.fixture(autouse=True)
+def fresh_parsed_cache(monkeypatch):
+    """Every test starts without parsed tables, they would skip the parse of the workbooks."""
+    from collections import OrderedDict
+
+    from shared_code import parsed_cache
+
+    monkeypatch.setattr(parsed_cache, "_tables", parsed_cache.TableCache(parsed_cache._max_bytes))
+    monkeypatch.setattr(parsed_cache, "_etags", OrderedDict())
@@ -0,0 +1,180 @@
+"""
+Write the golden workbooks of tests/golden and their expected CSV.
+
+The workbooks have the structure of the fb, ff and analytical layouts (benchmarks.workbooks) with edge cells
+mixed into their values: whitespace only and padded strings, the strings pandas reads as missing values,
+error cells, numbers stored as text, mixed int, float and bool values and dates. edge_cells.xlsx holds the
+same cells in a plain sheet. The expected CSV is written by the baseline conversion of the blueprints,
+pd.read_excel with the openpyxl engine followed by the transformations of each layout, and must not be
+regenerated to make a test pass:
+
+    python tests/make_golden.py
+"""
+
+import datetime
+import io
+import os
+import random
+import sys
+
+import pandas as pd
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.workbooks import analytical_rows, fb_rows, ff_rows  # noqa: E402
+
+
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+EDGE_VALUES = [
+    " ", "  ", "\t", " padded ", "x ", "NA", "n/a", "NULL", "None", "nan", "", "#N/A", "#DIV/0!", "-3", "1.5",
+    "1e3", "TRUE", True, False, 0, 1, -3, 2.5, 1e-7, 10**15, -0.0,
+    datetime.datetime(2024, 1, 2), datetime.datetime(2024, 1, 2, 10, 30, 15), datetime.date(2023, 5, 1),
+    datetime.datetime(1900, 3, 1), "2024-02-02 10:00", "é ü ↑",
+]
+
+
+def _with_edges(rows, first_row: int, first_col: int, seed: int):
+    """Replace some of the values right of first_col, below first_row, with edge values."""
+    _rng = random.Random(seed)
+    for number, row in enumerate(rows):
+        row = list(row)
+        if number >= first_row:
+            for col in range(first_col, len(row)):
+                if _rng.random() < 0.2:
+                    row[col] = _rng.choice(EDGE_VALUES)
+        yield row
+
+
+def _save(rows, name: str, write_only: bool = False) -> bytes:
+    # the regular mode stores the strings in the shared strings, the write_only mode inline in the sheet
+    _workbook = Workbook(write_only=write_only)
+    _sheet = _workbook.create_sheet("Data") if write_only else _workbook.active
+    for row in rows:
+        _sheet.append(row)
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    with open(os.path.join(GOLDEN, name), "wb") as target:
+        target.write(_buffer.getvalue())
+    return _buffer.getvalue()
+
+
+##### baseline conversions #####
+
+def baseline_fb(blob_content: bytes) -> bytes:
+    _df = pd.read_excel(io.BytesIO(blob_content), engine='openpyxl')
+    _df = _df.iloc[:, 6:]
+    _df = _df.iloc[2:, :]
+    _df.columns = [None] * len(_df.columns)
+    _df.iloc[0, 0] = 'Experiment_ID'
+    _df.reset_index(drop=True, inplace=True)
+    _df_transposed = _df.T
+    _df_transposed.columns = [None] * len(_df_transposed.columns)
+    _df_transposed.dropna(axis=1, how='all', inplace=True)
+    _df_transposed.dropna(axis=0, how='all', inplace=True)
+    new_header = _df_transposed.iloc[0]
+    _df_transposed = _df_transposed[1:]
+    _df_transposed.columns = new_header
+    idx = pd.Series(range(1, len(_df_transposed) + 1))
+    _df_transposed.set_index(idx, inplace=True)
+    _df_transposed.index.name = 'id'
+    _df_transposed.drop(
+        [col for col in _df_transposed.columns if col.startswith('↑') or col.startswith('↓')], axis=1, inplace=True
+    )
+    _df_transposed.drop(
+        _df_transposed[_df_transposed['Experiment_ID'].str.contains('Template', na=False)].index, inplace=True
+    )
+    _df_transposed.dropna(subset=['Experiment_ID'], inplace=True)
+    buffer = io.BytesIO()
+    _df_transposed.to_csv(buffer, index=True)
+    return buffer.getvalue()
+
+
+def baseline_ff(blob_content: bytes) -> bytes:
+    _df = pd.read_excel(io.BytesIO(blob_content), engine='openpyxl')
+    _df = _df.iloc[6:]
+    _df = _df.iloc[:, 1:]
+    new_header = _df.iloc[0]
+    _df = _df[1:]
+    _df.columns = new_header
+    _df = _df.drop([col for col in _df.columns if not isinstance(col, str)], axis=1)
+    _df = _df.drop([col for col in _df.columns if col.startswith('↑') or col.startswith('↓')], axis=1)
+    _df = _df.dropna(subset=['Parameter name pivot'])
+    _df = _df[~_df['Parameter name pivot'].str.contains('---|Insert')]
+    _df = _df.rename(columns={'Parameter name pivot': 'Experiment ID'})
+    buffer = io.BytesIO()
+    _df.to_csv(buffer, index=True)
+    return buffer.getvalue()
+
+
+def baseline_analytical(blob_content: bytes) -> bytes:
+    _df = pd.read_excel(io.BytesIO(blob_content), engine='openpyxl', header=None)
+    _df = _df.iloc[4:]
+    _df.columns = _df.iloc[0]
+    _df = _df[1:]
+    _df.reset_index(drop=True, inplace=True)
+    _df['Spalte_Compiling_Timestamp'] = pd.to_datetime(_df['Spalte_Compiling_Timestamp'], errors='coerce')
+    buffer = io.BytesIO()
+    _df.to_csv(buffer, index=True)
+    return buffer.getvalue()
+
+
+# read_sheet arguments of edge_cells.xlsx, and the expected table as pd.read_excel(...).iloc reads it
+EDGE_READ = {"header": 0, "skip_rows": 2, "skip_cols": 1}
+
+
+def baseline_edge_cells(blob_content: bytes) -> bytes:
+    _df = pd.read_excel(io.BytesIO(blob_content), engine='openpyxl', header=EDGE_READ["header"])
+    _df = _df.iloc[EDGE_READ["skip_rows"]:, EDGE_READ["skip_cols"]:]
+    buffer = io.BytesIO()
+    _df.to_csv(buffer, index=True, header=False)
+    return buffer.getvalue()
+
+
+def edge_rows(seed: int = 0):
+    """A plain sheet of edge values: every column gets its own mix, some of them a single kind."""
+    _rng = random.Random(seed)
+    yield [f"Header {c}" for c in range(12)]
+    for r in range(40):
+        _row = []
+        for c in range(12):
+            if c == 0:
+                _row.append(f"row {r}")
+            elif c == 1:
+                # whitespace and numbers: the column stays object
+                _row.append(_rng.choice([" ", 1, 2, None]))
+            elif c == 2:
+                # integers with blanks: the column is float
+                _row.append(_rng.choice([1, 2, None]))
+            elif c == 3:
+                # integers and missing strings
+                _row.append(_rng.choice([-3, 4, "NA", "n/a"]))
+            elif c == 4:
+                _row.append(_rng.choice([True, False, None]))
+            elif c == 5:
+                _row.append(_rng.choice([True, 1, 0, False, 2.5]))
+            elif c == 6:
+                _row.append(_rng.choice([datetime.datetime(2024, 1, 2), datetime.date(2023, 5, 1), None]))
+            else:
+                _row.append(_rng.choice(EDGE_VALUES + [None]))
+        yield _row
+
+
+def main():
+    os.makedirs(GOLDEN, exist_ok=True)
+    _cases = [
+        ("fb", _with_edges(fb_rows(30, 40, seed=1), 4, 7, seed=11), baseline_fb, False),
+        ("ff", _with_edges(ff_rows(60, 25, seed=2), 8, 2, seed=12), baseline_ff, False),
+        ("analytical", _with_edges(analytical_rows(80, 8, seed=3), 5, 2, seed=13), baseline_analytical, False),
+        ("edge_cells", edge_rows(), baseline_edge_cells, True),
+    ]
+    for name, rows, baseline, write_only in _cases:
+        _blob = _save(rows, f"{name}.xlsx", write_only=write_only)
+        with open(os.path.join(GOLDEN, f"{name}.csv"), "wb") as target:
+            target.write(baseline(_blob))
+        print(f"{name}.xlsx {len(_blob)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+
+import pytest
+
+from shared_code.admission import AdmissionController, AdmissionRejected, BASE_COST_MB, estimate_cost_mb
+
+
+def _hold(controller: AdmissionController, cost_mb: float, order: list, release: threading.Event):
+    with controller.admit(cost_mb):
+        order.append(cost_mb)
+        release.wait()
+
+
+def test_conversions_run_within_the_budget():
+    _controller = AdmissionController(budget_mb=100, max_wait=5)
+    _order, _release = [], threading.Event()
+    _threads = [threading.Thread(target=_hold, args=(_controller, 60, _order, _release)) for _ in range(2)]
+    for thread in _threads:
+        thread.start()
+    time.sleep(0.1)
+    assert (_controller.running, len(_order)) == (1, 1)
+    _release.set()
+    for thread in _threads:
+        thread.join()
+    assert (_controller.running, _controller.in_use_mb, _controller.admitted) == (0, 0, 2)
+
+
+def test_waiting_conversions_are_admitted_smallest_first():
+    _controller = AdmissionController(budget_mb=100, max_wait=5)
+    _order, _release = [], threading.Event()
+    _first = threading.Thread(target=_hold, args=(_controller, 100, _order, _release))
+    _first.start()
+    time.sleep(0.05)
+    _waiting = []
+    for cost_mb in (80, 30, 50):
+        _waiting.append(threading.Thread(target=_hold, args=(_controller, cost_mb, _order, _release)))
+        _waiting[-1].start()
+        time.sleep(0.05)
+    _release.set()
+    for thread in [_first] + _waiting:
+        thread.join()
+    assert _order == [100, 30, 50, 80]
+
+
+def test_conversion_larger_than_the_budget_runs_alone():
+    _controller = AdmissionController(budget_mb=100, max_wait=1)
+    with _controller.admit(500):
+        assert _controller.running == 1
+
+
+def test_conversions_are_rejected_after_the_wait_or_when_the_queue_is_full():
+    _controller = AdmissionController(budget_mb=100, max_wait=5, max_queue=0, retry_after=7)
+    with pytest.raises(AdmissionRejected) as rejection:
+        _controller.acquire(10)
+    assert rejection.value.retry_after == 7
+
+    _controller = AdmissionController(budget_mb=100, max_wait=0.1)
+    with _controller.admit(100):
+        with pytest.raises(AdmissionRejected):
+            _controller.acquire(10)
+    assert _controller.stats()["admission_rejected"] == 1
+    assert _controller.stats()["admission_waiting"] == 0
+
+
+def test_disabled_controller_admits_everything():
+    _controller = AdmissionController(budget_mb=0)
+    with _controller.admit(10**6), _controller.admit(10**6):
+        assert _controller.running == 0
+
+
+def test_cost_grows_with_the_blob():
+    assert estimate_cost_mb(0, "fb") == BASE_COST_MB
+    assert estimate_cost_mb(2**20, "fb") > BASE_COST_MB
+    assert estimate_cost_mb(2**20, None) > BASE_COST_MB
+    # a template variant costs what its layout costs
+    assert estimate_cost_mb(2**20, "ff@8:1") == estimate_cost_mb(2**20, "ff") != estimate_cost_mb(2**20, None)
+
+
+@pytest.fixture
+def saturated(monkeypatch):
+    """The admission controller of the worker, with a full queue: every conversion is rejected."""
+    from shared_code import admission
+
+    _controller = AdmissionController(budget_mb=100, max_wait=5, max_queue=0, retry_after=7)
+    monkeypatch.setattr(admission, "controller", _controller)
+    return _controller
+
+
+def test_routes_answer_429_with_a_retry_after(saturated):
+    from blueprints.http_parse_to_csv import http_parse_to_csv
+    from tests.conftest import OutputBinding, golden_bytes, http_request, input_stream
+
+    _outputblob = OutputBinding()
+    _body = {"input_path": "input", "input_file": "run_STOV_01.xlsx", "output_path": "output"}
+    _response = http_parse_to_csv(http_request(_body), input_stream(golden_bytes("ff.xlsx")), _outputblob)
+    _result = json.loads(_response.get_body())
+    assert (_response.status_code, _response.headers["Retry-After"]) == (429, "7")
+    assert (_result["layout"], _result["admission"]["admission_rejected"]) == ("ff", 1)
+    assert _result["error"].startswith("TOO MANY CONVERSIONS") and _outputblob.value is None
+
+    # the validations are not admitted
+    _response = http_parse_to_csv(
+        http_request({**_body, "mode": "validate"}), input_stream(golden_bytes("ff.xlsx")), _outputblob
+    )
+    assert _response.status_code == 200 and json.loads(_response.get_body())["valid"]
+    assert saturated.rejected == 1
+
+
+def test_batch_items_are_rejected_with_a_retry_after(saturated, storage):
+    from blueprints import http_parse_to_csv_batch as batch
+    from shared_code import http_conversion
+    from tests.conftest import golden_bytes, http_request
+
+    storage.patch(batch)
+    storage.patch(http_conversion)
+    storage.put("input", "run_STOV_01.xlsx", golden_bytes("ff.xlsx"))
+    storage.put("input", "run_DIL_01.xlsx", golden_bytes("fb.xlsx"))
+    _items = [
+        {"input_path": "input", "input_file": name, "output_path": "output"}
+        for name in ("run_STOV_01.xlsx", "run_DIL_01.xlsx")
+    ]
+    _response = batch.http_parse_to_csv_batch(http_request({"items": _items}, "http-parse-to-csv-batch"))
+    _result = json.loads(_response.get_body())
+    assert (_response.status_code, _response.headers["Retry-After"]) == (207, "7")
+    assert (_result["succeeded"], _result["failed"]) == (0, 2)
+    assert [(item["status_code"], item["retry_after"]) for item in _result["items"]] == [(429, 7), (429, 7)]
+    assert not [blob for blob in storage.blobs if blob[0] == "output"]
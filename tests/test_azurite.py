@@ -0,0 +1,151 @@
+"""
+Integration tests against the Azurite storage emulator, skipped unless AZURITE_CONNECTION holds its connection string:
+
+    docker run -p 10000:10000 -p 10001:10001 mcr.microsoft.com/azure-storage/azurite
+    export AZURITE_CONNECTION="DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;AccountKey=...;BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;QueueEndpoint=http://127.0.0.1:10001/devstoreaccount1;"
+"""
+
+import json
+import os
+import uuid
+
+import pytest
+
+from shared_code import storage
+
+AZURITE_CONNECTION = os.environ.get("AZURITE_CONNECTION")
+
+pytestmark = [
+    pytest.mark.azurite,
+    pytest.mark.skipif(not AZURITE_CONNECTION, reason="AZURITE_CONNECTION is not set"),
+]
+
+
+@pytest.fixture
+def container(monkeypatch):
+    """A new container of the emulator, the input and output connections of the app target the emulator."""
+    from azure.storage.blob import BlobServiceClient
+
+    for connection in (storage.INPUT_CONNECTION, storage.OUTPUT_CONNECTION):
+        monkeypatch.setenv(connection, AZURITE_CONNECTION)
+    storage.get_blob_service_client.cache_clear()
+    _name = f"tests-{uuid.uuid4().hex[:12]}"
+    _client = BlobServiceClient.from_connection_string(AZURITE_CONNECTION).get_container_client(_name)
+    _client.create_container()
+    yield _name
+    _client.delete_container()
+    storage.get_blob_service_client.cache_clear()
+
+
+def test_block_writer_commits_the_blob(container):
+    _data = os.urandom(10 * 1024 + 17)
+    with storage.BlockBlobWriter(storage.get_blob_client(storage.OUTPUT_CONNECTION, container, "out.bin"), block_size=1024) as writer:
+        for offset in range(0, len(_data), 1000):
+            writer.write(_data[offset:offset + 1000])
+    assert storage.download_blob(container, "out.bin", connection=storage.OUTPUT_CONNECTION) == _data
+
+
+def test_block_writer_error_keeps_the_previous_blob(container):
+    storage.upload_blob(container, "out.bin", b"previous")
+    with pytest.raises(RuntimeError):
+        with storage.BlockBlobWriter(storage.get_blob_client(storage.OUTPUT_CONNECTION, container, "out.bin"), block_size=4) as writer:
+            writer.write(b"partial output")
+            raise RuntimeError("serialization failed")
+    assert storage.download_blob(container, "out.bin", connection=storage.OUTPUT_CONNECTION) == b"previous"
+
+
+def test_interleaved_writers_of_the_same_blob(container):
+    """The blocks staged by another writer of the same blob never end up in the committed blob."""
+    _first = storage.open_blob_writer(container, "out.bin")
+    _second = storage.open_blob_writer(container, "out.bin")
+    _first._block_size = _second._block_size = 4
+    _first.write(b"aaaaaaaa")
+    _second.write(b"bbbbbbbbbbbb")
+    _first.close()
+    _second.abort()
+    assert storage.download_blob(container, "out.bin", connection=storage.OUTPUT_CONNECTION) == b"aaaaaaaa"
+
+
+@pytest.mark.parametrize("size", [100, 4096, 10 * 1024 + 17])
+def test_ranged_download(container, size):
+    _data = os.urandom(size)
+    storage.upload_blob(container, "in.bin", _data, connection=storage.INPUT_CONNECTION)
+    assert storage.download_blob_ranged(container, "in.bin", chunk_size=1024, concurrency=3) == _data
+
+
+def test_ranged_download_of_a_version(container):
+    from azure.core.exceptions import ResourceModifiedError
+
+    storage.upload_blob(container, "in.bin", b"first version", connection=storage.INPUT_CONNECTION)
+    _etag = storage.get_blob_properties(container, "in.bin").etag
+    assert storage.download_blob_ranged(container, "in.bin", chunk_size=4, etag=_etag) == b"first version"
+    storage.upload_blob(container, "in.bin", b"second version", connection=storage.INPUT_CONNECTION)
+    with pytest.raises(ResourceModifiedError):
+        storage.download_blob_ranged(container, "in.bin", chunk_size=4, etag=_etag)
+
+
+def test_delta_state_is_only_saved_over_the_version_read(container):
+    from shared_code import delta
+
+    assert delta.load_state(container, "out.csv") == (None, None)
+    delta.save_state(container, "out.csv", {"rows": 1}, None)
+    with pytest.raises(delta.StateConflict):
+        delta.save_state(container, "out.csv", {"rows": 2}, None)
+
+    _state, _etag = delta.load_state(container, "out.csv")
+    assert _state == {"rows": 1}
+    delta.save_state(container, "out.csv", {"rows": 3}, _etag)
+    with pytest.raises(delta.StateConflict):
+        delta.save_state(container, "out.csv", {"rows": 4}, _etag)
+    assert delta.load_state(container, "out.csv")[0] == {"rows": 3}
+
+
+def test_deleting_a_blob(container):
+    storage.upload_blob(container, "out.bin", b"superseded")
+    storage.delete_blob(container, "out.bin")
+    assert storage.get_blob_size(container, "out.bin") is None
+    # a blob already gone is not an error
+    storage.delete_blob(container, "out.bin")
+
+
+class QueueOutput:
+    """Queue output binding of the function, sends to the queue of the emulator."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def set(self, value: str):
+        self._client.send_message(value.encode())
+
+
+def test_queued_conversions_and_poison_queue(container, monkeypatch):
+    from blueprints.queue_parse_to_csv import convert_message
+    from scripts.enqueue_conversions import _queue_client, blob_created_event
+    from tests.conftest import golden_bytes
+
+    monkeypatch.setenv("RESULT_CACHE", "false")
+    monkeypatch.setenv("INGESTION_OUTPUT_PATH", f"{container}/converted")
+    storage.upload_blob(container, "run_STOV_01.xlsx", golden_bytes("ff.xlsx"), connection=storage.INPUT_CONNECTION)
+    storage.upload_blob(container, "run_DIL_01.xlsx", b"not a workbook", connection=storage.INPUT_CONNECTION)
+    _queue = _queue_client(container)
+    _poison = _queue_client(f"{container}-poison")
+    try:
+        for input_file in ("run_STOV_01.xlsx", "run_DIL_01.xlsx"):
+            _queue.send_message(json.dumps(blob_created_event(container, input_file)).encode())
+
+        _results = []
+        for message in _queue.receive_messages(max_messages=2):
+            _results.append(convert_message(message.content.decode(), message.dequeue_count, QueueOutput(_poison)))
+            _queue.delete_message(message)
+        assert sorted(result["status_code"] for result in _results) == [200, 406]
+        assert storage.download_blob(
+            f"{container}/converted", "run_STOV_01.csv", connection=storage.OUTPUT_CONNECTION
+        ) == golden_bytes("ff.csv")
+
+        [_dead] = _poison.receive_messages(max_messages=2)
+        _dead = json.loads(_dead.content.decode())
+        assert json.loads(_dead["message"])["subject"].endswith("/blobs/run_DIL_01.xlsx")
+        assert (_dead["status_code"], _dead["error"]) == (406, "INPUT FILE CAN'T BE LOADED")
+    finally:
+        _queue.delete_queue()
+        _poison.delete_queue()
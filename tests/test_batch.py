@@ -0,0 +1,80 @@
+import json
+
+import azure.functions as func
+import pytest
+
+from blueprints import http_parse_to_csv_batch as batch
+from shared_code import http_conversion
+from tests.conftest import golden_bytes
+
+
+def _post(body) -> func.HttpResponse:
+    _body = body if isinstance(body, bytes) else json.dumps(body).encode()
+    return batch.http_parse_to_csv_batch(func.HttpRequest("POST", "/api/http-parse-to-csv-batch", body=_body))
+
+
+@pytest.mark.parametrize("body", [b"not json", [], [{"items": []}], "items", {}, {"items": []}, {"items": {}}])
+def test_invalid_body_is_rejected(body):
+    _response = _post(body)
+    assert _response.status_code == 400
+    assert "error" in json.loads(_response.get_body())
+
+
+@pytest.mark.parametrize("max_workers", ["4", "x", 0, -1, 2.5, True, [2]])
+def test_invalid_max_workers_is_rejected(max_workers):
+    _response = _post({"items": [{}], "max_workers": max_workers})
+    assert _response.status_code == 400
+    assert "max_workers" in json.loads(_response.get_body())["error"]
+
+
+def test_max_workers_is_capped():
+    assert batch.resolve_max_workers() == batch._max_workers
+    assert batch.resolve_max_workers(1) == 1
+    assert batch.resolve_max_workers(batch._max_workers + 10) == batch._max_workers
+
+
+GOLDEN_FILES = {"fb": "run_DIL_01.xlsx", "ff": "run_STOV_01.xlsx", "analytical": "run_Analytical_01.xlsx"}
+
+
+def test_items_are_converted(storage):
+    storage.patch(batch)
+    storage.patch(http_conversion)
+    for layout, input_file in GOLDEN_FILES.items():
+        storage.put("input", input_file, golden_bytes(f"{layout}.xlsx"))
+    _response = _post({
+        "items": [{"input_path": "input", "input_file": name, "output_path": "output"} for name in GOLDEN_FILES.values()]
+        + [{"input_path": "input", "input_file": "notes.xlsx", "output_path": "output"}, "not an item"],
+        "max_workers": 2
+    })
+    assert _response.status_code == 207
+    _result = json.loads(_response.get_body())
+    assert (_result["succeeded"], _result["failed"]) == (3, 2)
+    for layout, input_file in GOLDEN_FILES.items():
+        _item = next(item for item in _result["items"] if item["input_file"] == input_file)
+        assert (_item["status_code"], _item["layout"]) == (200, layout)
+        assert storage.get("output", input_file.replace(".xlsx", ".csv")) == golden_bytes(f"{layout}.csv")
+    assert [item["status_code"] for item in _result["items"][3:]] == [400, 400]
+
+
+def test_items_take_the_paths_of_the_single_route(storage, monkeypatch):
+    from shared_code import process_pool
+
+    storage.patch(batch)
+    storage.patch(http_conversion)
+    storage.put("input", "run_STOV_01.xlsx", golden_bytes("ff.xlsx"))
+    # a parse pool failure is answered by the same path as on the http-parse-to-csv route
+    monkeypatch.setattr(process_pool, "_workers", 1)
+    monkeypatch.setattr(process_pool, "convert", lambda *args: {"error": "read", "message": "bad workbook"})
+    _response = _post({"items": [{"input_path": "input", "input_file": "run_STOV_01.xlsx", "output_path": "output"}]})
+    [_item] = json.loads(_response.get_body())["items"]
+    assert (_item["status_code"], _item["error"]) == (406, "INPUT FILE CAN'T BE LOADED")
+    assert _item["output_file"] == "run_STOV_01.csv"
+
+    # a tall export is converted batch by batch, as on the single route
+    monkeypatch.setattr(process_pool, "_workers", 0)
+    monkeypatch.setenv("ANALYTICAL_CHUNK_ROWS", "7")
+    storage.put("input", "run_Analytical_01.xlsx", golden_bytes("analytical.xlsx"))
+    _response = _post({"items": [{"input_path": "input", "input_file": "run_Analytical_01.xlsx", "output_path": "output"}]})
+    [_item] = json.loads(_response.get_body())["items"]
+    assert (_item["status_code"], _item["parsed"]) == (200, "chunked") and "first_5_rows" not in _item
+    assert storage.get("output", "run_Analytical_01.csv") == golden_bytes("analytical.csv")
@@ -0,0 +1,17 @@
+import pytest
+
+from benchmarks.run import run_case
+from benchmarks.workbooks import ROWS, generate
+
+
+@pytest.mark.parametrize("layout", ["fb", "ff", "analytical"])
+def test_run_case(layout):
+    _result = run_case(generate(layout, 20, 10), layout, "openpyxl", "csv", repeat=2)
+    assert _result["output_shape"][0] > 0 and _result["output_bytes"] > 0
+    assert {"read_excel_s", "transform_s", "serialize_s", "total_s", "peak_rss_mb"} <= set(_result)
+
+
+@pytest.mark.parametrize("layout", sorted(ROWS))
+def test_generated_rows_are_reproducible(layout):
+    assert list(ROWS[layout](10, 5, seed=1)) == list(ROWS[layout](10, 5, seed=1))
+    assert list(ROWS[layout](10, 5, seed=1)) != list(ROWS[layout](10, 5, seed=2))
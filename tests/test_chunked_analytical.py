@@ -0,0 +1,120 @@
+import gzip
+import io
+import json
+
+import pytest
+from openpyxl import Workbook
+
+from benchmarks.workbooks import analytical_rows
+from shared_code import chunked_analytical, http_conversion
+from shared_code.excel_engines import ENGINES
+from shared_code.layouts import read_layout, transform_layout
+from shared_code.outputs import write_output
+from tests.conftest import OutputBinding, golden_bytes, http_request, input_stream
+from tests.make_golden import _with_edges
+
+
+def _workbook(rows) -> bytes:
+    _workbook = Workbook()
+    for row in rows:
+        _workbook.active.append(row)
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    return _buffer.getvalue()
+
+
+def _full_csv(blob_content: bytes, engine: str) -> bytes:
+    _buffer = io.BytesIO()
+    write_output(transform_layout(read_layout(blob_content, "analytical", engine), "analytical"), _buffer, "csv", "none")
+    return _buffer.getvalue()
+
+
+def _chunked_csv(blob_content: bytes, engine: str, chunk_rows: int, output_compression: str = None) -> bytes:
+    _plan = chunked_analytical.plan_chunks(blob_content, engine, chunk_rows)
+    assert _plan is not None
+    _buffer = io.BytesIO()
+    chunked_analytical.write_chunks(blob_content, _plan, _buffer, engine, chunk_rows, output_compression)
+    return _buffer.getvalue()
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+@pytest.mark.parametrize("chunk_rows", [1, 7, 1000])
+def test_golden_export_in_batches(golden, engine, chunk_rows):
+    assert _chunked_csv(golden("analytical.xlsx"), engine, chunk_rows) == golden("analytical.csv")
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_exports_match_the_full_conversion(seed):
+    _blob = _workbook(_with_edges(analytical_rows(30 + seed, 4 + seed % 3, seed=seed), 5, 1, seed=200 + seed))
+    _plan = chunked_analytical.plan_chunks(_blob, "openpyxl", 4)
+    if _plan is not None:
+        assert _chunked_csv(_blob, "openpyxl", 4) == _full_csv(_blob, "openpyxl")
+
+
+def test_compressed_csv_is_the_same(golden):
+    assert gzip.decompress(_chunked_csv(golden("analytical.xlsx"), "openpyxl", 7, "gzip")) == golden("analytical.csv")
+
+
+def test_exports_without_a_single_timestamp_column_are_converted_at_once():
+    assert chunked_analytical.plan_chunks(_workbook([["title"], [], [], [], ["a", "b"], [1, 2]]), "openpyxl", 10) is None
+
+
+@pytest.mark.parametrize("chunk_rows, expected", [(None, None), (0, None), (10, 10), ("10", 10)])
+def test_resolve_chunk_rows(chunk_rows, expected, monkeypatch):
+    monkeypatch.delenv("ANALYTICAL_CHUNK_ROWS", raising=False)
+    assert chunked_analytical.resolve_chunk_rows(chunk_rows) == expected
+
+
+@pytest.mark.parametrize("chunk_rows", [-1, "x", True])
+def test_invalid_chunk_rows_are_rejected(chunk_rows):
+    with pytest.raises(ValueError):
+        chunked_analytical.resolve_chunk_rows(chunk_rows)
+
+
+def _convert(storage, body: dict, blob_content: bytes):
+    storage.patch(http_conversion)
+    _outputblob = OutputBinding()
+    _response = http_conversion.convert_request(
+        http_request(body), input_stream(blob_content), _outputblob, layout="analytical",
+        function_name="http_parse_to_csv_analytical"
+    )
+    return _response, json.loads(_response.get_body()), _outputblob
+
+
+REQUEST = {
+    "input_path": "input", "input_file": "run_Analytical_01.xlsx", "output_path": "output",
+    "output_file": "run_Analytical_01.csv", "chunk_rows": 7
+}
+
+
+def test_chunked_output_is_staged_to_the_blob(storage, golden):
+    _response, _result, _outputblob = _convert(storage, REQUEST, golden("analytical.xlsx"))
+    assert (_response.status_code, _result["parsed"]) == (200, "chunked")
+    assert storage.get("output", "run_Analytical_01.csv") == golden("analytical.csv")
+    assert _outputblob.value is None
+
+
+@pytest.mark.parametrize("stage, error, status_code", [
+    ("read", "INPUT FILE CAN'T BE LOADED", 406), ("transform", "Error parsing the data frame", 500)
+])
+def test_chunked_errors_are_not_write_errors(storage, golden, monkeypatch, stage, error, status_code):
+    def fail(*args, **kwargs):
+        raise chunked_analytical.ChunkedConversionError(stage, ValueError("bad rows"))
+
+    monkeypatch.setattr(chunked_analytical, "write_chunks", fail)
+    _response, _result, _ = _convert(storage, REQUEST, golden("analytical.xlsx"))
+    assert (_response.status_code, _result["error"]) == (status_code, error)
+    assert ("output", "run_Analytical_01.csv") not in storage.blobs
+
+
+def test_unreadable_rows_raise_a_read_error(golden, monkeypatch):
+    _plan = chunked_analytical.plan_chunks(golden("analytical.xlsx"), "openpyxl", 7)
+
+    def rows(*args, **kwargs):
+        raise OSError("truncated workbook")
+        yield
+
+    monkeypatch.setattr(chunked_analytical, "_iter_batches", rows)
+    with pytest.raises(chunked_analytical.ChunkedConversionError) as error:
+        chunked_analytical.write_chunks(golden("analytical.xlsx"), _plan, io.BytesIO(), "openpyxl", 7)
+    assert error.value.stage == "read"
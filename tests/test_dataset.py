@@ -0,0 +1,173 @@
+import datetime
+import io
+import json
+import threading
+
+import azure.functions as func
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from benchmarks.workbooks import generate
+from blueprints import http_parse_to_dataset as route
+from shared_code import dataset
+from tests.conftest import golden_bytes
+
+INGESTED_AT = datetime.datetime(2024, 5, 2, 10, 15, tzinfo=datetime.timezone.utc)
+PARTITION = "unit_of_operation=STOV/date=2024-05-02"
+
+
+def _post(body) -> tuple:
+    _body = body if isinstance(body, bytes) else json.dumps(body).encode()
+    _response = route.http_parse_to_dataset(func.HttpRequest("POST", "/api/http-parse-to-dataset", body=_body))
+    return _response.status_code, json.loads(_response.get_body())
+
+
+def _part_files(storage) -> dict:
+    return {
+        f"{path}/{file}": pq.ParquetFile(io.BytesIO(data)) for (path, file), data in storage.blobs.items()
+        if file.endswith(".parquet")
+    }
+
+
+@pytest.fixture
+def dataset_storage(storage):
+    for module in (route, dataset):
+        storage.patch(module)
+    return storage
+
+
+@pytest.mark.parametrize("body", [
+    b"not json", b"[1, 2]", {}, {"layout": "xx", "input_path": "input", "output_path": "dataset"},
+    {"layout": "ff", "input_path": "input", "output_path": "dataset", "max_workers": "2"},
+    {"layout": "ff", "input_path": "input", "output_path": "dataset", "max_workers": 0},
+    {"layout": "ff", "input_path": "input", "output_path": "dataset", "input_files": []},
+])
+def test_invalid_requests_are_rejected(body):
+    _status, _result = _post(body)
+    assert (_status, _result["status_code"]) == (400, 400) and "error" in _result
+
+
+def test_workbooks_are_consolidated(dataset_storage):
+    dataset_storage.put("input", "run_STOV_01.xlsx", golden_bytes("ff.xlsx"))
+    dataset_storage.put("input", "run_STOV_02.xlsx", generate("ff", 30, 8, seed=1))
+    dataset_storage.put("input", "run_VIA_01.xlsx", generate("ff", 20, 8, seed=2))
+    dataset_storage.put("input", "run_DIL_01.xlsx", golden_bytes("fb.xlsx"))
+    _body = {"layout": "ff", "input_path": "input", "output_path": "dataset", "partition_date": "ingested"}
+
+    _status, _result = _post(_body)
+    assert (_status, _result["succeeded"], _result["failed"]) == (200, 3, 0)
+    _parts = _part_files(dataset_storage)
+    # one part file per partition, with the columns of all its workbooks
+    assert sorted(path.split("/")[1] for path in _parts) == ["unit_of_operation=STOV", "unit_of_operation=VIA"]
+    _stov = next(part for path, part in _parts.items() if "STOV" in path)
+    assert {"parameter 18", "parameter 7"} <= set(_stov.schema_arrow.names)
+    assert sum(part.metadata.num_rows for part in _parts.values()) == _result["rows"] == 57 + 30 + 20
+    for item in _result["items"]:
+        assert item["output_file"].endswith(".parquet") and item["message"] == "SUCCESS"
+    assert len([file for path, file in dataset_storage.blobs if path == "dataset/_sources"]) == 3
+
+    # the same workbooks are skipped by the next request
+    _status, _result = _post(_body)
+    assert (_status, _result["skipped"], _result["partitions"]) == (200, 3, [])
+
+
+def test_schema_is_fixed_by_the_layout(dataset_storage):
+    dataset_storage.put("input", "run_Analytical_01.xlsx", golden_bytes("analytical.xlsx"))
+    dataset_storage.put("input", "run_Analytical_02.xlsx", generate("analytical", 40, 6, seed=3))
+    _status, _result = _post({"layout": "analytical", "input_path": "input", "output_path": "dataset"})
+    assert _status == 200
+    _schemas = [part.schema_arrow for part in _part_files(dataset_storage).values()]
+    for schema in _schemas:
+        assert schema.field("index").type == pa.int64()
+        assert schema.field("Spalte_Compiling_Timestamp").type == pa.timestamp("us")
+        assert schema.field("_source_modified").type == pa.timestamp("us", tz="UTC")
+        assert schema.field("_source_file").type == pa.string()
+        # the other columns are text, whatever the values of the workbook
+        assert all(field.type == pa.string() for field in schema if not field.name.startswith("_")
+                   and field.name not in ("index", "Spalte_Compiling_Timestamp"))
+
+
+def _table(rows: int, columns: list, source: str) -> tuple:
+    _df = pd.DataFrame({column: [f"{column}{row}" for row in range(rows)] for column in columns})
+    _lineage = dataset.lineage_of("input", source, source, INGESTED_AT, INGESTED_AT)
+    return dataset.with_lineage(_df, _lineage), _lineage
+
+
+def test_partition_writer_buffers_one_row_group(storage):
+    storage.patch(dataset)
+    _writer = dataset.PartitionWriter("dataset", PARTITION, "ff", INGESTED_AT, row_group_rows=25)
+    _names = set()
+    for number in range(6):
+        _names.add(_writer.append(*_table(10, ["a", "b"], f"source{number}")))
+        # the rows are written as row groups while the workbooks are appended
+        assert _writer._part["buffered"] < 25
+    # a workbook missing a column goes to the same part file, a new column starts a new one
+    _names.add(_writer.append(*_table(10, ["a"], "source6")))
+    _names.add(_writer.append(*_table(10, ["a", "c"], "source7")))
+    _parts = _writer.close()
+
+    assert len(_names) == 2 and [part["rows"] for part in _parts] == [70, 10]
+    _file = pq.ParquetFile(io.BytesIO(storage.get(f"dataset/{PARTITION}", _parts[0]["output_file"])))
+    assert [_file.metadata.row_group(group).num_rows for group in range(_file.num_row_groups)] == [25, 25, 20]
+    assert _file.read().column("b").null_count == 10
+
+
+def test_appends_do_not_wait_for_the_uploads(storage, monkeypatch):
+    storage.patch(dataset)
+    _uploading = threading.Event()
+    _release = threading.Event()
+
+    def writer(path, file, **kwargs):
+        _writer = storage.writer(path, file)
+        _write = _writer.write
+
+        def write(data):
+            # the first row group is uploaded until the test releases it
+            _uploading.set()
+            assert _release.wait(10)
+            return _write(data)
+
+        _writer.write = write
+        return _writer
+
+    monkeypatch.setattr(dataset, "open_blob_writer", writer)
+    _writer = dataset.PartitionWriter("dataset", PARTITION, "ff", INGESTED_AT, row_group_rows=10)
+    _writer.append(*_table(10, ["a"], "source0"))
+    assert _uploading.wait(10)
+    # the other workbooks of the partition are buffered while the first row group is uploaded
+    for number in range(1, 4):
+        _writer.append(*_table(5, ["a"], f"source{number}"))
+    assert _writer._part["buffered"] == 5
+    _release.set()
+    [_part] = _writer.close()
+    assert (_part["status_code"], _part["rows"], _part["sources"]) == (200, 25, 4)
+
+
+def test_part_file_gets_the_columns_of_its_workbooks(storage):
+    storage.patch(dataset)
+    _writer = dataset.PartitionWriter("dataset", PARTITION, "ff", INGESTED_AT)
+    _names = {_writer.append(*_table(10, ["a"], "source0")), _writer.append(*_table(5, ["b", "a"], "source1"))}
+    [_part] = _writer.close()
+    assert len(_names) == 1 and _part["rows"] == 15
+    _read = pq.read_table(io.BytesIO(storage.get(f"dataset/{PARTITION}", _part["output_file"])))
+    assert _read.column_names == ["index", "a", "b"] + dataset.LINEAGE_COLUMNS
+    assert (_read.column("a").null_count, _read.column("b").null_count) == (0, 10)
+
+
+def test_failed_part_file_fails_its_workbooks(dataset_storage, monkeypatch):
+    class FailingWriter(io.BytesIO):
+        def write(self, data):
+            raise OSError("storage unavailable")
+
+        def abort(self):
+            self.close()
+
+    monkeypatch.setattr(dataset, "open_blob_writer", lambda *args, **kwargs: FailingWriter())
+    dataset_storage.put("input", "run_STOV_01.xlsx", golden_bytes("ff.xlsx"))
+    _status, _result = _post({"layout": "ff", "input_path": "input", "output_path": "dataset"})
+    assert (_status, _result["failed"]) == (207, 1)
+    _error = "Failed to write to output blob: storage unavailable"
+    assert _result["items"][0]["error"] == _result["partitions"][0]["error"] == _error
+    assert not [file for path, file in dataset_storage.blobs if path == "dataset/_sources"]
@@ -0,0 +1,111 @@
+"""
+Golden-file tests of the excel engines: every engine gives the CSV of the baseline conversion
+(pd.read_excel with openpyxl, then the transformations of the layout), byte for byte.
+"""
+
+import datetime
+import io
+import os
+import random
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from shared_code import excel_engines
+from shared_code.excel_engines import ENGINES, ERROR_CODES, NA_STRINGS, iter_sheet_values, resolve_engine
+from shared_code.layouts import read_layout, transform_layout
+from shared_code.outputs import write_output
+from shared_code.workbook_reader import read_sheet
+from tests.conftest import ROOT
+from tests.make_golden import EDGE_READ, EDGE_VALUES
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+@pytest.mark.parametrize("layout", ["fb", "ff", "analytical"])
+def test_layout_csv_matches_golden(golden, layout, engine):
+    _df = transform_layout(read_layout(golden(f"{layout}.xlsx"), layout, engine), layout)
+    _buffer = io.BytesIO()
+    write_output(_df, _buffer, "csv", "none")
+    assert _buffer.getvalue() == golden(f"{layout}.csv")
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_edge_cells_match_golden(golden, engine):
+    _df = read_sheet(golden("edge_cells.xlsx"), engine=engine, **EDGE_READ)
+    assert _df.to_csv(header=False).encode() == golden("edge_cells.csv")
+
+
+def _random_workbook(seed: int) -> bytes:
+    _rng = random.Random(seed)
+    _workbook = Workbook(write_only=seed % 2 == 0)
+    _sheet = _workbook.create_sheet("Data") if seed % 2 == 0 else _workbook.active
+    for _ in range(_rng.randint(1, 10)):
+        _sheet.append([_rng.choice(EDGE_VALUES + [None, None]) for _ in range(_rng.randint(0, 7))])
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    return _buffer.getvalue()
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_random_sheets_match_read_excel(engine):
+    for seed in range(150):
+        _blob = _random_workbook(seed)
+        for header, skip_rows, skip_cols in [(0, 2, 1), (None, 1, 0)]:
+            _expected = pd.read_excel(io.BytesIO(_blob), engine="openpyxl", header=header)
+            _expected = _expected.iloc[skip_rows:, skip_cols:].to_csv(header=False)
+            _df = read_sheet(_blob, header=header, skip_rows=skip_rows, skip_cols=skip_cols, engine=engine)
+            assert _df.to_csv(header=False) == _expected, f"seed {seed}"
+
+
+def test_pandas_is_in_the_pinned_range():
+    # read_sheet parses the rows with the TextParser of pd.read_excel, which is not a public pandas API:
+    # the tests above only vouch for the pandas versions allowed by requirements.txt
+    from packaging.requirements import Requirement
+
+    with open(os.path.join(ROOT, "requirements.txt")) as requirements:
+        _pandas = next(Requirement(line.strip()) for line in requirements if line.startswith("pandas"))
+    assert _pandas.specifier and _pandas.specifier.contains(pd.__version__)
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_engines_keep_whitespace_and_error_cells(engine):
+    _workbook = Workbook()
+    _workbook.active.append([" ", "\t", " a ", "#N/A", None, 1, datetime.datetime(2024, 1, 2)])
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    assert list(iter_sheet_values(_buffer.getvalue(), engine))[0][:7] == (
+        " ", "\t", " a ", "#N/A", None, 1, datetime.datetime(2024, 1, 2)
+    )
+
+
+def test_calamine_reads_plain_workbooks_itself(golden, monkeypatch):
+    # the sheetxml fallback is only used for the workbooks calamine can not read exactly
+    monkeypatch.setattr(excel_engines, "iter_sheetxml_rows", None)
+    _workbook = Workbook()
+    _workbook.active.append(["a", " b", 1, 2.5])
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    assert list(iter_sheet_values(_buffer.getvalue(), "calamine")) == [("a", " b", 1.0, 2.5)]
+
+
+def test_missing_strings_are_those_of_pandas():
+    _csv = "value\n" + "\n".join(f'"{value}"' for value in sorted(NA_STRINGS - {""}))
+    assert pd.read_csv(io.StringIO(_csv))["value"].isna().all()
+    assert not pd.read_csv(io.StringIO('value\n"NAN"\n" NA"'))["value"].isna().any()
+
+
+def test_error_codes_are_those_of_openpyxl():
+    from openpyxl.cell.cell import ERROR_CODES as OPENPYXL_ERROR_CODES
+
+    assert ERROR_CODES == set(OPENPYXL_ERROR_CODES)
+
+
+def test_resolve_engine(monkeypatch):
+    monkeypatch.delenv("EXCEL_ENGINE", raising=False)
+    assert resolve_engine() == "openpyxl"
+    monkeypatch.setenv("EXCEL_ENGINE", "calamine")
+    assert resolve_engine() == "calamine"
+    assert resolve_engine("sheetxml") == "sheetxml"
+    with pytest.raises(ValueError):
+        resolve_engine("xlrd")
@@ -0,0 +1,89 @@
+import gzip
+import json
+import io
+
+import pandas as pd
+import pytest
+
+from shared_code import delta, fanout, result_cache
+from shared_code.layouts import read_layout, transform_layout
+from tests.conftest import golden_bytes
+
+OUTPUTS = [
+    {"output_file": "table.csv"},
+    {"output_file": "table.csv.gz", "output_compression": "gzip"},
+    {"output_file": "table.parquet", "output_format": "parquet"},
+    {"output_file": "sample.csv", "head": 5},
+]
+
+
+@pytest.mark.parametrize("outputs", [
+    None, [], {}, [{}], [{"output_file": "a.csv", "head": 0}], [{"output_file": "a.csv", "head": True}],
+    [{"output_file": "a.csv"}, {"output_file": "a.csv"}], [{"output_file": "a.csv", "output_format": "xlsx"}],
+    [{"output_file": "a.csv", "incremental": True, "head": 2}], [{"output_file": f"{i}.csv"} for i in range(17)],
+])
+def test_invalid_outputs_are_rejected(outputs):
+    with pytest.raises(ValueError):
+        fanout.resolve_outputs(outputs, "output")
+
+
+def test_outputs_default_to_the_request_path():
+    _outputs = fanout.resolve_outputs([{"output_file": "a.csv"}, {"output_file": "a.csv", "output_path": "other"}], "output")
+    assert [output["output_path"] for output in _outputs] == ["output", "other"]
+
+
+def test_every_output_is_written_once(storage, monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE", "true")
+    storage.patch(fanout)
+    storage.patch(result_cache)
+    _df = transform_layout(read_layout(golden_bytes("ff.xlsx"), "ff", "openpyxl"), "ff")
+    _hash = "hash"
+
+    _pending, _cached = fanout.lookup_outputs(fanout.resolve_outputs(OUTPUTS, "output"), _hash, "ff")
+    assert (len(_pending), _cached) == (4, [])
+    _results = fanout.write_outputs(_df, _pending, "input", "table.xlsx", "ff")
+    assert [result["status_code"] for result in _results] == [200] * 4
+
+    assert storage.get("output", "table.csv") == golden_bytes("ff.csv")
+    assert gzip.decompress(storage.get("output", "table.csv.gz")) == golden_bytes("ff.csv")
+    assert pd.read_parquet(io.BytesIO(storage.get("output", "table.parquet"))).shape == _df.shape
+    assert storage.get("output", "sample.csv").count(b"\n") == 6
+
+    # a second request only writes the outputs that changed
+    _pending, _cached = fanout.lookup_outputs(
+        fanout.resolve_outputs(OUTPUTS + [{"output_file": "sample.csv.gz", "output_compression": "gzip"}], "output"),
+        _hash, "ff"
+    )
+    assert [output["output_file"] for output in _pending] == ["sample.csv.gz"]
+    assert len(_cached) == 4
+
+
+def test_incremental_output_is_written_again_after_a_concurrent_conversion(storage, monkeypatch):
+    for module in (fanout, delta):
+        storage.patch(module)
+    _df = transform_layout(read_layout(golden_bytes("ff.xlsx"), "ff", "openpyxl"), "ff")
+    _pending, _ = fanout.lookup_outputs(
+        fanout.resolve_outputs([{"output_file": "table.csv", "incremental": True}], "output"), None, "ff"
+    )
+    _compute_delta = delta.compute_delta
+    _states = []
+
+    def compute_delta(_df, key_column, layout, state):
+        # another conversion of the output, of the first 20 experiments, saves its delta between the load
+        # and the save of this one
+        _states.append(state)
+        if len(_states) == 1:
+            fanout.write_outputs(_df.head(20), _pending, "input", "other.xlsx", "ff", key_column=key_column)
+        return _compute_delta(_df, key_column, layout, state)
+
+    monkeypatch.setattr(delta, "compute_delta", compute_delta)
+    [_result] = fanout.write_outputs(_df, _pending, "input", "table.xlsx", "ff", key_column="Experiment ID")
+    assert _result["status_code"] == 200 and len(_states) == 3
+    assert (_result["delta"]["inserted"], _result["delta"]["updated"], _result["delta"]["deleted"]) == (37, 0, 0)
+
+    # both deltas are kept, each in its own blob under the output
+    _names = storage.names("output/table.csv")
+    assert len(_names) == 2 and _result["delta_file"] == f"table.csv/{_names[1]}"
+    _keys = [set(pd.read_csv(io.BytesIO(storage.get("output/table.csv", name)))["Experiment ID"]) for name in _names]
+    assert (len(_keys[0]), len(_keys[1])) == (20, 37) and len(_keys[0] | _keys[1]) == len(_df)
+    assert ("output", "table.csv") not in storage.blobs
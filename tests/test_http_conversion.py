@@ -0,0 +1,208 @@
+import gzip
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from shared_code import delta, fanout, http_conversion, layout_detection, process_pool, result_cache
+from shared_code.layouts import read_layout, transform_layout
+from shared_code.outputs import write_output
+from tests.conftest import OutputBinding, golden_bytes, http_request, input_stream
+
+FILES = {"fb": "run_DIL_01.xlsx", "ff": "run_STOV_01.xlsx", "analytical": "run_Analytical_01.xlsx"}
+
+
+@pytest.fixture
+def convert(storage):
+    """Convert a golden workbook with the body, return (status code, result, output binding)."""
+    for module in (http_conversion, fanout, result_cache, delta):
+        storage.patch(module)
+
+    def convert(body, layout: str = None, blob_content: bytes = None, route_layout: str = None):
+        _layout = layout or "fb"
+        _body = body if not isinstance(body, dict) else {
+            "input_path": "input", "input_file": FILES[_layout], "output_path": "output",
+            "output_file": FILES[_layout].replace(".xlsx", ".csv"), **body
+        }
+        _content = golden_bytes(f"{_layout}.xlsx") if blob_content is None else blob_content
+        _outputblob = OutputBinding()
+        _response = http_conversion.convert_request(
+            http_request(_body), input_stream(_content), _outputblob, layout=route_layout
+        )
+        return _response.status_code, json.loads(_response.get_body()), _outputblob
+    return convert
+
+
+@pytest.mark.parametrize("layout", sorted(FILES))
+def test_output_binding_gets_the_golden_csv(convert, layout):
+    _status, _result, _outputblob = convert({}, layout)
+    assert (_status, _result["layout"], _result["message"]) == (200, layout, "SUCCESS")
+    assert _outputblob.value == golden_bytes(f"{layout}.csv")
+    assert len(json.loads(_result["first_5_rows"])) == 5
+
+
+def test_streamed_output(convert, storage):
+    _status, _result, _outputblob = convert({"stream_output": True}, "ff")
+    assert _status == 200 and _outputblob.value is None
+    assert storage.get("output", "run_STOV_01.csv") == golden_bytes("ff.csv")
+
+
+def test_compressed_output_is_streamed(convert, storage):
+    _status, _, _outputblob = convert({"output_compression": "gzip", "output_file": "run_STOV_01.csv.gz"}, "ff")
+    assert _status == 200 and _outputblob.value is None
+    assert gzip.decompress(storage.get("output", "run_STOV_01.csv.gz")) == golden_bytes("ff.csv")
+
+
+def test_parquet_output(convert):
+    _status, _, _outputblob = convert({"output_format": "parquet", "output_file": "run_DIL_01.parquet"})
+    assert _status == 200
+    _expected = transform_layout(read_layout(golden_bytes("fb.xlsx"), "fb", "openpyxl"), "fb")
+    assert pd.read_parquet(io.BytesIO(_outputblob.value)).shape == _expected.shape
+
+
+def test_second_conversion_is_a_cache_hit(convert, monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE", "true")
+    _status, _result, _ = convert({"stream_output": True})
+    assert (_status, _result["cache"]) == (200, "miss")
+    _status, _result, _outputblob = convert({"stream_output": True})
+    assert (_status, _result["cache"], _outputblob.value) == (200, "hit", None)
+
+
+def test_several_outputs(convert, storage, monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE", "true")
+    _outputs = [{"output_file": "table.csv"}, {"output_file": "table.parquet", "output_format": "parquet"}]
+    _status, _result, _ = convert({"outputs": _outputs}, "ff")
+    assert _status == 200
+    assert [output["status_code"] for output in _result["outputs"]] == [200, 200]
+    assert storage.get("output", "table.csv") == golden_bytes("ff.csv")
+    _status, _result, _ = convert({"outputs": _outputs}, "ff")
+    assert (_status, _result["cache"]) == (200, "hit")
+
+
+def _deltas(storage, output_file: str) -> list:
+    """The delta blobs of the output, in the order downstream applies them."""
+    return [
+        pd.read_csv(io.BytesIO(storage.get(f"output/{output_file}", name)))
+        for name in storage.names(f"output/{output_file}")
+    ]
+
+
+def test_incremental_output(convert, storage):
+    _status, _result, _outputblob = convert({"incremental": True}, "ff")
+    assert _status == 200 and _outputblob.value is None
+    assert _result["delta"]["inserted"] > 0 and _result["delta"]["updated"] == 0
+    assert _result["delta_file"].startswith("run_STOV_01.csv/00000001-")
+    _status, _result, _outputblob = convert({"incremental": True}, "ff")
+    assert (_result["delta"]["inserted"], _result["delta"]["updated"], _result["delta"]["deleted"]) == (0, 0, 0)
+    assert _result["delta_file"].startswith("run_STOV_01.csv/00000002-")
+
+    # the first delta is not overwritten by the second one
+    _first, _second = _deltas(storage, "run_STOV_01.csv")
+    assert (_first["_change"] == "insert").all() and len(_first) == 57 and _second.empty
+
+
+def test_incremental_output_is_computed_again_after_a_concurrent_conversion(convert, storage, monkeypatch):
+    _compute_delta = delta.compute_delta
+    _calls = []
+
+    def compute_delta(_df, key_column, layout, state):
+        # another conversion of the output, of the first 20 experiments, saves its delta between the load
+        # and the save of this one
+        _calls.append(state)
+        if len(_calls) == 1:
+            delta.write_delta(
+                _df.head(20), "output", "run_STOV_01.csv", key_column, layout,
+                lambda _table, path, file: storage.upload(path, file, _table.to_csv(index=False).encode()), ".csv"
+            )
+        return _compute_delta(_df, key_column, layout, state)
+
+    monkeypatch.setattr(delta, "compute_delta", compute_delta)
+    _status, _result, _outputblob = convert({"incremental": True}, "ff")
+    assert _status == 200 and _calls[0] is None and _calls[2] is not None
+    assert (_result["delta"]["inserted"], _result["delta"]["updated"], _result["delta"]["deleted"]) == (37, 0, 0)
+
+    # the rows of both conversions are still there, the delta computed from the first state is gone
+    _other, _this = _deltas(storage, "run_STOV_01.csv")
+    assert len(_other) == 20 and len(_this) == 37
+    assert len(set(_other["Experiment ID"]) | set(_this["Experiment ID"])) == 57
+    assert delta.load_state("output", "run_STOV_01.csv")[0]["sequence"] == 2
+
+
+def test_incremental_output_fails_when_the_state_keeps_changing(convert, storage, monkeypatch):
+    _compute_delta = delta.compute_delta
+
+    def compute_delta(_df, key_column, layout, state):
+        _table, _state, _counts = _compute_delta(_df, key_column, layout, state)
+        storage.upload(*delta._state_location("output", "run_STOV_01.csv"), json.dumps(_state).encode())
+        return _table, _state, _counts
+
+    monkeypatch.setattr(delta, "compute_delta", compute_delta)
+    _status, _result, _ = convert({"incremental": True}, "ff")
+    assert (_status, _result["error"]) == (409, "The delta state was written by concurrent conversions of the output")
+    assert _deltas(storage, "run_STOV_01.csv") == []
+
+
+def test_pool_conversion(convert, monkeypatch):
+    def pool_convert(blob_content, layout, engine, output_format, output_compression, output_compression_level=None):
+        _df = transform_layout(read_layout(bytes(blob_content), layout, engine), layout)
+        _buffer = io.BytesIO()
+        write_output(_df, _buffer, output_format, output_compression, output_compression_level)
+        return {"output": _buffer.getvalue(), "head": _df.head().to_json(orient="records"), "rows": len(_df)}
+
+    monkeypatch.setattr(process_pool, "_workers", 1)
+    monkeypatch.setattr(process_pool, "convert", pool_convert)
+    _status, _result, _outputblob = convert({}, "analytical")
+    assert (_status, _result["parsed"]) == (200, "pool")
+    assert _outputblob.value == golden_bytes("analytical.csv")
+
+    monkeypatch.setattr(process_pool, "convert", lambda *args: {"error": "read", "message": "bad workbook"})
+    _status, _result, _ = convert({}, "analytical")
+    assert (_status, _result["error"]) == (406, "INPUT FILE CAN'T BE LOADED")
+
+
+def test_validate_mode(convert):
+    _status, _result, _outputblob = convert({"mode": "validate"}, "ff")
+    assert (_status, _result["mode"], _result["valid"], _outputblob.value) == (200, "validate", True, None)
+
+
+@pytest.mark.parametrize("body, layout", [
+    (b"not json", "fb"), (b"[1, 2]", "fb"), (b'"text"', "fb"), ({"output_path": None}, "fb"),
+    ({"mode": "transpose"}, "fb"), ({"engine": "xlrd"}, "fb"), ({"output_format": "xlsx"}, "fb"),
+    ({"chunk_rows": -1}, "analytical"), ({"outputs": []}, "fb"), ({"incremental": True}, "analytical"),
+])
+def test_invalid_requests_are_rejected(convert, body, layout):
+    _status, _result, _outputblob = convert(body, layout)
+    assert (_status, _result["status_code"]) == (400, 400)
+    assert "error" in _result and _outputblob.value is None
+
+
+def test_file_of_another_layout_is_rejected(convert):
+    _status, _result, _ = convert({"input_file": "run_STOV_01.xlsx"}, route_layout="fb")
+    assert (_status, _result["error"]) == (400, "The input file is not a valid file for this function")
+
+
+@pytest.mark.parametrize("detection", [False, True])
+def test_empty_and_broken_workbooks(convert, monkeypatch, detection):
+    monkeypatch.setattr(layout_detection, "_enabled", detection)
+    _status, _result, _ = convert({}, blob_content=b"")
+    assert (_status, _result["error"]) == (406, "Failed to read blob: Blob content is empty")
+    _status, _result, _ = convert({}, "ff", blob_content=b"not a workbook")
+    assert (_status, _result["error"], _result["input_file"]) == (406, "INPUT FILE CAN'T BE LOADED", "run_STOV_01.xlsx")
+
+
+def test_load_table_maps_the_errors_of_every_route(monkeypatch):
+    from shared_code.instrumentation import StageTimer
+
+    _conversion = {"input_file": "run_STOV_01.xlsx", "layout": "ff", "engine": "openpyxl", "blob_hash": "load-table"}
+    with pytest.raises(http_conversion.LoadError) as error:
+        http_conversion.load_table(dict(_conversion, blob_hash="unreadable"), lambda: b"not a workbook", StageTimer())
+    assert (error.value.error, error.value.status_code) == ("INPUT FILE CAN'T BE LOADED", 406)
+
+    def transform_layout(_df, layout):
+        raise KeyError("Experiment ID")
+
+    monkeypatch.setattr(http_conversion, "transform_layout", transform_layout)
+    with pytest.raises(http_conversion.LoadError) as error:
+        http_conversion.load_table(_conversion, lambda: golden_bytes("ff.xlsx"), StageTimer())
+    assert (error.value.error, error.value.status_code) == ("Error parsing the data frame", 500)
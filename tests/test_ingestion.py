@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from blueprints import http_parse_to_csv_batch as batch
+from blueprints.queue_parse_to_csv import convert_message
+from scripts.enqueue_conversions import blob_created_event
+from shared_code import http_conversion, ingestion
+from tests.conftest import OutputBinding, golden_bytes
+
+
+@pytest.fixture
+def output_path(monkeypatch):
+    monkeypatch.setenv("INGESTION_OUTPUT_PATH", "output/converted")
+    return "output/converted"
+
+
+def test_blob_created_event(output_path):
+    _event = blob_created_event("input/experiments/2024", "run_STOV_01.xlsx")
+    _expected = {"input_path": "input/experiments/2024", "input_file": "run_STOV_01.xlsx", "output_path": output_path}
+    assert ingestion.parse_message(json.dumps(_event)) == (_expected, {})
+    # CloudEvents schema, and a single event wrapped in a list
+    _cloud_event = {"type": _event["eventType"], "subject": _event["subject"]}
+    assert ingestion.parse_message(json.dumps([_cloud_event])) == (_expected, {})
+
+
+def test_conversion_request():
+    _message = {"input_path": "input", "input_file": "run_DIL_01.xlsx", "output_format": "parquet", "force": True}
+    _item, _options = ingestion.parse_message(json.dumps(_message))
+    assert _item == {"input_path": "input", "input_file": "run_DIL_01.xlsx", "output_path": None, "output_file": None}
+    assert _options == {"output_format": "parquet", "force": True}
+
+
+@pytest.mark.parametrize("body", [
+    "not json", "[1, 2]", '"text"', json.dumps({"eventType": "Microsoft.Storage.BlobDeleted", "subject": "x"}),
+    json.dumps({"eventType": "Microsoft.Storage.BlobCreated", "subject": "/blobServices/default/containers/input"}),
+])
+def test_invalid_messages_are_rejected(output_path, body):
+    with pytest.raises(ValueError):
+        ingestion.parse_message(body)
+
+
+def test_events_need_an_output_path(monkeypatch):
+    monkeypatch.delenv("INGESTION_OUTPUT_PATH", raising=False)
+    with pytest.raises(ValueError, match="INGESTION_OUTPUT_PATH"):
+        ingestion.parse_message(json.dumps(blob_created_event("input", "run_STOV_01.xlsx")))
+
+
+@pytest.mark.parametrize("result, permanent", [
+    ({"status_code": 400, "error": "MANDATORY PARAMETERS ARE MISSING"}, True),
+    ({"status_code": 406, "error": "INPUT FILE CAN'T BE LOADED"}, True),
+    ({"status_code": 406, "error": "EMPTY DATAFRAME"}, True),
+    ({"status_code": 406, "error": "Failed to read blob: timeout"}, False),
+    ({"status_code": 429, "error": "TOO MANY CONVERSIONS"}, False),
+    ({"status_code": 500, "error": "Failed to write to output blob"}, False),
+])
+def test_permanent_failures(result, permanent):
+    assert ingestion.is_permanent(result) is permanent
+
+
+def test_queued_conversions(storage, output_path):
+    storage.patch(batch)
+    storage.patch(http_conversion)
+    storage.put("input", "run_STOV_01.xlsx", golden_bytes("ff.xlsx"))
+    storage.put("input", "run_DIL_01.xlsx", b"not a workbook")
+    _deadletter = OutputBinding()
+
+    _result = convert_message(json.dumps(blob_created_event("input", "run_STOV_01.xlsx")), 1, _deadletter)
+    assert _result["status_code"] == 200 and _deadletter.value is None
+    assert storage.get(output_path, "run_STOV_01.csv") == golden_bytes("ff.csv")
+
+    # a workbook that can't be loaded goes to the dead-letter queue at once
+    _body = json.dumps(blob_created_event("input", "run_DIL_01.xlsx"))
+    _result = convert_message(_body, 1, _deadletter)
+    _dead = json.loads(_deadletter.value)
+    assert (_result["status_code"], _dead["message"], _dead["error"]) == (406, _body, "INPUT FILE CAN'T BE LOADED")
+
+    # a blob that can't be downloaded is retried by the host
+    _deadletter = OutputBinding()
+    with pytest.raises(RuntimeError, match="attempt 2"):
+        convert_message(json.dumps(blob_created_event("input", "run_STOV_02.xlsx")), 2, _deadletter)
+    assert _deadletter.value is None
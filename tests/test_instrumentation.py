@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from shared_code import instrumentation
+from shared_code.instrumentation import StageTimer, rss_mb
+
+pytestmark = pytest.mark.skipif(rss_mb() is None, reason="/proc/self/statm is not available")
+
+
+def test_peak_is_the_peak_of_the_stage(monkeypatch):
+    monkeypatch.setattr(instrumentation, "_sample_interval", 0.001)
+    _timer = StageTimer()
+    with _timer.stage("allocate"):
+        _block = bytearray(200 * 2**20)
+        _block[::4096] = b"x" * len(_block[::4096])
+        time.sleep(0.05)
+        del _block
+        time.sleep(0.05)
+    with _timer.stage("idle"):
+        time.sleep(0.05)
+    _stages = _timer.as_dict()
+    assert _stages["allocate"]["peak_rss_mb"] >= _stages["allocate"]["rss_mb"] + 150
+    # the peak of a later stage does not carry the peak of the earlier ones
+    assert _stages["idle"]["peak_rss_mb"] < _stages["allocate"]["peak_rss_mb"] - 150
+
+
+def test_timings_of_every_stage():
+    _timer = StageTimer()
+    with _timer.stage("first"):
+        pass
+    with pytest.raises(ValueError):
+        with _timer.stage("failed"):
+            raise ValueError()
+    _timings = _timer.as_dict()
+    assert set(_timings) == {"first", "failed", "total_s"}
+    assert set(_timings["first"]) >= {"wall_s", "cpu_s", "rss_mb", "peak_rss_mb"}
+    assert not instrumentation._sampler._peaks
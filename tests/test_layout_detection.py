@@ -0,0 +1,100 @@
+import io
+import json
+import logging
+
+import pytest
+from openpyxl import Workbook
+
+from benchmarks.workbooks import ROWS
+from shared_code import layout_detection
+from shared_code.layouts import read_layout, transform_layout
+
+
+def _workbook(rows) -> bytes:
+    _workbook = Workbook(write_only=True)
+    _sheet = _workbook.create_sheet("Data")
+    for row in rows:
+        _sheet.append(row)
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    return _buffer.getvalue()
+
+
+def _moved(rows, inserted_rows: int, inserted_cols: int) -> list:
+    """The rows of a template with rows inserted above the table and columns inserted on its left."""
+    return [["notes"]] * inserted_rows + [[None] * inserted_cols + list(row) for row in rows]
+
+
+@pytest.fixture(autouse=True)
+def templates(monkeypatch):
+    monkeypatch.setattr(layout_detection, "_templates", {})
+    monkeypatch.setattr(layout_detection, "_fingerprints_path", None)
+    monkeypatch.setattr(layout_detection, "_stats", dict.fromkeys(layout_detection._stats, 0))
+
+
+@pytest.mark.parametrize("layout, inserted_rows, inserted_cols, expected", [
+    ("ff", 0, 0, (7, 1)), ("ff", 2, 3, (9, 4)), ("analytical", 0, 0, (4, 0)), ("analytical", 1, 2, (5, 2)),
+])
+def test_scan_finds_the_table(layout, inserted_rows, inserted_cols, expected):
+    _region = _moved(ROWS[layout](5, 6), inserted_rows, inserted_cols)
+    _layout, _first_row, _skip_cols, _columns = layout_detection.scan(_region, [layout])
+    assert (_layout, _first_row, _skip_cols) == (layout, *expected)
+
+
+def test_anchor_that_is_not_the_first_column():
+    # the first column of the analytical table has no header: the table still starts one column left of the timestamp
+    _region = [["Analytical results"], [], [], [], [None, "Spalte_Compiling_Timestamp", "Result 0"]]
+    assert layout_detection.scan(_region, ["analytical"])[:3] == ("analytical", 4, 0)
+    # the timestamp can't be the first column of the sheet
+    assert layout_detection.scan([["Spalte_Compiling_Timestamp", "Result 0"]], ["analytical"]) is None
+
+
+@pytest.mark.parametrize("layout", ["ff", "analytical"])
+def test_moved_template_converts_like_its_layout(layout):
+    _rows = list(ROWS[layout](30, 8))
+    _detected, _detection = layout_detection.detect(_workbook(_moved(_rows, 2, 1)), layout, "moved.xlsx")
+    assert (_detected.startswith(f"{layout}@"), _detection) == (True, "scanned")
+    _expected = transform_layout(read_layout(_workbook(_rows), layout, "openpyxl"), layout)
+    _converted = transform_layout(read_layout(_workbook(_moved(_rows, 2, 1)), _detected, "openpyxl"), _detected)
+    assert _converted.to_csv() == _expected.to_csv()
+
+    # the same template is known from its fingerprint
+    assert layout_detection.detect(_workbook(_moved(_rows, 2, 1)), layout, "moved.xlsx") == (_detected, "known")
+
+
+def test_layout_without_anchors_is_not_read(monkeypatch, caplog):
+    _reads = []
+    _read_region = layout_detection.read_region
+    monkeypatch.setattr(layout_detection, "read_region", lambda *args: _reads.append(args[1:]) or _read_region(*args))
+    with caplog.at_level(logging.INFO):
+        assert layout_detection.detect(_workbook(ROWS["fb"](5, 5)), "fb", "run_DIL_01.xlsx") == ("fb", "undetected")
+    assert _reads == [] and "No template detected" not in caplog.text
+    assert layout_detection.stats()["templates_undetected"] == 1
+
+
+def test_workbook_is_read_once(monkeypatch):
+    _reads = []
+    _read_region = layout_detection.read_region
+    monkeypatch.setattr(layout_detection, "read_region", lambda *args: _reads.append(args[1:]) or _read_region(*args))
+    _content = _workbook(_moved(ROWS["ff"](5, 5), 1, 2))
+    assert layout_detection.detect(_content, "ff", "moved.xlsx")[1] == "scanned"
+    assert layout_detection.detect(_content, "ff", "moved.xlsx")[1] == "known"
+    assert _reads == [(layout_detection.SCAN_ROWS, layout_detection.SCAN_COLS)] * 2
+
+
+def test_concurrent_workers_keep_each_other_templates(monkeypatch, storage):
+    storage.patch(layout_detection)
+    monkeypatch.setattr(layout_detection, "_fingerprints_path", "templates")
+    storage.put("templates", "fingerprints.json", b'{"a": {"first_seen": "1"}}')
+    _download = layout_detection.download_blob_version
+
+    def download_then_save(*args, **kwargs):
+        # another worker saves its template between our read and our write
+        _read = _download(*args, **kwargs)
+        if "b" not in json.loads(storage.get("templates", "fingerprints.json")):
+            storage.put("templates", "fingerprints.json", b'{"a": {"first_seen": "1"}, "b": {"first_seen": "2"}}')
+        return _read
+
+    monkeypatch.setattr(layout_detection, "download_blob_version", download_then_save)
+    layout_detection._save("c", {"first_seen": "3"})
+    assert set(json.loads(storage.get("templates", "fingerprints.json"))) == {"a", "b", "c"}
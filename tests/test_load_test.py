@@ -0,0 +1,79 @@
+import json
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.load_test import output_file, percentile, regressions, run_level, worker_pids
+
+
+class _Route(BaseHTTPRequestHandler):
+    """Stand-in of a route of the Functions host: every third request is rejected by the admission control."""
+
+    requests = 0
+    bodies = []
+
+    def do_POST(self):
+        _body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        _Route.bodies.append(_body)
+        _Route.requests += 1
+        _status = 429 if _Route.requests % 3 == 0 else 200
+        self.send_response(_status)
+        self.end_headers()
+        self.wfile.write(json.dumps({"input_file": _body["input_file"]}).encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def route():
+    _server = ThreadingHTTPServer(("127.0.0.1", 0), _Route)
+    _thread = threading.Thread(target=_server.serve_forever, daemon=True)
+    _thread.start()
+    yield f"http://127.0.0.1:{_server.server_address[1]}/api/http-parse-to-csv"
+    _server.shutdown()
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert [percentile(list(range(1, 101)), percent) for percent in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert percentile([3.0], 99) == 3.0
+
+
+def test_run_level(route):
+    _workbooks = [
+        {"input_file": name, "output_file": output_file(name, "csv"), "bytes": 2**20}
+        for name in ("run_STOV_01.xlsx", "run_DIL_01.xlsx")
+    ]
+    _level = run_level(route, _workbooks, 2, 0.5, {"input_path": "input", "output_path": "output"}, 5, r"(?!)")
+    assert _level["requests"] > 0 and _level["requests"] == _level["succeeded"] + _level["errors"].get("429", 0)
+    assert 0 < _level["error_rate"] < 1 and set(_level["errors"]) == {"429"}
+    assert _level["p50_s"] <= _level["p95_s"] <= _level["p99_s"] <= _level["max_s"]
+    assert _level["conversions_per_min"] > 0
+
+    # the output binding of the routes is {output_path}/{output_file}, every request names its output
+    assert all(
+        {"input_path", "input_file", "output_path", "output_file"} <= set(body) for body in _Route.bodies
+    )
+    assert {body["output_file"] for body in _Route.bodies} == {"run_STOV_01.csv", "run_DIL_01.csv"}
+
+
+def test_worker_pids_include_the_children():
+    _child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)  # load-test-worker"])
+    try:
+        assert _child.pid in worker_pids("load-test-worker")
+    finally:
+        _child.kill()
+        _child.wait()
+
+
+def test_regressions():
+    _baseline = {"levels": [{"concurrency": 4, "p95_s": 1.0, "conversions_per_min": 100, "error_rate": 0.0}]}
+    _level = {"concurrency": 4, "p95_s": 1.05, "conversions_per_min": 98, "error_rate": 0.005}
+    assert regressions([_level], _baseline, 10) == []
+    assert regressions([{**_level, "concurrency": 8, "p95_s": 9}], _baseline, 10) == []
+    _worse = regressions([{**_level, "p95_s": 1.5, "conversions_per_min": 50, "error_rate": 0.2}], _baseline, 10)
+    assert len(_worse) == 3
@@ -0,0 +1,125 @@
+import datetime
+import gzip
+import io
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from shared_code.layouts import read_layout, transform_layout
+from shared_code.outputs import (
+    content_settings, digest_options, extension, resolve_compression_level, resolve_output, typed_frame, unique_names,
+    write_output
+)
+from tests.conftest import golden_bytes
+
+
+@pytest.mark.parametrize("output_format, output_compression, expected", [
+    (None, None, ("csv", "none")), ("parquet", None, ("parquet", "snappy")), ("parquet", "none", ("parquet", "none"))
+])
+def test_resolve_output(output_format, output_compression, expected):
+    assert resolve_output(output_format, output_compression) == expected
+
+
+@pytest.mark.parametrize("output_format, output_compression", [("xlsx", None), ("parquet", "rar"), ("csv", "snappy")])
+def test_resolve_output_rejects_unknown_options(output_format, output_compression):
+    with pytest.raises(ValueError):
+        resolve_output(output_format, output_compression)
+
+
+def test_typed_frame_has_one_type_per_column():
+    _df = pd.DataFrame({
+        "number": [1, 2.5, None], "bool": [True, None, False], "date": [datetime.datetime(2024, 5, 1), None, None],
+        "mixed": [1, "a", True], "empty": [None, None, None],
+    }, dtype=object)
+    _df.columns = ["a", "a", None, 3, "a"]
+    _typed = typed_frame(_df)
+    assert list(_typed.columns) == ["a", "a.1", "", "3", "a.2"]
+    assert [str(dtype) for dtype in _typed.dtypes] == ["float64", "boolean", "datetime64[us]", "object", "float64"]
+    assert list(_typed.iloc[:, 3]) == ["1", "a", "True"]
+
+
+def test_unique_names():
+    assert unique_names(["x", float("nan"), 1]) == ["x", "", "1"]
+    assert unique_names(["x", "x", "x"]) == ["x", "x.1", "x.2"]
+
+
+@pytest.mark.parametrize("layout", ["fb", "ff", "analytical"])
+@pytest.mark.parametrize("output_compression", ["snappy", "zstd", "none"])
+def test_parquet_output_holds_the_table(golden, layout, output_compression):
+    _df = transform_layout(read_layout(golden(f"{layout}.xlsx"), layout, "openpyxl"), layout)
+    _buffer = io.BytesIO()
+    write_output(_df, _buffer, "parquet", output_compression)
+    _file = pq.ParquetFile(io.BytesIO(_buffer.getvalue()))
+    _codec = _file.metadata.row_group(0).column(0).compression
+    assert _codec == {"none": "UNCOMPRESSED"}.get(output_compression, output_compression.upper())
+    _read = _file.read().to_pandas()
+    assert _read.shape == _df.shape
+    # the parquet values are the csv values once typed
+    _typed = typed_frame(_df)
+    pd.testing.assert_frame_equal(_read, _typed, check_dtype=False, check_index_type=False, check_names=False)
+    assert {str(dtype) for dtype in _read.dtypes} <= {"float64", "boolean", "datetime64[us]", "str"}
+
+
+def test_extension():
+    assert extension("parquet", "snappy") == ".parquet"
+    assert extension("csv", "none") == ".csv"
+    assert extension("csv", "gzip") == ".csv.gz"
+    assert extension("csv", "zstd") == ".csv.zst"
+
+
+@pytest.mark.parametrize("output_compression, encoding", [("none", None), ("gzip", "gzip"), ("zstd", "zstd")])
+def test_content_encoding_of_the_csv_output(output_compression, encoding):
+    _settings = content_settings("csv", output_compression)
+    assert (_settings.content_type, _settings.content_encoding) == ("text/csv; charset=utf-8", encoding)
+    assert content_settings("parquet", "gzip").content_encoding is None
+
+
+@pytest.mark.parametrize("output_compression, level, expected", [
+    ("gzip", None, None), ("gzip", "fast", 1), ("gzip", "small", 9), ("zstd", "balanced", 3), ("zstd", 22, 22),
+    ("brotli", 0, 0), ("none", None, None),
+])
+def test_resolve_compression_level(output_compression, level, expected):
+    assert resolve_compression_level(output_compression, level) == expected
+
+
+@pytest.mark.parametrize("output_compression, level", [
+    ("gzip", 10), ("zstd", 0), ("gzip", "tiny"), ("gzip", True), ("gzip", 1.5), ("none", 1), ("snappy", "fast"),
+])
+def test_resolve_compression_level_rejects_invalid_levels(output_compression, level):
+    with pytest.raises(ValueError):
+        resolve_compression_level(output_compression, level)
+
+
+def test_compression_level_changes_the_digest():
+    assert digest_options("csv", "gzip") != digest_options("csv", "gzip", 1)
+
+
+@pytest.mark.parametrize("layout", ["fb", "ff", "analytical"])
+def test_compressed_csv_output_is_the_golden_csv(layout):
+    import zstandard
+
+    _df = transform_layout(read_layout(golden_bytes(f"{layout}.xlsx"), layout, "openpyxl"), layout)
+    _sizes = {}
+    for output_compression, level in [("gzip", 1), ("gzip", 9), ("zstd", 1), ("zstd", 19)]:
+        _buffer = io.BytesIO()
+        write_output(_df, _buffer, "csv", output_compression, level)
+        _sizes[output_compression, level] = len(_buffer.getvalue())
+        if output_compression == "gzip":
+            _content = gzip.decompress(_buffer.getvalue())
+        else:
+            _content = zstandard.ZstdDecompressor().decompressobj().decompress(_buffer.getvalue())
+        assert _content == golden_bytes(f"{layout}.csv")
+    # the higher level trades CPU for size
+    assert _sizes["gzip", 9] <= _sizes["gzip", 1] and _sizes["zstd", 19] <= _sizes["zstd", 1]
+    assert _sizes["gzip", 9] < len(golden_bytes(f"{layout}.csv")) / 2
+
+
+def test_gzip_output_is_identical_from_one_conversion_to_the_next():
+    _df = transform_layout(read_layout(golden_bytes("ff.xlsx"), "ff", "openpyxl"), "ff")
+    _outputs = []
+    for _ in range(2):
+        _buffer = io.BytesIO()
+        write_output(_df, _buffer, "csv", "gzip")
+        _outputs.append(_buffer.getvalue())
+    assert _outputs[0] == _outputs[1]
@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from shared_code import parsed_cache
+from shared_code.parsed_cache import SingleFlight, TableCache
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    _calls = []
+    _flights = SingleFlight()
+    _started = threading.Event()
+
+    def work():
+        _calls.append(1)
+        _started.set()
+        time.sleep(0.1)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        _leader = executor.submit(_flights.do, "key", work)
+        _started.wait()
+        _followers = [executor.submit(_flights.do, "key", work) for _ in range(3)]
+        assert _leader.result() == ("result", False)
+        assert [future.result() for future in _followers] == [("result", True)] * 3
+    assert len(_calls) == 1
+    # the next call after the flight runs again
+    assert _flights.do("key", work) == ("result", False)
+
+
+def test_single_flight_shares_the_exception():
+    with pytest.raises(ValueError):
+        SingleFlight().do("key", lambda: (_ for _ in ()).throw(ValueError("parse failed")))
+
+
+def _table(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({"a": range(rows)}, dtype="int64")
+
+
+def test_table_cache_evicts_the_least_recently_used():
+    _size = int(_table(100).memory_usage(index=True, deep=True).sum())
+    _cache = TableCache(max_bytes=2 * _size)
+    _cache.put("first", _table(100))
+    _cache.put("second", _table(100))
+    assert _cache.get("first") is not None
+    _cache.put("third", _table(100))
+    assert "first" in _cache and "third" in _cache and "second" not in _cache
+    _cache.put("large", _table(1000))
+    assert "large" not in _cache
+
+
+def test_cached_tables_are_copies():
+    _cache = TableCache(max_bytes=2**20)
+    _cache.put("key", _table(10))
+    _copy = _cache.get("key")
+    _copy.iloc[0, 0] = 99
+    assert _cache.get("key").iloc[0, 0] == 0
+
+
+def test_read_table_parses_a_workbook_once(golden):
+    _loads = []
+
+    def load_content():
+        _loads.append(1)
+        return golden("fb.xlsx")
+
+    _hash = parsed_cache.content_hash(golden("fb.xlsx"))
+    _first, _status = parsed_cache.read_table(load_content, _hash, "fb", "openpyxl")
+    assert _status == "miss"
+    assert parsed_cache.is_cached(_hash, "fb", "openpyxl")
+    _second, _status = parsed_cache.read_table(load_content, _hash, "fb", "openpyxl")
+    assert _status == "hit" and len(_loads) == 1
+    pd.testing.assert_frame_equal(_first, _second)
+
+
+def test_etags_are_remembered():
+    _source = ("connection", "input", "table.xlsx")
+    parsed_cache.remember_etag(_source, '"1"', "hash")
+    assert parsed_cache.hash_for_etag(_source, '"1"') == "hash"
+    assert parsed_cache.hash_for_etag(_source, '"2"') is None
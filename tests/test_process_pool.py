@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from shared_code import process_pool
+from tests.conftest import golden_bytes
+
+
+def _no_warm_up():
+    pass
+
+
+def _sleeping_convert(shm_name, size, layout, *args):
+    """Stand-in of the conversion of the pool: write the pid, sleep for the seconds given as layout."""
+    process_pool._attach(shm_name, size)
+    with open(os.environ["PARSE_POOL_TEST_PIDS"], "a") as pids:
+        pids.write(f"{os.getpid()}\n")
+    time.sleep(float(layout))
+    return {"output": b"", "head": "[]", "rows": 0}
+
+
+def _dying_convert(shm_name, size, *args):
+    os._exit(1)
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # a killed child not reaped yet is a zombie
+    with open(f"/proc/{pid}/stat") as stat:
+        return stat.read().split(")")[-1].split()[0] != "Z"
+
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    """A parse pool of 2 processes without warm-up, the pids of the conversions are written to a file."""
+    monkeypatch.setattr(process_pool, "_workers", 2)
+    monkeypatch.setattr(process_pool, "_timeout", 5)
+    monkeypatch.setattr(process_pool, "_executor", None)
+    monkeypatch.setattr(process_pool, "_initialize", _no_warm_up)
+    monkeypatch.setattr(process_pool, "_stats", dict.fromkeys(process_pool._stats, 0))
+    monkeypatch.setenv("PARSE_POOL_TEST_PIDS", str(tmp_path / "pids"))
+    yield tmp_path / "pids"
+    if process_pool._executor is not None:
+        process_pool._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def test_conversion_of_the_pool_is_the_golden_csv(pool):
+    _result = process_pool.convert(golden_bytes("ff.xlsx"), "ff", "openpyxl", "csv", "none")
+    assert (_result["output"], _result["rows"]) == (golden_bytes("ff.csv"), 57)
+    _result = process_pool.convert(b"not a workbook", "ff", "openpyxl", "csv", "none")
+    assert _result["error"] == "read"
+    assert {key: value for key, value in process_pool.stats().items() if key != "parse_pool_workers"} == {
+        "parse_pool_submitted": 2, "parse_pool_completed": 1, "parse_pool_failed": 1, "parse_pool_restarts": 0
+    }
+
+
+def test_timed_out_conversion_is_killed(pool, monkeypatch):
+    monkeypatch.setattr(process_pool, "_convert", _sleeping_convert)
+    _results = {}
+
+    def convert(name: str, seconds: float):
+        try:
+            _results[name] = process_pool.convert(b"workbook", str(seconds), "openpyxl", "csv", "none")
+        except Exception as e:
+            _results[name] = e
+
+    # the short conversion runs in the other process of the pool when the long one is killed
+    _long = threading.Thread(target=convert, args=("long", 60))
+    _long.start()
+    time.sleep(3)
+    _short = threading.Thread(target=convert, args=("short", 3))
+    _short.start()
+    _long.join(30)
+    _short.join(30)
+
+    assert isinstance(_results["long"], TimeoutError)
+    assert _results["short"] == {"output": b"", "head": "[]", "rows": 0}
+    _pids = [int(pid) for pid in pool.read_text().split()]
+    assert len(_pids) == 3 and not _is_alive(_pids[0])
+    _stats = process_pool.stats()
+    assert (_stats["parse_pool_completed"], _stats["parse_pool_failed"], _stats["parse_pool_restarts"]) == (1, 1, 1)
+
+
+def test_dead_process_fails_the_conversion(pool, monkeypatch):
+    monkeypatch.setattr(process_pool, "_convert", _dying_convert)
+    with pytest.raises(BrokenProcessPool):
+        process_pool.convert(b"workbook", "ff", "openpyxl", "csv", "none")
+    _stats = process_pool.stats()
+    assert (_stats["parse_pool_failed"], _stats["parse_pool_restarts"]) == (1, 1)
+    assert process_pool._executor is None
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from blueprints import http_parse_to_csv_batch as batch
+from shared_code import http_conversion, result_cache
+from tests.conftest import golden_bytes
+
+
+def test_digest_changes_with_the_options():
+    _digest = result_cache.compute_digest("hash", "fb", output_format="csv")
+    assert _digest == result_cache.compute_digest("hash", "fb", output_format="csv")
+    assert _digest != result_cache.compute_digest("other", "fb", output_format="csv")
+    assert _digest != result_cache.compute_digest("hash", "ff", output_format="csv")
+    assert _digest != result_cache.compute_digest("hash", "fb", output_format="parquet")
+
+
+@pytest.mark.parametrize("setting, force, enabled", [
+    (None, False, True), ("false", False, False), ("0", False, False), ("true", True, False)
+])
+def test_is_enabled(monkeypatch, setting, force, enabled):
+    if setting is None:
+        monkeypatch.delenv("RESULT_CACHE", raising=False)
+    else:
+        monkeypatch.setenv("RESULT_CACHE", setting)
+    assert result_cache.is_enabled(force) is enabled
+
+
+def test_lookup_checks_the_digest_and_the_output(storage):
+    storage.patch(result_cache)
+    assert result_cache.lookup("output", "table.csv", "digest") is None
+    storage.put("output", "table.csv", b"a,b\n")
+    result_cache.record("output", "table.csv", "digest", 4, "input", "table.xlsx")
+    assert json.loads(storage.get("output/_manifest", "table.csv.json"))["input_file"] == "table.xlsx"
+    assert result_cache.lookup("output", "table.csv", "digest")["output_size"] == 4
+    assert result_cache.lookup("output", "table.csv", "other") is None
+    # an output changed or deleted since the conversion is converted again
+    storage.put("output", "table.csv", b"a,b\n1,2\n")
+    assert result_cache.lookup("output", "table.csv", "digest") is None
+    del storage.blobs[("output", "table.csv")]
+    assert result_cache.lookup("output", "table.csv", "digest") is None
+
+
+def test_storage_errors_are_cache_misses(storage, monkeypatch):
+    def fail(*args, **kwargs):
+        raise ConnectionError("storage is down")
+
+    monkeypatch.setattr(result_cache, "download_blob", fail)
+    monkeypatch.setattr(result_cache, "upload_blob", fail)
+    assert result_cache.lookup("output", "table.csv", "digest") is None
+    result_cache.record("output", "table.csv", "digest", 4, "input", "table.xlsx")
+
+
+def test_unchanged_workbook_is_not_converted_again(storage, monkeypatch):
+    monkeypatch.setenv("RESULT_CACHE", "true")
+    storage.patch(batch)
+    storage.patch(http_conversion)
+    storage.patch(result_cache)
+    storage.put("input", "run_DIL_01.xlsx", golden_bytes("fb.xlsx"))
+    _item = {"input_path": "input", "input_file": "run_DIL_01.xlsx", "output_path": "output"}
+
+    assert batch.convert_item(dict(_item), "openpyxl")["cache"] == "miss"
+    assert batch.convert_item(dict(_item), "openpyxl")["cache"] == "hit"
+    assert batch.convert_item(dict(_item), "openpyxl", output_format="parquet")["cache"] == "miss"
+    assert batch.convert_item(dict(_item, force=True), "openpyxl")["cache"] == "disabled"
+    assert storage.get("output", "run_DIL_01.csv") == golden_bytes("fb.csv")
@@ -0,0 +1,82 @@
+import base64
+import gc
+
+import pytest
+
+from shared_code.storage import BlockBlobWriter
+
+
+class RecordingBlobClient:
+    """Block blob client keeping the staged blocks and the committed blob in memory."""
+
+    def __init__(self, fail_on_block: int = None):
+        self.staged = {}
+        self.committed = None
+        self._fail_on_block = fail_on_block
+
+    def stage_block(self, block_id, data, length):
+        if len(self.staged) == self._fail_on_block:
+            raise RuntimeError("stage failed")
+        self.staged[block_id] = bytes(data)
+
+    def commit_block_list(self, blocks, content_settings=None):
+        self.committed = b"".join(self.staged[block.id] for block in blocks)
+
+
+def test_blocks_are_committed_in_order():
+    _client = RecordingBlobClient()
+    with BlockBlobWriter(_client, block_size=4, max_concurrency=2) as writer:
+        for _ in range(10):
+            writer.write(b"abc")
+    assert _client.committed == b"abc" * 10
+    assert writer.size == 30
+    assert len(_client.staged) == 8
+
+
+def test_empty_output_commits_an_empty_blob():
+    _client = RecordingBlobClient()
+    with BlockBlobWriter(_client, block_size=4):
+        pass
+    assert _client.committed == b""
+
+
+def test_block_ids_are_unique_per_writer():
+    _client = RecordingBlobClient()
+    for _ in range(2):
+        with BlockBlobWriter(_client, block_size=4) as writer:
+            writer.write(b"12345678")
+    _ids = [base64.b64decode(block_id) for block_id in _client.staged]
+    assert len(_ids) == 4
+    assert len({len(block_id) for block_id in _ids}) == 1
+    assert len({block_id.split(b"-")[0] for block_id in _ids}) == 2
+
+
+def test_error_in_the_with_block_does_not_commit():
+    _client = RecordingBlobClient()
+    with pytest.raises(RuntimeError):
+        with BlockBlobWriter(_client, block_size=4) as writer:
+            writer.write(b"12345678")
+            raise RuntimeError("serialization failed")
+    assert _client.committed is None
+
+
+def test_collected_writer_does_not_commit():
+    _client = RecordingBlobClient()
+    writer = BlockBlobWriter(_client, block_size=4)
+    writer.write(b"123456")
+    del writer
+    gc.collect()
+    assert _client.committed is None
+
+
+def test_failed_block_is_never_committed():
+    _client = RecordingBlobClient(fail_on_block=1)
+    writer = BlockBlobWriter(_client, block_size=2, max_concurrency=1)
+    with pytest.raises(RuntimeError):
+        writer.write(b"123456")
+    with pytest.raises(OSError):
+        writer.write(b"78")
+    with pytest.raises(OSError):
+        writer.close()
+    assert _client.committed is None
+    assert writer.closed
@@ -0,0 +1,39 @@
+import io
+
+import pytest
+from openpyxl import Workbook
+
+from benchmarks.workbooks import fb_rows
+from shared_code.excel_engines import ENGINES
+from shared_code.layouts import read_layout, transform_layout
+from shared_code.outputs import write_output
+from shared_code.transposed_reader import read_fb
+from tests.make_golden import _with_edges, baseline_fb
+
+
+def _workbook(rows) -> bytes:
+    _workbook = Workbook()
+    for row in rows:
+        _workbook.active.append(row)
+    _buffer = io.BytesIO()
+    _workbook.save(_buffer)
+    return _buffer.getvalue()
+
+
+def test_golden_fb_is_read_column_wise(golden):
+    assert read_fb(golden("fb.xlsx")) is not None
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+@pytest.mark.parametrize("seed", range(8))
+def test_fb_matches_the_baseline(engine, seed):
+    _blob = _workbook(_with_edges(fb_rows(6 + seed, 5 + seed, seed=seed), 4, 7, seed=100 + seed))
+    try:
+        _expected = baseline_fb(_blob)
+    except Exception as e:
+        with pytest.raises(type(e)):
+            transform_layout(read_layout(_blob, "fb", engine), "fb")
+        return
+    _buffer = io.BytesIO()
+    write_output(transform_layout(read_layout(_blob, "fb", engine), "fb"), _buffer, "csv", "none")
+    assert _buffer.getvalue() == _expected
@@ -0,0 +1,65 @@
+import datetime
+import json
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from shared_code import http_conversion
+from shared_code.validation import _kind, validate_workbook
+from tests.conftest import GOLDEN, ROOT, OutputBinding, golden_bytes, http_request, input_stream
+
+
+@pytest.mark.parametrize("engine", ["sheetxml", "openpyxl", "calamine"])
+@pytest.mark.parametrize("layout", ["fb", "ff", "analytical"])
+def test_schema_of_the_golden_workbooks(layout, engine):
+    _validation = validate_workbook(golden_bytes(f"{layout}.xlsx"), layout, engine)
+    _expected = pd.read_csv(f"{GOLDEN}/{layout}.csv")
+    assert (_validation["valid"], _validation["problems"]) == (True, [])
+    # the first column of the CSV is the index
+    assert [column["name"] for column in _validation["schema"]] == list(_expected.columns[1:])
+    # the rows dropped by the conversion are counted by the estimate
+    assert _validation["estimated_rows"] >= len(_expected)
+    if layout == "fb":
+        assert _validation["estimated_rows"] == len(_expected)
+
+
+def test_missing_header_is_a_problem():
+    _validation = validate_workbook(golden_bytes("ff.xlsx"), "analytical")
+    assert not _validation["valid"]
+    assert "'Spalte_Compiling_Timestamp' is missing" in _validation["problems"][0]
+
+
+@pytest.mark.parametrize("values, kind", [
+    ([1, 2.5], "number"), (["a", " "], "text"), ([datetime.datetime(2024, 1, 2), datetime.date(2024, 1, 2)], "datetime"),
+    ([True, False], "bool"), ([1, "a"], "mixed"), ([True, 1], "mixed"), ([None, "NA", "#N/A", float("nan")], "empty"),
+    ([], "empty"),
+])
+def test_kind_of_the_sampled_values(values, kind):
+    assert _kind(values) == kind
+
+
+def test_validation_does_not_import_pandas():
+    _code = (
+        "import sys; from shared_code.validation import validate_workbook; "
+        f"validate_workbook(open({GOLDEN + '/ff.xlsx'!r}, 'rb').read(), 'ff'); "
+        "assert 'pandas' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", _code], cwd=ROOT, check=True)
+
+
+@pytest.mark.parametrize("input_file, content, problem", [
+    ("run_STOV_01.xlsx", b"", "Failed to read blob: Blob content is empty"),
+    ("run_STOV_01.xlsx", b"not a workbook", "INPUT FILE CAN'T BE LOADED: File is not a zip file"),
+    ("run_XYZ_01.xlsx", golden_bytes("ff.xlsx"), "The input file is not a valid file for this function"),
+])
+def test_invalid_workbooks_are_reported(input_file, content, problem):
+    _outputblob = OutputBinding()
+    _response = http_conversion.convert_request(
+        http_request({"input_path": "input", "input_file": input_file, "output_path": "output", "mode": "validate"}),
+        input_stream(content), _outputblob
+    )
+    _result = json.loads(_response.get_body())
+    assert (_response.status_code, _result["valid"], _result["message"]) == (200, False, "INVALID")
+    assert _result["problems"] == [problem] and _outputblob.value is None
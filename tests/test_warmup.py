@@ -0,0 +1,22 @@
+import subprocess
+import sys
+
+from shared_code.layouts import LAYOUTS
+from shared_code.warmup import warm_up
+from tests.conftest import ROOT
+
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "pyarrow", "python_calamine", "azure.storage.blob")
+
+
+def test_function_app_does_not_import_the_heavy_libraries():
+    _loaded = subprocess.run(
+        [sys.executable, "-c", f"import sys, function_app; print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert _loaded == "[]"
+
+
+def test_warm_up_runs_every_layout():
+    _timings = warm_up("openpyxl", ["csv", "parquet"])
+    for layout in LAYOUTS:
+        assert {f"{layout}_parse", f"{layout}_csv", f"{layout}_parquet"} <= set(_timings)